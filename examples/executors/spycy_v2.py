@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+import sys
+
+from spycy import spycy
+
+from rainbow.protocol import serve
+
+if __name__ == "__main__":
+    exe = spycy.CypherExecutor()
+
+    def execute(query: str):
+        if query.startswith("CREATE") or query == "RETURN 0":
+            exe.exec(query)
+            return None
+        return exe.exec(query).to_dict("records")
+
+    serve(execute, sys.stdin.buffer, sys.stdout.buffer)
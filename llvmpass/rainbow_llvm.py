@@ -14,6 +14,12 @@ from lark import Lark
 from rainbow.config import Config
 from rainbow.scope import Scope
 
+# Look up the enum values once so the inner loop compares integers. llvmcpy's
+# enums map names to values and values to names.
+ALLOCA = cllvm.Opcode["Alloca"]
+CALL = cllvm.Opcode["Call"]
+STRUCT_TYPE_KIND = cllvm.TypeKind["StructTypeKind"]
+
 
 @dataclass
 class AnnotatedFn:
@@ -28,26 +34,57 @@ class RainbowLLVM:
     module: cllvm.Module
     config: Config
     logger: logging.Logger = field(default_factory=lambda: logging.Logger("rainbow"))
+    # Values of the constant global strings read so far
+    strings: dict[str, str] = field(default_factory=dict)
 
-    def decode_name(self,  name: str):
-        """Demangle C++ symbols"""
+    def cxxfilt(self, names: list[str]) -> list[str]:
+        """The lines c++filt prints for `names`, one per line"""
         p = subprocess.Popen(["c++filt"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        out = p.communicate(name.encode())
-        return out[0].decode()
+        out = p.communicate("".join(f"{name}\n" for name in names).encode())
+        return out[0].decode().splitlines()
+
+
+    def decode_names(self, names: list[str]) -> dict[str, str]:
+        """Demangle C++ symbols, all with the same c++filt process as long as
+        it prints one line per symbol"""
+        demangled = self.cxxfilt(names)
+        if len(demangled) != len(names):
+            self.logger.warning(
+                f"c++filt returned {len(demangled)} lines for {len(names)} "
+                "symbols, demangling them one at a time"
+            )
+            demangled = []
+            for name in names:
+                lines = self.cxxfilt([name])
+                demangled.append(lines[0] if len(lines) == 1 else name)
+        return dict(zip(names, demangled))
 
 
     def const_str_glbl(self, glbl: str, remove_prefix: bool=False) -> str:
         """Retrive the value of a constant global string"""
-        a = self.module.get_named_global(glbl).get_initializer().get_as_string()[:-1]
+        if glbl not in self.strings:
+            glbl_value = self.module.get_named_global(glbl)
+            self.strings[glbl] = glbl_value.get_initializer().get_as_string()[:-1]
+        a = self.strings[glbl]
         if remove_prefix and self.config.prefix in a:
             return a[len(self.config.prefix) :]
         return a
 
 
-    def get_iptr(self, inst) -> str:
-        """Get the hex representation of the underlying pointer for an
-        instruction - this can be used as a UID for the instruction"""
-        return str(inst.ptr[0]).split()[-1][:-1]
+    def get_iptr(self, inst) -> int:
+        """Get the address of the underlying instruction - this can be used as
+        a UID for the instruction"""
+        # llvmcpy declares uintptr_t as a 32 bit int, which truncates
+        return int(cllvm.ffi.cast("intptr_t", inst.ptr[0]))
+
+
+    def is_lambda(self, alloca) -> bool:
+        """Whether an alloca instruction allocates a lambda's closure"""
+        allocated = alloca.get_allocated_type()
+        if allocated.get_kind() != STRUCT_TYPE_KIND:
+            return False
+        struct_name = allocated.get_struct_name()
+        return struct_name is not None and struct_name.startswith(b"class.anon")
 
 
     def parse_annotations(self, annotations: str) -> dict[str, AnnotatedFn]:
@@ -104,39 +141,50 @@ class RainbowLLVM:
 
         annotations = annotations.get_initializer().print_value_to_string().decode()
         annotated_module_fns = self.parse_annotations(annotations)
-        for fn in self.module.iter_functions():
+        # Intrinsics aren't part of the call graph, calls to them are only
+        # checked for annotations
+        fns = [
+            fn
+            for fn in self.module.iter_functions()
+            if not fn.name.startswith(b"llvm.")
+        ]
+        demangled = self.decode_names([fn.name.decode() for fn in fns])
+        for fn in fns:
             # Need to check if the fn is linked in
             # TODO get param colors
             fn_name = fn.name.decode()
             # TODO pass in filename/line numbers?
+            color = None
             if fn_name in annotated_module_fns:
-                Scope.create_function(
-                    scope_id,
-                    root_scope,
-                    self.decode_name(fn_name),
-                    annotated_module_fns[fn_name].attributes[0],
-                    {},
-                )
-            else:
-                Scope.create_function(scope_id, root_scope, self.decode_name(fn_name), None, {})
-
-        for fn in self.module.iter_functions():
-            fn_scope = root_scope.resolve_function(self.decode_name(fn.name.decode()))
+                color = annotated_module_fns[fn_name].attributes[0]
+            Scope.create_function(scope_id, root_scope, demangled[fn_name], color, {})
+
+        # Calls are looked up by their mangled name
+        fn_scopes = {
+            fn.name: root_scope.resolve_function(demangled[fn.name.decode()])
+            for fn in fns
+        }
+
+        for fn in fns:
+            if fn.is_declaration():
+                continue
+            fn_scope = fn_scopes[fn.name]
             assert fn_scope
             scope_id += 1
-            llvm_fn = self.module.get_named_function(fn.name.decode())
             inst_to_color = {}
             lambdas = set()
-            for bb in llvm_fn.iter_basic_blocks():
+            for bb in fn.iter_basic_blocks():
                 for inst in bb.iter_instructions():
-                    opcode = cllvm.Opcode[inst.instruction_opcode]
-                    if opcode == "Alloca":
-                        parts = inst.print_value_to_string().decode().split()
-                        if parts[3].startswith("%class.anon"):
+                    opcode = inst.instruction_opcode
+                    if opcode == ALLOCA:
+                        if self.is_lambda(inst):
                             lambdas.add(self.get_iptr(inst))
-                    elif opcode == "Call":
+                    elif opcode == CALL:
                         called_fn = inst.get_operand(inst.get_num_arg_operands())
-                        if called_fn.name.decode().startswith("llvm.var.annotation"):
+                        called_name = called_fn.name
+                        if called_name.startswith(b"llvm."):
+                            if not called_name.startswith(b"llvm.var.annotation"):
+                                continue
                             # llvm.var.annotation is a hint to analyzers to annotate a particular
                             # instruction
                             annotated_obj = inst.get_operand(0)
@@ -147,9 +195,9 @@ class RainbowLLVM:
                             inst_to_color[iptr] = color
                             # TODO set parameter colors here
                         else:
-                            callee_name = self.decode_name(called_fn.name.decode())
-                            callee = root_scope.resolve_function(callee_name)
+                            callee = fn_scopes.get(called_name)
                             if callee:
+                                callee_name = callee.name
                                 # This should be safe because it's a lambda defined
                                 # in this method
                                 if callee_name.endswith("::operator()() const"):
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import rainbow.protocol as protocol
+
+Table = Optional[List[Dict[str, Any]]]
+
+# What reading from or writing to an executor that exited raises
+EXECUTOR_ERRORS = (
+    asyncio.IncompleteReadError,
+    ConnectionError,
+    ValueError,
+    protocol.ProtocolError,
+)
+
+# v1 results are single lines of any length, which asyncio's default limit of
+# 64 KiB per line would turn into errors
+STREAM_LIMIT = 2**31
+
+
+@dataclass
+class AsyncExecutor:
+    """An executor subprocess driven with asyncio. Speaks either version of the
+    executor protocol, see rainbow/protocol.py"""
+
+    process: asyncio.subprocess.Process
+    version: int
+    encoding: str = "json"
+    _next_id: int = 0
+
+    @classmethod
+    async def start(cls, executor: Path, source: Path, version: int) -> "AsyncExecutor":
+        process = await asyncio.create_subprocess_exec(
+            executor,
+            source,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            # So that kill() also reaches processes started by the executor
+            start_new_session=True,
+            limit=STREAM_LIMIT,
+        )
+        result = AsyncExecutor(process, version)
+        if version == protocol.PROTOCOL_VERSION:
+            try:
+                await result._handshake()
+            except EXECUTOR_ERRORS:
+                await result.abandon()
+                raise
+        return result
+
+    def _write_frame(self, message: Dict[str, Any], encoding: str):
+        assert self.process.stdin
+        payload = protocol.encode(message, encoding)
+        self.process.stdin.write(protocol.HEADER.pack(len(payload)) + payload)
+
+    async def _read_frame(self, encoding: str) -> Dict[str, Any]:
+        assert self.process.stdout
+        header = await self.process.stdout.readexactly(protocol.HEADER.size)
+        (size,) = protocol.HEADER.unpack(header)
+        return protocol.decode(await self.process.stdout.readexactly(size), encoding)
+
+    async def _handshake(self):
+        assert self.process.stdin
+        hello = {
+            "type": "hello",
+            "protocol": protocol.PROTOCOL_VERSION,
+            "encodings": protocol.supported_encodings(),
+        }
+        self._write_frame(hello, "json")
+        await self.process.stdin.drain()
+        reply = await self._read_frame("json")
+        if reply.get("encoding") not in hello["encodings"]:
+            raise protocol.ProtocolError(f"Unexpected handshake from executor: {reply}")
+        self.encoding = reply["encoding"]
+
+    async def query(self, query: protocol.Query, limit: Optional[int] = None) -> Table:
+        assert self.process.stdin and self.process.stdout
+        if self.version != protocol.PROTOCOL_VERSION:
+            for chunk in [query] if isinstance(query, str) else query():
+                self.process.stdin.write(chunk.encode())
+                await self.process.stdin.drain()
+            self.process.stdin.write(b"\n--\n")
+            await self.process.stdin.drain()
+            return json.loads((await self.process.stdout.readline()).decode())
+
+        id_ = self._next_id
+        self._next_id += 1
+        for piece in protocol.query_frame(id_, query, limit, self.encoding):
+            self.process.stdin.write(piece)
+            await self.process.stdin.drain()
+
+        rows: Table = None
+        while True:
+            reply = await self._read_frame(self.encoding)
+            if reply.get("id") != id_:
+                raise protocol.ProtocolError(
+                    f"Unexpected message from executor: {reply}"
+                )
+            if reply["type"] == "rows":
+                if rows is None:
+                    rows = []
+                rows.extend(reply["rows"])
+            elif reply["type"] == "done":
+                return rows
+            else:
+                return None
+
+    async def close(self):
+        assert self.process.stdin
+        self.process.stdin.close()
+        await self.process.wait()
+
+    def kill(self):
+        if self.process.returncode is None:
+            os.killpg(self.process.pid, signal.SIGKILL)
+
+    async def abandon(self):
+        """Kill the executor, e.g. after it failed or timed out"""
+        self.kill()
+        await self.process.wait()
+
+
+async def run_queries(
+    executor: Path,
+    source: Path,
+    version: int,
+    concurrency: int,
+    create: protocol.Query,
+    queries: List[str],
+    timeout: Optional[float] = None,
+    limit: Optional[int] = None,
+    logger: Optional[logging.Logger] = None,
+    timeouts: Optional[List[Optional[float]]] = None,
+    timings: Optional[Dict[int, float]] = None,
+) -> List[Table]:
+    """Start `concurrency` executors, load the graph into all of them with
+    `create`, and spread `queries` across them in order. A query that doesn't
+    finish within `timeout` seconds (or its entry in `timeouts`) has an unknown
+    (None) result, and the executor running it is killed. So is an executor
+    that exits or sends garbage, leaving its query unknown. The results, and
+    the seconds every query took in `timings`, are indexed like `queries`.
+    Executors that fail to start or to load the graph are left out."""
+    logger = logger or logging.getLogger("rainbow")
+
+    async def start() -> Optional[AsyncExecutor]:
+        try:
+            return await AsyncExecutor.start(executor, source, version)
+        except (OSError, *EXECUTOR_ERRORS) as err:
+            logger.warning(f"Executor failed to start: {err!r}")
+            return None
+
+    started = await asyncio.gather(*(start() for _ in range(concurrency)))
+    executors = [e for e in started if e is not None]
+
+    async def load(e: AsyncExecutor) -> bool:
+        try:
+            await e.query(create)
+            return True
+        except EXECUTOR_ERRORS as err:
+            logger.warning(f"Executor failed to load the graph: {err!r}")
+            await e.abandon()
+            return False
+
+    loaded = await asyncio.gather(*(load(e) for e in executors))
+    executors = [e for e, ok in zip(executors, loaded) if ok]
+
+    # Queries nobody got to, because every executor timed out or failed, stay
+    # unknown
+    results: List[Table] = [None] * len(queries)
+    pending = list(reversed(range(len(queries))))
+
+    async def worker(e: AsyncExecutor):
+        while len(pending) > 0:
+            i = pending.pop()
+            query = queries[i]
+            query_timeout = timeout
+            if timeouts and timeouts[i] is not None:
+                query_timeout = timeouts[i]
+            start = time.perf_counter()
+            try:
+                results[i] = await asyncio.wait_for(
+                    e.query(query, limit), query_timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Query timed out after {query_timeout}s: {query}")
+                # The executor is still busy with the query, don't reuse it
+                await e.abandon()
+                return
+            except EXECUTOR_ERRORS as err:
+                logger.warning(f"Executor failed on query: {query}: {err!r}")
+                await e.abandon()
+                return
+            finally:
+                if timings is not None:
+                    timings[i] = time.perf_counter() - start
+        await e.close()
+
+    await asyncio.gather(*(worker(e) for e in executors))
+    return results
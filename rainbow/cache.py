@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import clang.cindex
+from clang.cindex import Diagnostic
+
+
+@functools.cache
+def _libclang_version() -> str:
+    """The serialized AST format is only stable for a single libclang build"""
+    # The bindings don't wrap clang_getClangVersion, so this needs their
+    # private string type
+    cx_string = getattr(clang.cindex, "_CXString", None)
+    if cx_string is not None:
+        try:
+            fn = clang.cindex.conf.lib.clang_getClangVersion
+            fn.restype = cx_string
+            fn.errcheck = cx_string.from_result
+            return fn()
+        except (AttributeError, TypeError):
+            pass
+    # Fall back to identifying the shared library itself
+    library = clang.cindex.conf.lib._name
+    try:
+        stat = os.stat(library)
+    except OSError:
+        return library
+    return f"{library}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _hash_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+@dataclass
+class ASTCache:
+    """Cache of serialized libclang translation units.
+
+    Every entry is keyed by the source file's path, contents and the compiler
+    flags used to parse it. The manifest stored alongside each AST records the
+    hashes of every included file, and the entry is only reused if none of them
+    have changed. It can be shared by threads, only parsing runs concurrently."""
+
+    root: Path
+    max_size: Optional[int] = None
+    max_age: Optional[float] = None
+    logger: logging.Logger = field(default_factory=lambda: logging.Logger("cache"))
+
+    hits: int = 0
+    misses: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _key(self, path: str, args: List[str]) -> Optional[str]:
+        content_hash = _hash_file(path)
+        if content_hash is None:
+            return None
+        key = json.dumps(
+            [os.path.abspath(path), content_hash, args, _libclang_version()]
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _load(self, index: clang.cindex.Index, key: str):
+        manifest_path = self.root / f"{key}.json"
+        ast_path = self.root / f"{key}.ast"
+        if not manifest_path.exists() or not ast_path.exists():
+            return None
+
+        try:
+            with manifest_path.open() as f:
+                includes: Dict[str, str] = dict(json.load(f)["includes"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.logger.warning("Could not read AST cache manifest %s" % manifest_path)
+            return None
+        for include, include_hash in includes.items():
+            if _hash_file(include) != include_hash:
+                self.logger.info("AST cache entry for %s is stale" % include)
+                return None
+
+        try:
+            tu = index.read(str(ast_path))
+        except clang.cindex.TranslationUnitLoadError:
+            self.logger.warning("Could not load cached AST %s" % ast_path)
+            return None
+
+        # Bump the modification time so that eviction is least-recently-used
+        now = time.time()
+        os.utime(manifest_path, (now, now))
+        os.utime(ast_path, (now, now))
+        return tu
+
+    def _store(self, key: str, tu: clang.cindex.TranslationUnit):
+        for diag in tu.diagnostics:
+            if diag.severity >= Diagnostic.Error:
+                # Don't cache invalid ASTs, we want to report the errors again
+                return
+
+        includes = {}
+        for include in tu.get_includes():
+            name = include.include.name
+            if (include_hash := _hash_file(name)) is not None:
+                includes[name] = include_hash
+
+        ast_path = self.root / f"{key}.ast"
+        tmp_path = self.root / f"{key}.{os.getpid()}.tmp"
+        try:
+            tu.save(str(tmp_path))
+        except clang.cindex.TranslationUnitSaveError:
+            self.logger.warning("Could not save AST of %s to the cache" % tu.spelling)
+            tmp_path.unlink(missing_ok=True)
+            return
+        os.replace(tmp_path, ast_path)
+
+        manifest_path = self.root / f"{key}.json"
+        tmp_path = self.root / f"{key}.{os.getpid()}.json.tmp"
+        with tmp_path.open("w") as f:
+            json.dump({"source": tu.spelling, "includes": includes}, f)
+        os.replace(tmp_path, manifest_path)
+
+    def evict(self):
+        """Remove entries older than `max_age` seconds, then remove the least
+        recently used entries until the cache is smaller than `max_size` bytes"""
+        entries = []
+        for ast_path in self.root.glob("*.ast"):
+            manifest_path = ast_path.with_suffix(".json")
+            try:
+                stat = ast_path.stat()
+                size = stat.st_size
+                if manifest_path.exists():
+                    size += manifest_path.stat().st_size
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, size, ast_path, manifest_path))
+        entries.sort()
+
+        now = time.time()
+        total_size = sum(size for _, size, _, _ in entries)
+        for mtime, size, ast_path, manifest_path in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_size is not None and total_size > self.max_size
+            if not expired and not too_big:
+                continue
+            self.logger.debug("Evicting %s from AST cache" % ast_path)
+            manifest_path.unlink(missing_ok=True)
+            ast_path.unlink(missing_ok=True)
+            total_size -= size
+
+    def parse(
+        self, index: clang.cindex.Index, path: str, args: Optional[List[str]] = None
+    ) -> clang.cindex.TranslationUnit:
+        """Drop-in replacement for `index.parse` that reuses cached ASTs"""
+        args = args or []
+        key = self._key(path, args)
+        if key is not None:
+            with self._lock:
+                tu = self._load(index, key)
+                if tu:
+                    self.hits += 1
+            if tu:
+                self.logger.debug("Loaded %s from AST cache" % path)
+                return tu
+
+        tu = index.parse(path, args)
+        with self._lock:
+            self.misses += 1
+            if key is not None:
+                self._store(key, tu)
+                self.evict()
+        return tu
+
+
+@functools.cache
+def rainbow_version() -> str:
+    """The installed version of rainbow, and a hash of its sources for
+    development checkouts whose version doesn't change"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        result = version("rainbow_aneeshdurg")
+    except PackageNotFoundError:
+        result = "unknown"
+    sources = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        sources.update(path.read_bytes())
+    return f"{result}+{sources.hexdigest()[:16]}"
+
+
+# (logger name relative to the config's logger, level, message)
+Message = Tuple[str, int, str]
+
+
+class MessageRecorder(logging.Handler):
+    """Records the messages logged by a config and its patterns, so that they
+    can be replayed when a verdict is reused"""
+
+    def __init__(self, root: logging.Logger, loggers: List[logging.Logger]):
+        super().__init__()
+        self.root = root
+        self.loggers = loggers
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        # Records of child loggers can propagate to `root` as well
+        if not any(r is record for r in self.records):
+            self.records.append(record)
+
+    def __enter__(self) -> "MessageRecorder":
+        for logger in self.loggers:
+            logger.addHandler(self)
+        return self
+
+    def __exit__(self, *args):
+        for logger in self.loggers:
+            logger.removeHandler(self)
+
+    def messages(self) -> List[Message]:
+        result = []
+        for record in self.records:
+            name = record.name[len(self.root.name) + 1 :]
+            result.append((name, record.levelno, record.getMessage()))
+        return result
+
+
+def replay(root: logging.Logger, messages: List[Message]):
+    for name, level, msg in messages:
+        logger = root.getChild(name) if name else root
+        logger.log(level, msg)
+
+
+@dataclass
+class VerdictCache:
+    """Verdicts and messages of earlier runs. Keyed by everything that can
+    change the outcome of a run: see `Config.verdict_key`."""
+
+    root: Path
+    logger: logging.Logger = field(default_factory=lambda: logging.Logger("cache"))
+
+    hits: int = 0
+    misses: int = 0
+
+    def __post_init__(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Tuple[bool, List[Message]]]:
+        path = self.root / f"{key}.verdict.json"
+        try:
+            with path.open() as f:
+                data = json.load(f)
+            verdict = data["verdict"]
+            messages = [tuple(m) for m in data["messages"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return verdict, messages
+
+    def put(self, key: str, verdict: bool, messages: List[Message]):
+        path = self.root / f"{key}.verdict.json"
+        tmp_path = self.root / f"{key}.{os.getpid()}.verdict.tmp"
+        with tmp_path.open("w") as f:
+            json.dump({"verdict": verdict, "messages": messages}, f)
+        os.replace(tmp_path, path)
+
+
+@dataclass
+class CostHistory:
+    """Seconds every pattern took on earlier runs, keyed by
+    `Config.pattern_key`. Used to run cheap patterns first."""
+
+    path: Path
+    costs: Dict[str, float] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "CostHistory":
+        try:
+            with path.open() as f:
+                costs = json.load(f)
+        except (OSError, ValueError):
+            costs = {}
+        return CostHistory(path, costs)
+
+    def cost(self, key: str) -> float:
+        """Patterns that never ran cost nothing, so that they are measured"""
+        return self.costs.get(key, 0.0)
+
+    def record(self, key: str, seconds: float):
+        # Average with the previous cost to smooth out noisy runs
+        if key in self.costs:
+            seconds = (self.costs[key] + seconds) / 2
+        self.costs[key] = seconds
+
+    def save(self):
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("w") as f:
+            json.dump(self.costs, f)
+        os.replace(tmp_path, self.path)
@@ -1,13 +1,26 @@
+import concurrent.futures
+import dataclasses
+import hashlib
+import itertools
 import json
 import logging
+import re
 import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-
-from spycy import spycy
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
+from rainbow.cache import (CostHistory, MessageRecorder, VerdictCache,
+                           rainbow_version, replay)
+from rainbow.executors import (Executor, ExecutorFactory, SpycyExecutor,
+                               find_executor)
+from rainbow.graph import Graph, Reachability
+from rainbow.protocol import (PROTOCOL_VERSION, ExecutorConnection, Query,
+                              ResultStream)
 from rainbow.scope import Scope
 
 
@@ -33,18 +46,158 @@ def get_string(config: Dict[str, Any], key: str) -> str:
     return result
 
 
+class _Abandoned(Exception):
+    """A pattern ran over its timeout on an executor that can't be
+    interrupted, see `Config._fetch_in_thread`"""
+
+
+class _PartLogger(logging.Logger):
+    """The logger of a part of `Config.run_components`. Neither it nor its
+    children are registered with `logging` or propagate to other loggers, so
+    that what every part logs can be recorded separately."""
+
+    def __init__(self, name: str, level: int):
+        super().__init__(name, level)
+        self.propagate = False
+
+    def getChild(self, suffix: str) -> logging.Logger:
+        child = logging.Logger(f"{self.name}.{suffix}")
+        child.parent = self
+        return child
+
+
+# Fingerprints of the call graph components (see `Graph.fingerprint`) that are
+# known not to match a pattern, keyed by `Config.pattern_key`
+CleanComponents = Dict[str, Set[str]]
+
+# Node patterns such as `(x:RED:BLUE {name: 'main'})`
+_NODE_RE = re.compile(
+    r"\(\s*(?:\w+|`[^`]*`)?\s*(?P<labels>(?::\s*(?:\w+|`[^`]*`)\s*)*)"
+    + r"(?P<props>\{[^}]*\})?\s*\)"
+)
+_LABEL_RE = re.compile(r":\s*(\w+|`[^`]*`)")
+# Matched after string literals are replaced, see `_without_strings`
+_NAME_RE = re.compile(r"\bname\s*:\s*'(\d+)'")
+_STRING_RE = re.compile(r"`[^`]*`" + r"|'(?:[^'\\]|\\.)*'" + r'|"(?:[^"\\]|\\.)*"')
+_CLAUSE_RE = re.compile(r"\b(?:WHERE|MATCH|WITH|UNION|CALL|OPTIONAL)\b", re.IGNORECASE)
+_CHAIN_RE = r"^\s*\[\s*\w+\s+IN\s+nodes\(\s*{path}\s*\)\s*\|"
+
+
+def _without_strings(pattern: str) -> Tuple[str, List[Optional[str]]]:
+    """`pattern` with every string literal replaced by `'<index>'`, so that
+    their contents can't be mistaken for clauses or labels, and the values of
+    the literals. Literals with escape sequences have no value."""
+    strings: List[Optional[str]] = []
+
+    def replace(m: re.Match) -> str:
+        literal = m.group(0)
+        if literal.startswith("`"):
+            return literal
+        strings.append(None if "\\" in literal else literal[1:-1])
+        return f"'{len(strings) - 1}'"
+
+    return _STRING_RE.sub(replace, pattern), strings
+
+
+def required_labels_and_names(pattern: str) -> Tuple[Set[str], Set[str]]:
+    """Labels and names that some node must have for `pattern` to match.
+    Only node patterns before `WHERE` are considered, labels and patterns in
+    the WHERE clause can be negated."""
+    pattern, strings = _without_strings(pattern)
+    if m := _CLAUSE_RE.search(pattern):
+        if m.group(0).upper() != "WHERE":
+            # Not a single MATCH pattern, we can't tell what it needs
+            return set(), set()
+        pattern = pattern[: m.start()]
+    labels: Set[str] = set()
+    names: Set[str] = set()
+    for node in _NODE_RE.finditer(pattern):
+        for label in _LABEL_RE.findall(node.group("labels")):
+            labels.add(label.strip("`"))
+        if props := node.group("props"):
+            for index in _NAME_RE.findall(props):
+                if (name := strings[int(index)]) is not None:
+                    names.add(name)
+    return labels, names
+
+
+def chain_projections(
+    pattern: str,
+    on_match: Optional[Dict[str, str]],
+    error_msg: Optional[str],
+    witness: Optional[int],
+) -> Optional[List[str]]:
+    """The `on_match` variables that list the nodes of the path, if `pattern`
+    can run against a contracted call graph (see `Graph.contract`), otherwise
+    None. That is the case if it only asks whether a colored function reaches
+    another one, and nothing but the nodes of the path is projected."""
+    reach = Reachability.parse(pattern)
+    if reach is None or reach.source is None or reach.sink is None:
+        return None
+    if witness is not None:
+        return []
+    if error_msg and not on_match:
+        # Every row holds the whole path
+        return None
+    chains = []
+    for var, value in (on_match or {}).items():
+        if reach.path is None:
+            continue
+        if re.match(_CHAIN_RE.format(path=reach.path), value, re.IGNORECASE):
+            chains.append(var)
+        elif re.search(rf"\b{reach.path}\b", value):
+            return None
+    return chains
+
+
 class Pattern:
     match_pattern: str
     on_match: Optional[Dict[str, str]]
     error_msg: Optional[str]
+    witness: Optional[int]
+    reachability: Optional[Reachability]
+    # Report at most this many matches
+    max_messages: Optional[int]
+    # Seconds after which the result is unknown, overrides `executor_timeout`
+    timeout: Optional[float]
+    # Every match contains nodes with these colors and names
+    required_labels: Set[str]
+    required_names: Set[str]
+    # `on_match` variables holding call chains, None if the pattern can't run
+    # against a contracted call graph, see `chain_projections`
+    chain_vars: Optional[List[str]]
 
-    def __init__(self, pattern: str, on_match=None, error_msg=None):
+    def __init__(
+        self,
+        pattern: str,
+        on_match=None,
+        error_msg=None,
+        witness=None,
+        max_messages=None,
+        timeout=None,
+    ):
         self.match_pattern = pattern
         self.on_match = on_match
         self.error_msg = error_msg
+        self.witness = witness
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.required_labels, self.required_names = required_labels_and_names(pattern)
+        self.chain_vars = chain_projections(pattern, on_match, error_msg, witness)
+        self.reachability = None
+        if witness is not None:
+            self.reachability = Reachability.parse(pattern)
+            if self.reachability is None:
+                raise AssertionError(
+                    f"witness mode is only supported for reachability patterns: {pattern}"
+                )
+            if self.error_msg is None:
+                self.error_msg = "Found invalid callchain: %chain"
 
-    def _assemble_query(self) -> str:
-        projections = "count(*) > 0 as invalidcalls"
+    def assemble_query(self) -> str:
+        # Without a message we only need to know if there is any match, which
+        # lets the executor stop at the first one
+        projections = "true as invalidcalls LIMIT 1"
         if self.on_match:
             projection_frags = []
             for k, v in self.on_match.items():
@@ -52,26 +205,90 @@ class Pattern:
             projections = "DISTINCT " + ", ".join(projection_frags)
         elif self.error_msg:
             projections = "*"
+        if self.error_msg and self.max_messages is not None:
+            projections += f" LIMIT {self.max_messages}"
         return f"MATCH {self.match_pattern} RETURN {projections}"
 
-    def run(self, logger, executor):
-        result = executor(self._assemble_query())
-        return self.error_handler(logger, result)
+    def is_connected(self) -> bool:
+        """Whether every match lies within one weakly connected component of
+        the call graph. Only false for patterns made of several comma
+        separated parts, such as `(a:RED), (b:BLUE)`."""
+        depth = 0
+        for c in self.match_pattern:
+            if c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+            elif c == "," and depth == 0:
+                return False
+        return True
+
+    def _find_witnesses(self, graph: Graph) -> List[Dict[str, Any]]:
+        """Report one shortest violating chain per (source, sink) pair instead
+        of every distinct path"""
+        assert self.reachability
+        table = []
+        for path in graph.shortest_witnesses(self.reachability, self.witness):
+            path = graph.expand(path)
+            table.append(
+                {
+                    "chain": [n.display() for n in path],
+                    "source": path[0].name,
+                    "sink": path[-1].name,
+                }
+            )
+        return table
+
+    def run(self, logger, executor, graph: Graph):
+        return self.report(logger, self.fetch(executor, graph), graph)
+
+    def fetch(self, executor, graph: Graph):
+        """The matches of the pattern, None if they are unknown"""
+        if self.reachability:
+            return self._find_witnesses(graph)
+        if isinstance(executor, Executor):
+            return executor.run_pattern(self)
+        return executor(self.assemble_query())
+
+    def report(self, logger, result, graph: Graph) -> Optional[bool]:
+        """Report the matches returned by `fetch`, see `error_handler`"""
+        rows = result
+        if result is not None and graph.shortcuts and self.chain_vars:
+            rows = (self._expand_chains(row, graph) for row in result)
+        verdict = self.error_handler(logger, rows)
+        if isinstance(result, ResultStream) and result.failed:
+            # The executor failed after sending some of the rows
+            return None
+        return verdict
+
+    def _expand_chains(self, row: Dict[str, Any], graph: Graph) -> Dict[str, Any]:
+        assert self.chain_vars
+        row = dict(row)
+        for var in self.chain_vars:
+            chain = row.get(var)
+            if isinstance(chain, list) and all(isinstance(n, str) for n in chain):
+                row[var] = graph.expand_names(chain)
+        return row
 
     def error_handler(
-        self, logger: logging.Logger, table: List[Dict[str, Any]]
+        self, logger: logging.Logger, table: Optional[Iterable[Dict[str, Any]]]
     ) -> Optional[bool]:
+        """Report the rows of `table`. Rows are read one at a time, and only as
+        many as are needed."""
         if table is None:
             return None
 
         if self.error_msg:
-            for row in table:
+            found = False
+            for row in itertools.islice(table, self.max_messages):
                 msg = self.error_msg
                 for var, value in row.items():
                     msg = msg.replace(f"%{var}", str(value))
                 logger.error(msg)
-            return len(table) > 0
-        return table[0]["invalidcalls"]
+                found = True
+            return found
+        first = next(iter(table), None)
+        return first is not None and bool(first["invalidcalls"])
 
 
 @dataclass
@@ -81,7 +298,33 @@ class Config:
     patterns: List[Pattern]
     prefix: str = "COLOR::"
     executor: Optional[Path] = None
+    # Version of the protocol spoken with `executor`, see rainbow/protocol.py
+    executor_protocol: int = 1
+    # Maximum number of rows an executor returns per pattern (protocol 2 only)
+    executor_row_limit: Optional[int] = None
+    # Number of executor subprocesses to spread the patterns across
+    executor_concurrency: int = 1
+    # Seconds after which a pattern's result is considered unknown
+    executor_timeout: Optional[float] = None
+    # In-process executor used if `executor` is not set, see rainbow/executors.py
+    executor_plugin: ExecutorFactory = SpycyExecutor
+    executor_options: Dict[str, Any] = field(default_factory=dict)
     logger: logging.Logger = field(default_factory=lambda: logging.Logger("confifg"))
+    # Reuse the verdict of earlier runs on an identical call graph
+    verdict_cache: Optional[VerdictCache] = None
+    # Stop at the first pattern that finds errors
+    fail_fast: bool = False
+    # Run the patterns that were cheapest on earlier runs first
+    cost_history: Optional[CostHistory] = None
+    # Evaluate groups of weakly connected components of the call graph in this
+    # many threads, see `run_components`
+    component_workers: int = 1
+    # Merge function aliases into the function they alias, see
+    # `Graph.collapse`
+    collapse_aliases: bool = False
+    # Remove uncolored functions from the call graph if every pattern only
+    # checks reachability between colored functions, see `Graph.contract`
+    contract_chains: bool = False
 
     @classmethod
     def from_dict(
@@ -93,19 +336,46 @@ class Config:
         """Convert a dictionary to a config"""
         colors = get_list_of_strings(config, "colors")
 
+        def get_max_messages(obj: Dict[str, Any], default: Optional[int]):
+            value = obj.get("max_messages", default)
+            if value is not None and (type(value) != int or value < 1):
+                raise AssertionError("max_messages must be a positive integer")
+            return value
+
+        max_messages = get_max_messages(config, None)
+
         # TODO error checking
         patterns_raw = config["patterns"]
         patterns = []
         for pattern_obj in patterns_raw:
             if type(pattern_obj) == str:
-                patterns.append(Pattern(pattern_obj))
+                patterns.append(Pattern(pattern_obj, max_messages=max_messages))
             else:
                 match_pattern = pattern_obj["pattern"]
                 on_match = pattern_obj.get("on_match")
                 error_msg = pattern_obj.get("msg")
                 if on_match:
                     assert error_msg
-                patterns.append(Pattern(match_pattern, on_match, error_msg))
+                witness = pattern_obj.get("witness")
+                if witness is not None:
+                    if type(witness) != int or witness < 1:
+                        raise AssertionError("witness must be a positive integer")
+                    if on_match:
+                        raise AssertionError("witness and on_match are exclusive")
+                timeout = pattern_obj.get("timeout")
+                if timeout is not None:
+                    if type(timeout) not in [int, float] or timeout <= 0:
+                        raise AssertionError("timeout must be a positive number")
+                patterns.append(
+                    Pattern(
+                        match_pattern,
+                        on_match,
+                        error_msg,
+                        witness,
+                        get_max_messages(pattern_obj, max_messages),
+                        timeout,
+                    )
+                )
 
         result = Config(source, colors, patterns)
         if logger:
@@ -118,6 +388,52 @@ class Config:
             if not executor.exists() or not shutil.which(executor):
                 raise AssertionError(f"Could not find executable at {executor}")
             result.executor = executor
+        if "executor_plugin" in config:
+            if "executor" in config:
+                raise AssertionError("executor and executor_plugin are exclusive")
+            result.executor_plugin = find_executor(
+                get_string(config, "executor_plugin")
+            )
+        if "executor_options" in config:
+            options = config["executor_options"]
+            if not isinstance(options, dict):
+                raise AssertionError("executor_options must be an object")
+            result.executor_options = options
+        if "executor_protocol" in config:
+            protocol = config["executor_protocol"]
+            if protocol not in [1, PROTOCOL_VERSION]:
+                raise AssertionError(f"Unsupported executor_protocol: {protocol}")
+            result.executor_protocol = protocol
+        if "executor_row_limit" in config:
+            limit = config["executor_row_limit"]
+            if type(limit) != int or limit < 1:
+                raise AssertionError("executor_row_limit must be a positive integer")
+            if result.executor_protocol != PROTOCOL_VERSION:
+                raise AssertionError("executor_row_limit requires executor_protocol 2")
+            result.executor_row_limit = limit
+        if "executor_concurrency" in config:
+            concurrency = config["executor_concurrency"]
+            if type(concurrency) != int or concurrency < 1:
+                raise AssertionError("executor_concurrency must be a positive integer")
+            result.executor_concurrency = concurrency
+        if "executor_timeout" in config:
+            timeout = config["executor_timeout"]
+            if type(timeout) not in [int, float] or timeout <= 0:
+                raise AssertionError("executor_timeout must be a positive number")
+            result.executor_timeout = timeout
+        if "collapse_aliases" in config:
+            if type(config["collapse_aliases"]) != bool:
+                raise AssertionError("collapse_aliases must be a boolean")
+            result.collapse_aliases = config["collapse_aliases"]
+        if "contract_chains" in config:
+            if type(config["contract_chains"]) != bool:
+                raise AssertionError("contract_chains must be a boolean")
+            result.contract_chains = config["contract_chains"]
+        if "component_workers" in config:
+            workers = config["component_workers"]
+            if type(workers) != int or workers < 1:
+                raise AssertionError("component_workers must be a positive integer")
+            result.component_workers = workers
 
         return result
 
@@ -130,49 +446,556 @@ class Config:
             config = json.load(f)
         return Config.from_dict(source, config, logger)
 
-    def execute_queries(self, create_query: str, executor) -> Optional[bool]:
-        executor(create_query)
-        invalid = []
+    def pattern_timeout(self, pattern: Pattern) -> Optional[float]:
+        if pattern.timeout is not None:
+            return pattern.timeout
+        return self.executor_timeout
+
+    def missing_requirement(self, pattern: Pattern, graph: Graph) -> Optional[str]:
+        """Why `pattern` can't match `graph`, if the graph lacks a color or a
+        name that the pattern requires"""
+        for label in sorted(pattern.required_labels):
+            if graph.label_count(label) == 0:
+                return f"no {label} functions"
+        for name in sorted(pattern.required_names):
+            if graph.name_count(name) == 0:
+                return f"no functions named {name}"
+        return None
+
+    def schedule(self, graph: Graph) -> List[int]:
+        """Indices of the patterns that can match `graph`, in the order they
+        are run: cheapest first according to `cost_history`, otherwise in the
+        order of the config"""
+        order = [
+            i
+            for i, pattern in enumerate(self.patterns)
+            if self.missing_requirement(pattern, graph) is None
+        ]
+        if history := self.cost_history:
+            order.sort(key=lambda i: history.cost(self.pattern_key(self.patterns[i])))
+        return order
+
+    def _run_pattern(self, i: int, executor, graph: Graph) -> Optional[bool]:
+        pattern = self.patterns[i]
+        logger = self.logger.getChild(f"Pattern{i}")
+        timeout = self.pattern_timeout(pattern)
+        if timeout is None or not isinstance(executor, Executor):
+            return pattern.run(logger, executor, graph)
+        if not executor.interruptible:
+            return pattern.report(
+                logger, self._fetch_in_thread(pattern, executor, graph, timeout), graph
+            )
+        timer = threading.Timer(timeout, executor.interrupt)
+        timer.start()
+        try:
+            return pattern.run(logger, executor, graph)
+        finally:
+            timer.cancel()
+
+    def _fetch_in_thread(
+        self, pattern: Pattern, executor: Executor, graph: Graph, timeout: float
+    ):
+        """`pattern.fetch` in a thread that is abandoned after `timeout`
+        seconds, for executors that can't be interrupted"""
+        future: Future = Future()
+
+        def fetch():
+            try:
+                future.set_result(pattern.fetch(executor, graph))
+            except BaseException as e:
+                future.set_exception(e)
+
+        # A daemon thread doesn't keep rainbow from exiting
+        threading.Thread(target=fetch, daemon=True).start()
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise _Abandoned()
+
+    def execute_queries(
+        self,
+        graph: Graph,
+        executor,
+        ran_ahead: Optional[Dict[int, Tuple[Any, float]]] = None,
+    ) -> List[Optional[bool]]:
+        """The result of every pattern, see `Pattern.error_handler`. Patterns
+        run in the order of `schedule`. Patterns that can't match pass without
+        touching the executor. Patterns that run over their timeout, or are
+        skipped by `fail_fast`, have an unknown result. `ran_ahead` holds the
+        rows and seconds taken by patterns that ran ahead of time, by index,
+        see `async_executor`."""
+        invalid: List[Optional[bool]] = [None] * len(self.patterns)
         for i, pattern in enumerate(self.patterns):
-            result = pattern.run(self.logger.getChild(f"Pattern{i}"), executor)
-            invalid.append(result)
-            if result is None:
-                self.logger.warning("Pattern %d returned unknown" % i)
-            elif result:
-                self.logger.warning("Pattern %d found errors" % i)
-            else:
-                self.logger.debug("Pattern %d passed!" % i)
-        return any(invalid) if None not in invalid else None
+            if reason := self.missing_requirement(pattern, graph):
+                self.logger.info(
+                    f"Skipping pattern {i}, the call graph has {reason}",
+                    extra={"pattern": i},
+                )
+                invalid[i] = False
+        order = self.schedule(graph)
+        if len(order) == 0:
+            return invalid
+
+        if isinstance(executor, Executor):
+            executor.load(graph)
+        else:
+            executor(graph.iter_cypher)
+        # Executors that replaced one that is still busy with an abandoned
+        # pattern, see `_fetch_in_thread`
+        replacements: List[Executor] = []
+        try:
+            for n, i in enumerate(order):
+                pattern = self.patterns[i]
+                timeout = self.pattern_timeout(pattern)
+                start = time.perf_counter()
+                abandoned = False
+                try:
+                    if ran_ahead is not None and i in ran_ahead:
+                        rows, elapsed = ran_ahead[i]
+                        logger = self.logger.getChild(f"Pattern{i}")
+                        result = pattern.report(logger, rows, graph)
+                    else:
+                        result = self._run_pattern(i, executor, graph)
+                        elapsed = time.perf_counter() - start
+                except _Abandoned:
+                    abandoned = True
+                    elapsed = time.perf_counter() - start
+                    executor = self.executor_plugin(self, self.executor_options)
+                    replacements.append(executor)
+                    executor.load(graph)
+                # Status lines carry the pattern, see `_merge_parts`
+                status = {"pattern": i}
+                self.logger.info(
+                    f"Pattern {i} took {elapsed:.3f}s",
+                    extra=dict(status, seconds=elapsed),
+                )
+                if self.cost_history is not None:
+                    self.cost_history.record(self.pattern_key(pattern), elapsed)
+                if abandoned or (timeout is not None and elapsed > timeout):
+                    self.logger.warning(f"Pattern {i} timed out after {timeout}s")
+                    result = None
+
+                invalid[i] = result
+                if result is None:
+                    self.logger.warning("Pattern %d returned unknown" % i, extra=status)
+                elif result:
+                    self.logger.warning("Pattern %d found errors" % i, extra=status)
+                    if self.fail_fast and n + 1 < len(order):
+                        skipped = len(order) - n - 1
+                        self.logger.info(
+                            f"Skipping the remaining {skipped} pattern(s)", extra=status
+                        )
+                        break
+                else:
+                    self.logger.debug("Pattern %d passed!" % i, extra=status)
+        finally:
+            for replacement in replacements:
+                replacement.close()
+        return invalid
+
+    def plugin_executor(self, graph: Graph) -> List[Optional[bool]]:
+        """Evaluate queries in-process using `executor_plugin`"""
+        executor = self.executor_plugin(self, self.executor_options)
+        try:
+            return self.execute_queries(graph, executor)
+        finally:
+            executor.close()
+
+    def async_executor(self, graph: Graph) -> List[Optional[bool]]:
+        """Evaluate queries using several subprocesses concurrently"""
+        import asyncio
+
+        from rainbow.async_executor import run_queries
 
-    def spycy_executor(self, create_query: str) -> Optional[bool]:
-        """Evaluate queries using sPyCy"""
-        exe = spycy.CypherExecutor()
-        spycy_exec = lambda q: exe.exec(q).to_dict("records")
-        return self.execute_queries(create_query, spycy_exec)
+        assert self.executor
+        order = [i for i in self.schedule(graph) if not self.patterns[i].reachability]
+        patterns = [self.patterns[i] for i in order]
+        timings: Dict[int, float] = {}
+        results = asyncio.run(
+            run_queries(
+                self.executor,
+                self.source,
+                self.executor_protocol,
+                self.executor_concurrency,
+                graph.iter_cypher,
+                [p.assemble_query() for p in patterns],
+                self.executor_timeout,
+                self.executor_row_limit,
+                self.logger,
+                [p.timeout for p in patterns],
+                timings,
+            )
+        )
+        ran_ahead = {i: (results[n], timings.get(n, 0.0)) for n, i in enumerate(order)}
+        # Reachability patterns don't need the executor
+        return self.execute_queries(graph, lambda q: None, ran_ahead)
 
-    def generic_executor(self, create_query: str) -> Optional[bool]:
+    def generic_executor(self, graph: Graph) -> List[Optional[bool]]:
         """Evaluate queries using a subprocess"""
         assert self.executor
+        has_timeout = any(p.timeout is not None for p in self.patterns)
+        if (
+            self.executor_concurrency > 1
+            or self.executor_timeout is not None
+            or has_timeout
+        ):
+            return self.async_executor(graph)
         p = subprocess.Popen(
             [self.executor, self.source], stdout=subprocess.PIPE, stdin=subprocess.PIPE
         )
+        if self.executor_protocol == PROTOCOL_VERSION:
+            return self._generic_executor_v2(graph, p)
 
-        def run_query(q: str):
-            p.stdin.write(q.encode())
+        def run_query(q: Query):
+            # The CREATE query is written as it is generated, the pipe
+            # blocks us while the executor catches up
+            for chunk in [q] if isinstance(q, str) else q():
+                p.stdin.write(chunk.encode())
             p.stdin.write("\n--\n".encode())
             p.stdin.flush()
             output = p.stdout.readline()
             return json.loads(output.decode())
 
-        result = self.execute_queries(create_query, run_query)
+        result = self.execute_queries(graph, run_query)
         self.logger.debug("Finished query execution, shutting down")
         p.stdin.close()
         p.wait()
         return result
 
+    def _generic_executor_v2(
+        self, graph: Graph, p: subprocess.Popen
+    ) -> List[Optional[bool]]:
+        """Evaluate queries using a subprocess speaking protocol 2. All queries
+        are sent up front, and results are read in the same order."""
+        assert p.stdin and p.stdout
+        conn = ExecutorConnection(p.stdin, p.stdout)
+        conn.handshake()
+        queries: List[Query] = [graph.iter_cypher]
+        queries += [
+            self.patterns[i].assemble_query()
+            for i in self.schedule(graph)
+            if not self.patterns[i].reachability
+        ]
+        conn.submit(queries[:1])
+        conn.submit(queries[1:], self.executor_row_limit)
+
+        result = self.execute_queries(graph, conn.next_result)
+        for error in conn.errors:
+            self.logger.warning(f"Executor error: {error}")
+        self.logger.debug("Finished query execution, shutting down")
+        if conn.outstanding() > 0:
+            # We stopped early, the executor may be blocked on writing results
+            # that we won't read
+            p.kill()
+        conn.close()
+        p.wait()
+        p.stdout.close()
+        return result
+
     def run(self, scope: Scope) -> Optional[bool]:
         """Run the config against the passed in Scope"""
-        create_query = scope.to_cypher()
+        return self.run_graph(Graph.from_scope(scope, self.collapse_aliases))
+
+    def run_graph(self, graph: Graph) -> Optional[bool]:
+        """Run the config against a call graph"""
+        if self.verdict_cache is None:
+            return combine_results(self.run_patterns(graph))
+
+        key = self.verdict_key(graph)
+        if cached := self.verdict_cache.get(key):
+            verdict, messages = cached
+            self.logger.info("Reusing the verdict for an identical call graph")
+            replay(self.logger, messages)
+            return verdict
+
+        loggers = [self.logger]
+        loggers += [
+            self.logger.getChild(f"Pattern{i}") for i in range(len(self.patterns))
+        ]
+        with MessageRecorder(self.logger, loggers) as recorder:
+            results = self.run_patterns(graph)
+        verdict = combine_results(results)
+        # Unknown results can come from timeouts or crashes, don't keep them
+        if verdict is not None and (None not in results or self.fail_fast):
+            self.verdict_cache.put(key, verdict, recorder.messages())
+        return verdict
+
+    def verdict_key(self, graph: Graph) -> str:
+        """Everything that can change the verdict or the messages of a run"""
+        patterns = [
+            [
+                p.match_pattern,
+                p.on_match,
+                p.error_msg,
+                p.witness,
+                p.max_messages,
+                p.timeout,
+            ]
+            for p in self.patterns
+        ]
+        plugin = self.executor_plugin
+        key = [
+            graph.canonical_hash(),
+            self.prefix,
+            self.colors,
+            patterns,
+            str(self.executor) if self.executor else None,
+            f"{plugin.__module__}.{getattr(plugin, '__qualname__', plugin)}",
+            self.executor_options,
+            self.executor_protocol,
+            self.executor_row_limit,
+            self.fail_fast,
+            self.contract_chains,
+            self.logger.getEffectiveLevel(),
+            rainbow_version(),
+        ]
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    def run_patterns(self, graph: Graph) -> List[Optional[bool]]:
+        """Run every pattern against a call graph"""
+        if self.contract_chains:
+            graph = self.contract(graph)
+        if self.component_workers > 1 and all(p.is_connected() for p in self.patterns):
+            results = self.run_components(graph)
+        else:
+            results = self._run_patterns(graph)
+        if self.cost_history is not None:
+            self.cost_history.save()
+        return results
+
+    def contract(self, graph: Graph) -> Graph:
+        """`graph` without its uncolored functions, if none of the patterns
+        needs them and that makes the graph smaller"""
+        if any(p.chain_vars is None for p in self.patterns):
+            self.logger.info("Not contracting the call graph, a pattern needs it all")
+            return graph
+        contracted = graph.contract()
+        size = len(graph.nodes) + len(graph.edges)
+        if len(contracted.nodes) + len(contracted.edges) >= size:
+            return graph
+        self.logger.info(
+            f"Contracted the call graph from {len(graph.nodes)} to "
+            f"{len(contracted.nodes)} functions"
+        )
+        return contracted
+
+    def _run_patterns(self, graph: Graph) -> List[Optional[bool]]:
+        if len(self.schedule(graph)) == 0:
+            # Every pattern can be skipped, don't start an executor
+            return self.execute_queries(graph, None)
         if self.executor:
-            return self.generic_executor(create_query)
-        return self.spycy_executor(create_query)
+            return self.generic_executor(graph)
+        return self.plugin_executor(graph)
+
+    def partition(self, graph: Graph) -> List[Graph]:
+        """Split `graph` into at most `component_workers` graphs of similar
+        size made of whole weakly connected components. Components that no
+        pattern can match are dropped."""
+        components = []
+        for component in graph.components():
+            if any(
+                self.missing_requirement(p, component) is None for p in self.patterns
+            ):
+                components.append(component)
+        components.sort(key=lambda c: len(c.nodes) + len(c.edges), reverse=True)
+
+        parts: List[List[Graph]] = [[] for _ in range(self.component_workers)]
+        sizes = [0] * len(parts)
+        for component in components:
+            smallest = sizes.index(min(sizes))
+            parts[smallest].append(component)
+            sizes[smallest] += len(component.nodes) + len(component.edges)
+        return [Graph.union(part) for part in parts if part]
+
+    def run_components(self, graph: Graph) -> List[Optional[bool]]:
+        """Run every pattern against the parts of `graph` returned by
+        `partition`, each with its own executor in a pool of threads. A match
+        of a connected pattern lies within a single component, so the result
+        of a pattern is the combination of its results on every part. What the
+        parts log and the time they take is merged here, see `_merge_parts`."""
+        parts = self.partition(graph)
+        self.logger.info(
+            f"Evaluating {len(parts)} part(s) of the call graph in parallel"
+        )
+        done: Dict[int, Tuple[List[Optional[bool]], List[logging.LogRecord]]] = {}
+        pool = ThreadPoolExecutor(max_workers=self.component_workers)
+        try:
+            futures = {
+                pool.submit(self._run_part, n, part): n for n, part in enumerate(parts)
+            }
+            for future in as_completed(futures):
+                done[futures[future]] = future.result()
+                if self.fail_fast and any(done[futures[future]][0]):
+                    if len(done) < len(parts):
+                        skipped = len(parts) - len(done)
+                        self.logger.info(f"Skipping the remaining {skipped} part(s)")
+                    break
+        finally:
+            # Parts that are still running when fail_fast stops are left to
+            # finish in the background, nobody waits for them
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        per_part = [done[n][0] for n in sorted(done)]
+        results: List[Optional[bool]] = []
+        for i in range(len(self.patterns)):
+            if len(per_part) < len(parts) and not any(r[i] for r in per_part):
+                # Skipped by fail_fast
+                results.append(None)
+            else:
+                results.append(combine_results([r[i] for r in per_part]))
+        self._merge_parts(graph, [done[n][1] for n in sorted(done)], results)
+        return results
+
+    def _run_part(
+        self, n: int, part: Graph
+    ) -> Tuple[List[Optional[bool]], List[logging.LogRecord]]:
+        """Run every pattern against the `n`th part on a copy of this config,
+        which records what it logs instead of logging it"""
+        logger = _PartLogger(self.logger.name, self.logger.getEffectiveLevel())
+        history = self.cost_history
+        if history is not None:
+            # Only used to schedule the patterns, costs are recorded by
+            # `_merge_parts`
+            history = CostHistory(history.path, dict(history.costs))
+        options = self.executor_options
+        if options.get("path", ":memory:") != ":memory:":
+            # Every part loads its own database
+            options = {**options, "path": f"{options['path']}.{n}"}
+        config = dataclasses.replace(
+            self,
+            logger=logger,
+            verdict_cache=None,
+            cost_history=history,
+            executor_options=options,
+        )
+        with MessageRecorder(logger, [logger]) as recorder:
+            return config._run_patterns(part), recorder.records
+
+    def _merge_parts(
+        self,
+        graph: Graph,
+        records: List[List[logging.LogRecord]],
+        results: List[Optional[bool]],
+    ):
+        """Log what the parts of `run_components` logged, and record what their
+        patterns cost, as if the patterns had run against `graph` at once"""
+        seconds: Dict[int, float] = {}
+        limits = {f"Pattern{i}": p.max_messages for i, p in enumerate(self.patterns)}
+        counts: Dict[str, int] = {}
+        messages = []
+        seen = set()
+        for record in itertools.chain.from_iterable(records):
+            if hasattr(record, "pattern"):
+                # Status lines are logged below, once per pattern
+                if hasattr(record, "seconds"):
+                    i = getattr(record, "pattern")
+                    seconds[i] = seconds.get(i, 0.0) + getattr(record, "seconds")
+                continue
+            name = record.name[len(self.logger.name) + 1 :]
+            message = (name, record.levelno, record.getMessage())
+            if name in limits:
+                # Every part reported up to max_messages matches of the pattern
+                counts[name] = counts.get(name, 0) + 1
+                limit = limits[name]
+                if limit is not None and counts[name] > limit:
+                    continue
+            elif message in seen:
+                continue
+            seen.add(message)
+            messages.append(message)
+        replay(self.logger, messages)
+
+        for i, pattern in enumerate(self.patterns):
+            if i in seconds:
+                self.logger.info(f"Pattern {i} took {seconds[i]:.3f}s")
+                if self.cost_history is not None:
+                    self.cost_history.record(self.pattern_key(pattern), seconds[i])
+            elif reason := self.missing_requirement(pattern, graph):
+                self.logger.info(f"Skipping pattern {i}, the call graph has {reason}")
+                continue
+            if results[i] is None:
+                if i in seconds:
+                    self.logger.warning("Pattern %d returned unknown" % i)
+            elif results[i]:
+                self.logger.warning("Pattern %d found errors" % i)
+            else:
+                self.logger.debug("Pattern %d passed!" % i)
+
+    def pattern_key(self, pattern: Pattern) -> str:
+        """Identifies `pattern` in `CleanComponents`"""
+        return json.dumps([self.prefix, pattern.match_pattern])
+
+    def run_incremental(self, graph: Graph, clean: CleanComponents) -> Optional[bool]:
+        """Run the config against the components of `graph` that may match one
+        of its patterns. A match of a path pattern lies within a single
+        weakly connected component, so components we already know don't match
+        are skipped. `clean` is updated with the results of this run."""
+        if not all(p.is_connected() for p in self.patterns):
+            return self.run_graph(graph)
+        components = graph.components()
+        fingerprints = [c.fingerprint() for c in components]
+        keys = [self.pattern_key(p) for p in self.patterns]
+        dirty = [
+            i
+            for i, fingerprint in enumerate(fingerprints)
+            if fingerprint is None
+            or any(fingerprint not in clean.get(key, ()) for key in keys)
+        ]
+        self.logger.info(
+            f"Evaluating {len(dirty)} of {len(components)} call graph components"
+        )
+
+        # Forget components that no longer exist
+        current = set(fingerprints)
+        for key in keys:
+            clean[key] = clean.get(key, set()) & current
+
+        if len(dirty) == 0:
+            return False
+        results = self.run_patterns(Graph.union([components[i] for i in dirty]))
+        for key, result in zip(keys, results):
+            if result is False:
+                clean[key].update(fingerprints[i] for i in dirty if fingerprints[i])
+        return combine_results(results)
+
+
+def combine_results(results: List[Optional[bool]]) -> Optional[bool]:
+    """True if any result is True, otherwise None if any result is unknown"""
+    if any(results):
+        return True
+    return False if None not in results else None
+
+
+def run_configs(
+    config: Config,
+    extra_configs: List[Config],
+    graph: Graph,
+    clean: Optional[CleanComponents] = None,
+) -> Optional[bool]:
+    """Run `config` and every config in `extra_configs` against the same call
+    graph. The colors of the extra configs are stored as labels on the graph's
+    nodes, see `Rainbow.is_label`.
+
+    If `clean` is passed, only changed parts of the graph are evaluated, see
+    `Config.run_incremental`."""
+
+    def run(c: Config, g: Graph) -> Optional[bool]:
+        if clean is None:
+            return c.run_graph(g)
+        return c.run_incremental(g, clean)
+
+    results = [run(config, graph)]
+    for extra in extra_configs:
+        if config.fail_fast and results[-1]:
+            break
+        if extra.prefix == config.prefix:
+            results.append(run(extra, graph))
+        else:
+            results.append(run(extra, graph.project(extra.prefix)))
+
+    if clean is not None:
+        keys = {c.pattern_key(p) for c in [config] + extra_configs for p in c.patterns}
+        for key in list(clean):
+            if key not in keys:
+                del clean[key]
+    return combine_results(results)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import importlib
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from rainbow.graph import Graph
+
+if TYPE_CHECKING:
+    from rainbow.config import Config, Pattern
+
+ENTRY_POINT_GROUP = "rainbow.executors"
+
+
+class Executor:
+    """An executor that runs in the same process as rainbow.
+
+    Executors are selected with `"executor_plugin": "<name>"` in the config,
+    and are constructed with the config and the `"executor_options"` object
+    from the config. Third party executors are registered under the
+    `rainbow.executors` entry point group."""
+
+    # Whether `interrupt` stops the running pattern
+    interruptible = False
+
+    def __init__(self, config: "Config", options: Dict[str, Any]):
+        self.config = config
+        self.options = options
+
+    def load(self, graph: Graph):
+        """Load the call graph. Called once, before any pattern is run."""
+        raise NotImplementedError()
+
+    def query(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """Run an openCypher query and return the result rows, or None if the
+        result is unknown"""
+        raise NotImplementedError()
+
+    def run_pattern(self, pattern: "Pattern") -> Optional[List[Dict[str, Any]]]:
+        """Run a pattern from the config. Executors that don't speak
+        openCypher can translate `pattern` themselves instead."""
+        return self.query(pattern.assemble_query())
+
+    def interrupt(self):
+        """Called from another thread when the running pattern exceeds its
+        timeout, if `interruptible` is set. `run_pattern` should then return
+        None soon. Patterns of executors that can't be interrupted run in a
+        thread that is abandoned at the timeout, and the remaining patterns
+        use a new executor."""
+        pass
+
+    def close(self):
+        pass
+
+
+class SpycyExecutor(Executor):
+    """Evaluate queries using sPyCy"""
+
+    def load(self, graph: Graph):
+        # sPyCy pulls in pandas, which is slow to import
+        from spycy import spycy
+
+        self.exe = spycy.CypherExecutor()
+        self.exe.exec(graph.to_cypher())
+
+    def query(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        return self.exe.exec(query).to_dict("records")
+
+
+ExecutorFactory = Callable[["Config", Dict[str, Any]], Executor]
+
+# "module:attribute", imported when the executor is first used
+BUILTIN_EXECUTORS: Dict[str, str] = {
+    "spycy": "rainbow.executors:SpycyExecutor",
+    "sqlite": "rainbow.sqlite_executor:SQLiteExecutor",
+}
+
+
+def find_executor(name: str) -> ExecutorFactory:
+    if name in BUILTIN_EXECUTORS:
+        module, attribute = BUILTIN_EXECUTORS[name].split(":")
+        return getattr(importlib.import_module(module), attribute)
+
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == name:
+            return entry_point.load()
+    raise AssertionError(f"Could not find executor plugin {name}")
@@ -0,0 +1,612 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import re
+from collections import Counter, deque
+from dataclasses import dataclass, field, replace
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from rainbow.scope import Scope
+
+
+@dataclass
+class Node:
+    alias: str
+    name: str
+    color: Optional[str] = None
+    is_param: bool = False
+    # Identifies the same function across translation units. Only functions
+    # declared in the global scope (and their parameters) have a key. This is
+    # the function's USR if it has one, otherwise its name.
+    key: Optional[str] = None
+    # Colors from additional configs, keyed by the config's prefix
+    labels: Dict[str, str] = field(default_factory=dict)
+    # Names of aliases that were merged into this node, see `Graph.collapse`
+    aliases: List[str] = field(default_factory=list)
+
+    def has_label(self, label: Optional[str]) -> bool:
+        return label is None or self.color == label
+
+    def display(self) -> str:
+        """Format the node the same way as the chain projections in the
+        examples: `name:COLOR`, or just `name` for uncolored functions"""
+        result = self.name
+        if self.color:
+            result += f":{self.color}"
+        if self.aliases:
+            result += f" (as {', '.join(self.aliases)})"
+        return result
+
+    def to_cypher(self) -> str:
+        color_str = f":{self.color}" if self.color else ""
+        return f"({self.alias}{color_str} {{name: '{self.name}'}})"
+
+
+@dataclass
+class Graph:
+    """Call graph flattened out of a Scope tree"""
+
+    nodes: Dict[str, Node] = field(default_factory=dict)
+    edges: List[Tuple[str, str]] = field(default_factory=list)
+    # Uncolored nodes on a shortest call chain between the two colored nodes
+    # of every edge added by `contract`
+    shortcuts: Dict[Tuple[str, str], List[Node]] = field(default_factory=dict)
+
+    _successors: Optional[Dict[str, List[str]]] = field(
+        default=None, repr=False, compare=False
+    )
+    # Number of nodes with every color and every name
+    _label_counts: Optional[Counter] = field(default=None, repr=False, compare=False)
+    _name_counts: Optional[Counter] = field(default=None, repr=False, compare=False)
+    # `shortcuts` keyed by the names of their endpoints, see `expand_names`
+    _chain_names: Optional[Dict[Tuple[str, str], Optional[List[str]]]] = field(
+        default=None, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_scope(cls, scope: "Scope", collapse_aliases: bool = False) -> "Graph":
+        graph = Graph()
+        graph._add_scope_fns(scope)
+        graph._add_calls(scope)
+        if collapse_aliases:
+            return graph.collapse(_alias_targets(scope))
+        return graph
+
+    def _add_node(self, fn: "Scope", key: Optional[str]):
+        assert fn.name is not None
+        alias = fn.alias()
+        self.nodes[alias] = Node(
+            alias, fn.name, fn.color, fn.is_param, key, dict(fn.labels)
+        )
+
+    def _add_scope_fns(self, scope: "Scope"):
+        is_root = scope.parent_scope is None
+        for fn in scope.functions.values():
+            key = (fn.usr or fn.name) if is_root else None
+            self._add_node(fn, key)
+            for param, param_scope in fn.params.items():
+                if not param:
+                    continue
+                self._add_node(param_scope, f"{key}({param})" if key else None)
+            self._add_scope_fns(fn)
+
+        for c in scope.child_scopes:
+            self._add_scope_fns(c)
+
+    def _add_calls(self, root: "Scope"):
+        def resolve_called_functions(s: "Scope", ret_val: List["Scope"]):
+            ret_val += s.called_functions
+            for cs in s.child_scopes:
+                resolve_called_functions(cs, ret_val)
+
+        def scope_calls(fn: "Scope"):
+            called: List["Scope"] = []
+            resolve_called_functions(fn, called)
+            for c in called:
+                self.edges.append((fn.alias(), c.alias()))
+            for fn_scope in fn.params.values():
+                scope_calls(fn_scope)
+            for fn_scope in fn.functions.values():
+                scope_calls(fn_scope)
+
+        def scope_functions(scope: "Scope"):
+            for fn_def in scope.functions.values():
+                scope_calls(fn_def)
+                scope_functions(fn_def)
+            for child_scope in scope.child_scopes:
+                scope_functions(child_scope)
+
+        for fn in root.functions.values():
+            scope_calls(fn)
+            scope_functions(fn)
+
+    def collapse(self, targets: Dict[str, str]) -> "Graph":
+        """Merge every node in `targets` into the node it maps to, following
+        chains of aliases. Calls to a merged node become calls to the node it
+        was merged into, and its name is kept in that node's `aliases`. Nodes
+        are only merged if they have the same colors."""
+        parent: Dict[str, str] = {}
+
+        def find(alias: str) -> str:
+            while alias in parent:
+                alias = parent[alias]
+            return alias
+
+        for alias, target in targets.items():
+            node, target_node = self.nodes.get(alias), self.nodes.get(target)
+            if node is None or target_node is None:
+                continue
+            if node.color != target_node.color or node.labels != target_node.labels:
+                continue
+            if find(target) != alias:
+                parent[alias] = target
+
+        collapsed = Graph()
+        for alias, node in self.nodes.items():
+            if alias not in parent:
+                collapsed.nodes[alias] = replace(node, aliases=list(node.aliases))
+        for alias, node in self.nodes.items():
+            if alias in parent:
+                merged_into = collapsed.nodes[find(alias)]
+                merged_into.aliases += [node.name] + node.aliases
+
+        seen_edges = set()
+        for src, dst in self.edges:
+            if parent.get(src) == dst:
+                # The alias calling the function it aliases
+                continue
+            edge = (find(src), find(dst))
+            if edge not in seen_edges:
+                seen_edges.add(edge)
+                collapsed.edges.append(edge)
+        return collapsed
+
+    def contract(self) -> "Graph":
+        """Remove every uncolored node. A colored node calls every colored node
+        it reaches through uncolored nodes only, and the uncolored nodes of a
+        shortest such chain are kept in `shortcuts`. Which colored nodes reach
+        each other, and through which colored nodes, doesn't change."""
+
+        def is_colored(alias: str) -> bool:
+            node = self.nodes.get(alias)
+            return node is not None and node.color is not None
+
+        contracted = Graph()
+        for alias, node in self.nodes.items():
+            if node.color is not None:
+                contracted.nodes[alias] = node
+
+        for source in contracted.nodes:
+            called = set()
+            parents: Dict[str, Optional[str]] = {}
+            frontier: deque = deque()
+            for succ in self.successors(source):
+                if is_colored(succ):
+                    if succ not in called:
+                        called.add(succ)
+                        contracted.edges.append((source, succ))
+                elif succ not in parents:
+                    parents[succ] = None
+                    frontier.append(succ)
+
+            while len(frontier) > 0:
+                current = frontier.popleft()
+                for succ in self.successors(current):
+                    if not is_colored(succ):
+                        if succ not in parents:
+                            parents[succ] = current
+                            frontier.append(succ)
+                        continue
+                    if succ in called:
+                        continue
+                    called.add(succ)
+                    contracted.edges.append((source, succ))
+                    chain: List[Node] = []
+                    ancestor: Optional[str] = current
+                    while ancestor is not None:
+                        chain.append(self.get_node(ancestor))
+                        ancestor = parents[ancestor]
+                    contracted.shortcuts[(source, succ)] = chain[::-1]
+        return contracted
+
+    def expand(self, path: List[Node]) -> List[Node]:
+        """Put back the uncolored nodes `contract` removed from `path`"""
+        expanded = path[:1]
+        for src, dst in zip(path, path[1:]):
+            expanded += self.shortcuts.get((src.alias, dst.alias), [])
+            expanded.append(dst)
+        return expanded
+
+    def expand_names(self, chain: List[Any]) -> List[Any]:
+        """Same as `expand`, for a chain projected as `name:COLOR` strings.
+        Steps between two nodes that can't be told apart that way are left
+        as they are."""
+        if self._chain_names is None:
+            self._chain_names = {}
+            for (src, dst), nodes in self.shortcuts.items():
+                key = (_chain_name(self.nodes[src]), _chain_name(self.nodes[dst]))
+                names = [_chain_name(node) for node in nodes]
+                if self._chain_names.setdefault(key, names) != names:
+                    self._chain_names[key] = None
+
+        expanded = chain[:1]
+        for src, dst in zip(chain, chain[1:]):
+            expanded += self._chain_names.get((src, dst)) or []
+            expanded.append(dst)
+        return expanded
+
+    @classmethod
+    def merge(cls, graphs: List["Graph"]) -> "Graph":
+        """Link the call graphs of several translation units together. Nodes
+        with the same key are merged, all other nodes are kept separate."""
+        merged = Graph()
+        seen_edges = set()
+        # Keys can contain characters that aren't valid in aliases
+        key_aliases: Dict[str, str] = {}
+        for i, graph in enumerate(graphs):
+            renamed = {}
+            for alias, node in graph.nodes.items():
+                if node.key is None:
+                    new_alias = f"`{alias[1:-1]}__tu{i}`"
+                    renamed[alias] = new_alias
+                    merged.nodes[new_alias] = Node(
+                        new_alias,
+                        node.name,
+                        node.color,
+                        node.is_param,
+                        labels=dict(node.labels),
+                        aliases=list(node.aliases),
+                    )
+                    continue
+
+                if node.key not in key_aliases:
+                    key_aliases[node.key] = f"`{node.name}__g{len(key_aliases)}`"
+                new_alias = key_aliases[node.key]
+                renamed[alias] = new_alias
+                if existing := merged.nodes.get(new_alias):
+                    if node.color and existing.color and node.color != existing.color:
+                        raise Exception(
+                            f"Multiple colors found for function {node.name}"
+                        )
+                    existing.color = existing.color or node.color
+                    for prefix, color in node.labels.items():
+                        if existing.labels.get(prefix, color) != color:
+                            raise Exception(
+                                f"Multiple colors found for function {node.name}"
+                            )
+                        existing.labels[prefix] = color
+                    for name in node.aliases:
+                        if name not in existing.aliases:
+                            existing.aliases.append(name)
+                else:
+                    merged.nodes[new_alias] = Node(
+                        new_alias,
+                        node.name,
+                        node.color,
+                        node.is_param,
+                        node.key,
+                        dict(node.labels),
+                        list(node.aliases),
+                    )
+
+            for src, dst in graph.edges:
+                edge = (
+                    renamed.get(src, f"`{src[1:-1]}__tu{i}`"),
+                    renamed.get(dst, f"`{dst[1:-1]}__tu{i}`"),
+                )
+                if edge not in seen_edges:
+                    seen_edges.add(edge)
+                    merged.edges.append(edge)
+        return merged
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "nodes": [
+                [n.alias, n.name, n.color, n.is_param, n.key, n.labels, n.aliases]
+                for n in self.nodes.values()
+            ],
+            "edges": [list(e) for e in self.edges],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Graph":
+        graph = Graph()
+        for alias, name, color, is_param, key, labels, *aliases in data["nodes"]:
+            # State files written before aliases were recorded have no list
+            graph.nodes[alias] = Node(
+                alias, name, color, is_param, key, labels, *aliases[:1]
+            )
+        graph.edges = [(src, dst) for src, dst in data["edges"]]
+        return graph
+
+    def project(self, prefix: str) -> "Graph":
+        """The same call graph, colored with the labels of the config using
+        `prefix` instead of the primary config's colors"""
+        graph = Graph(edges=self.edges)
+        for alias, node in self.nodes.items():
+            graph.nodes[alias] = Node(
+                alias,
+                node.name,
+                node.labels.get(prefix),
+                node.is_param,
+                node.key,
+                aliases=node.aliases,
+            )
+        return graph
+
+    def components(self) -> List["Graph"]:
+        """Split the call graph into its weakly connected components"""
+        parent: Dict[str, str] = {}
+
+        def find(alias: str) -> str:
+            parent.setdefault(alias, alias)
+            while parent[alias] != alias:
+                parent[alias] = parent[parent[alias]]
+                alias = parent[alias]
+            return alias
+
+        for alias in self.nodes:
+            find(alias)
+        for src, dst in self.edges:
+            parent[find(src)] = find(dst)
+
+        components: Dict[str, Graph] = {}
+        for alias, node in self.nodes.items():
+            components.setdefault(find(alias), Graph()).nodes[alias] = node
+        for src, dst in self.edges:
+            component = components.setdefault(find(src), Graph())
+            component.edges.append((src, dst))
+            if chain := self.shortcuts.get((src, dst)):
+                component.shortcuts[(src, dst)] = chain
+        return list(components.values())
+
+    @classmethod
+    def union(cls, graphs: List["Graph"]) -> "Graph":
+        """Combine graphs that don't share any node, such as components"""
+        result = Graph()
+        for graph in graphs:
+            result.nodes.update(graph.nodes)
+            result.edges += graph.edges
+            result.shortcuts.update(graph.shortcuts)
+        return result
+
+    def fingerprint(self) -> Optional[str]:
+        """Identifies the contents of the graph across runs. Aliases depend on
+        the order functions were discovered in, so nodes are described by
+        their key or name, colors and labels instead. None if two nodes have
+        the same description and the graph can't be identified that way."""
+
+        def describe(alias: str) -> str:
+            if alias not in self.nodes:
+                return json.dumps(["anonymous", alias])
+            node = self.nodes[alias]
+            labels = sorted(node.labels.items())
+            return json.dumps(
+                [node.key or node.name, node.color, node.is_param, labels]
+            )
+
+        aliases = set(self.nodes) | {a for edge in self.edges for a in edge}
+        descriptions = {alias: describe(alias) for alias in aliases}
+        if len(set(descriptions.values())) != len(descriptions):
+            return None
+        edges = sorted(
+            [descriptions[src], descriptions[dst]] for src, dst in self.edges
+        )
+        content = json.dumps([sorted(descriptions.values()), edges])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def canonical_hash(self, max_rounds: int = 16) -> str:
+        """A hash of the call graph that doesn't depend on aliases or on the
+        order of nodes and edges: only on names, colors, labels and calls.
+
+        Nodes start out labelled with their contents, and are then relabelled
+        with the labels of their callers and callees (Weisfeiler-Lehman
+        refinement) until that stops telling nodes apart. If every function
+        has a distinct name the hash is exact, otherwise different graphs
+        collide with a low probability."""
+
+        def digest(value: Any) -> str:
+            return hashlib.sha256(json.dumps(value).encode()).hexdigest()
+
+        aliases = set(self.nodes) | {a for edge in self.edges for a in edge}
+        labels = {}
+        for alias in aliases:
+            if node := self.nodes.get(alias):
+                labels[alias] = digest(
+                    [
+                        node.name,
+                        node.color,
+                        node.is_param,
+                        sorted(node.labels.items()),
+                        sorted(node.aliases),
+                    ]
+                )
+            else:
+                labels[alias] = digest(["anonymous"])
+
+        predecessors: Dict[str, List[str]] = {}
+        successors: Dict[str, List[str]] = {}
+        for src, dst in self.edges:
+            successors.setdefault(src, []).append(dst)
+            predecessors.setdefault(dst, []).append(src)
+
+        distinct = len(set(labels.values()))
+        for _ in range(max_rounds):
+            if distinct == len(labels):
+                break
+            labels = {
+                alias: digest(
+                    [
+                        label,
+                        sorted(labels[a] for a in successors.get(alias, [])),
+                        sorted(labels[a] for a in predecessors.get(alias, [])),
+                    ]
+                )
+                for alias, label in labels.items()
+            }
+            if len(set(labels.values())) == distinct:
+                break
+            distinct = len(set(labels.values()))
+
+        edges = sorted([labels[src], labels[dst]] for src, dst in self.edges)
+        return digest([sorted(labels.values()), edges])
+
+    def successors(self, alias: str) -> List[str]:
+        if self._successors is None:
+            self._successors = {}
+            for src, dst in self.edges:
+                self._successors.setdefault(src, []).append(dst)
+        return self._successors.get(alias, [])
+
+    def _build_counts(self):
+        self._label_counts = Counter()
+        self._name_counts = Counter()
+        for node in self.nodes.values():
+            if node.color:
+                self._label_counts[node.color] += 1
+            self._name_counts[node.name] += 1
+
+    def label_count(self, label: str) -> int:
+        """Number of nodes with the color `label`"""
+        if self._label_counts is None:
+            self._build_counts()
+        assert self._label_counts is not None
+        return self._label_counts[label]
+
+    def name_count(self, name: str) -> int:
+        """Number of nodes named `name`"""
+        if self._name_counts is None:
+            self._build_counts()
+        assert self._name_counts is not None
+        return self._name_counts[name]
+
+    def get_node(self, alias: str) -> Node:
+        # Edges can refer to functions that were shadowed in their parent
+        # scope, CREATE models those as anonymous nodes, so we do the same.
+        if alias in self.nodes:
+            return self.nodes[alias]
+        return Node(alias, alias)
+
+    def shortest_witnesses(
+        self, reachability: "Reachability", limit: Optional[int] = None
+    ) -> Iterator[List[Node]]:
+        """Yield one shortest path for every (source, sink) pair matching
+        `reachability`. Paths are found with a BFS from every source, so the
+        cost is bounded by O(sources * edges) instead of the number of
+        distinct paths."""
+        found = 0
+        for source in list(self.nodes.values()):
+            if not reachability.is_source(source):
+                continue
+
+            parents: Dict[str, str] = {}
+            frontier = deque([source.alias])
+            while len(frontier) > 0:
+                current = frontier.popleft()
+                for succ in self.successors(current):
+                    if succ in parents:
+                        continue
+                    node = self.get_node(succ)
+                    if not reachability.may_visit(node):
+                        continue
+                    parents[succ] = current
+                    frontier.append(succ)
+
+                    if not reachability.is_sink(node):
+                        continue
+                    path = [node]
+                    ancestor = parents[succ]
+                    while ancestor != source.alias:
+                        path.append(self.get_node(ancestor))
+                        ancestor = parents[ancestor]
+                    path.append(source)
+                    path.reverse()
+                    yield path
+
+                    found += 1
+                    if limit is not None and found >= limit:
+                        return
+
+    def to_cypher(self) -> str:
+        """Outputs the call graph as an openCypher CREATE query, tagging all
+        functions with their colors"""
+        return "".join(self.iter_cypher())
+
+    def iter_cypher(self) -> Iterator[str]:
+        """Same as `to_cypher`, but yields the query one node or edge at a
+        time, so that it can be written out without building the whole
+        string"""
+        separator = "CREATE "
+        for node in self.nodes.values():
+            yield separator + node.to_cypher()
+            separator = ",\n  "
+        for src, dst in self.edges:
+            yield f"{separator}({src}) -[:CALLS]-> ({dst})"
+            separator = ",\n  "
+        if separator == "CREATE ":
+            yield "RETURN 0"
+
+
+def _chain_name(node: Node) -> str:
+    return f"{node.name}:{node.color}" if node.color else node.name
+
+
+def _alias_targets(scope: "Scope") -> Dict[str, str]:
+    """Maps every function alias, and each of its parameters, to the function
+    (or parameter) it aliases"""
+    targets = {}
+    for fn in scope.functions.values():
+        if fn.alias_of is not None:
+            targets[fn.alias()] = fn.alias_of.alias()
+            for param, param_scope in fn.params.items():
+                if param and param in fn.alias_of.params:
+                    targets[param_scope.alias()] = fn.alias_of.params[param].alias()
+        targets.update(_alias_targets(fn))
+    for child_scope in scope.child_scopes:
+        targets.update(_alias_targets(child_scope))
+    return targets
+
+
+def _node_re(name: str) -> str:
+    return rf"\(\s*\w*\s*(?::\s*(?P<{name}>\w+))?\s*\)"
+
+
+_REACHABILITY_RE = re.compile(
+    r"^\s*(?:(?P<path>\w+)\s*=\s*)?"
+    + _node_re("source")
+    + r"\s*-\[\s*(?::\s*CALLS\s*)?\*\s*\]->\s*"
+    + _node_re("sink")
+    + r"(?:\s+WHERE\s+NOT\s+any\(\s*(?P<var>\w+)\s+IN\s+nodes\(\s*(?P=path)\s*\)"
+    + r"\s+WHERE\s+(?P=var)\s*:\s*(?P<avoid>\w+)\s*\))?\s*$",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Reachability:
+    """A pattern of the form `p = (:SOURCE)-[:CALLS*]->(:SINK)`, optionally
+    followed by `WHERE NOT any(n in nodes(p) WHERE n:AVOID)`"""
+
+    source: Optional[str]
+    sink: Optional[str]
+    avoid: Optional[str] = None
+    # Name of the path, if the pattern binds it
+    path: Optional[str] = field(default=None, compare=False)
+
+    @classmethod
+    def parse(cls, pattern: str) -> Optional["Reachability"]:
+        if not (m := _REACHABILITY_RE.match(pattern)):
+            return None
+        return Reachability(
+            m.group("source"), m.group("sink"), m.group("avoid"), m.group("path")
+        )
+
+    def may_visit(self, node: Node) -> bool:
+        return self.avoid is None or node.color != self.avoid
+
+    def is_source(self, node: Node) -> bool:
+        return node.has_label(self.source) and self.may_visit(node)
+
+    def is_sink(self, node: Node) -> bool:
+        return node.has_label(self.sink)
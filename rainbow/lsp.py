@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Rainbow as a language server.
+
+Speaks a minimal subset of the Language Server Protocol over stdio, and
+publishes a diagnostic for every message reported by the config's patterns.
+"""
+
+import json
+import logging
+import re
+import sys
+import threading
+import warnings
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import clang.cindex
+import click
+
+import rainbow.errors as errors
+from rainbow.config import Config
+from rainbow.rainbow import Rainbow
+from rainbow.scope import Scope
+
+# https://microsoft.github.io/language-server-protocol/specifications/specification-current/#diagnosticSeverity
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+
+# https://microsoft.github.io/language-server-protocol/specifications/specification-current/#textDocumentSyncKind
+SYNC_FULL = 1
+
+METHOD_NOT_FOUND = -32601
+
+
+@dataclass
+class _Checkpoint:
+    """State of a Rainbow before a top-level declaration. The changes made by
+    the declarations processed after it are in the undo log past `n_undo`, and
+    restoring the checkpoint rolls them back."""
+
+    n_undo: int
+    scope_id_vendor: int
+
+    @classmethod
+    def capture(cls, rainbow: "IncrementalRainbow") -> "_Checkpoint":
+        return _Checkpoint(len(rainbow._undo), rainbow._scope_id_vendor)
+
+    def restore(self, rainbow: "IncrementalRainbow"):
+        rainbow._undo_to(self.n_undo)
+        rainbow._scope_id_vendor = self.scope_id_vendor
+
+
+@dataclass
+class IncrementalRainbow(Rainbow):
+    """Rainbow that can re-process a reparsed translation unit.
+
+    Top-level declarations are processed one at a time, and a checkpoint is
+    taken before every declaration in the main file. After a reparse, only the
+    declarations starting at the first one that changed are processed again.
+    Declarations from headers that precede the main file are never re-walked
+    unless the headers change."""
+
+    _decl_keys: List[Hashable] = field(default_factory=list)
+    _checkpoints: Dict[int, _Checkpoint] = field(default_factory=dict)
+    _undo: Optional[List[Tuple[Any, Any, Any]]] = field(default_factory=list)
+
+    # Number of top-level declarations walked by the last call to `process`
+    walked: int = 0
+
+    def _cursor_hash(self, node: clang.cindex.Cursor) -> Hashable:
+        # Cursor hashes change on every reparse, but USRs are stable
+        return node.get_usr() or node.hash
+
+    def _decl_key(
+        self, node: clang.cindex.Cursor, contents: bytes
+    ) -> Tuple[Optional[str], Any]:
+        start = node.extent.start
+        end = node.extent.end
+        filename = start.file.name if start.file else None
+        if filename == self.tu.spelling:
+            return (filename, contents[start.offset : end.offset])
+        return (filename, (start.offset, end.offset))
+
+    def process_incremental(self, contents: bytes) -> Scope:
+        """Process the translation unit after it was reparsed. `contents` must
+        be the current contents of the main file"""
+        self._check_diagnostics()
+        self._source_cache = {self.tu.spelling: contents}
+
+        decls = list(self.tu.cursor.get_children())
+        keys = [self._decl_key(d, contents) for d in decls]
+        first_changed = 0
+        while (
+            first_changed < len(keys)
+            and first_changed < len(self._decl_keys)
+            and keys[first_changed] == self._decl_keys[first_changed]
+        ):
+            first_changed += 1
+
+        if first_changed == len(keys) == len(self._decl_keys):
+            self.walked = 0
+            return self._global_scope
+
+        restart = max(
+            [i for i in self._checkpoints if i <= first_changed], default=None
+        )
+        if restart is None:
+            self._global_scope = Scope.create_root()
+            self._hash_to_scope = {}
+            self._scope_id_vendor = 0
+            self._checkpoints = {}
+            self._undo = []
+            restart = 0
+        else:
+            self._checkpoints[restart].restore(self)
+            self._checkpoints = {
+                i: cp for i, cp in self._checkpoints.items() if i <= restart
+            }
+
+        self.walked = 0
+        for i in range(restart, len(decls)):
+            in_main_file = keys[i][0] == self.tu.spelling
+            if in_main_file and i not in self._checkpoints:
+                self._checkpoints[i] = _Checkpoint.capture(self)
+            self._process(decls[i], self._global_scope)
+            self.walked += 1
+        self._decl_keys = keys
+        return self._global_scope
+
+
+@dataclass
+class Document:
+    uri: str
+    path: str
+    text: str
+    version: int
+    rainbow: Optional[IncrementalRainbow] = None
+    timer: Optional[threading.Timer] = None
+
+
+class _MessageCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+
+def uri_to_path(uri: str) -> str:
+    return unquote(urlparse(uri).path)
+
+
+@dataclass
+class RainbowServer:
+    config: Config
+    reader: IO[bytes]
+    writer: IO[bytes]
+    debounce: float = 0.1
+    args: List[str] = field(default_factory=list)
+    logger: logging.Logger = field(default_factory=lambda: logging.Logger("lsp"))
+
+    documents: Dict[str, Document] = field(default_factory=dict)
+    index: clang.cindex.Index = field(default_factory=clang.cindex.Index.create)
+
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+    _write_lock: threading.Lock = field(default_factory=threading.Lock)
+    _shutdown: bool = False
+
+    def read_message(self) -> Optional[Dict[str, Any]]:
+        headers = {}
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            line = line.decode().strip()
+            if line == "":
+                break
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        body = self.reader.read(int(headers["content-length"]))
+        return json.loads(body.decode())
+
+    def send(self, message: Dict[str, Any]):
+        message["jsonrpc"] = "2.0"
+        body = json.dumps(message).encode()
+        with self._write_lock:
+            self.writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode())
+            self.writer.write(body)
+            self.writer.flush()
+
+    def notify(self, method: str, params: Dict[str, Any]):
+        self.send({"method": method, "params": params})
+
+    def _diagnostic(
+        self, message: str, severity: int, line: int = 0, col: int = 0, length: int = 0
+    ) -> Dict[str, Any]:
+        return {
+            "range": {
+                "start": {"line": line, "character": col},
+                "end": {"line": line, "character": col + length},
+            },
+            "severity": severity,
+            "source": "rainbow",
+            "message": message,
+        }
+
+    def _locate(
+        self, doc: Document, message: str, locations: Dict[str, Tuple[int, int]]
+    ) -> Dict[str, Any]:
+        """Anchor a pattern message on the first function it mentions that is
+        defined in the document"""
+        best = None
+        for name, (line, col) in locations.items():
+            if m := re.search(rf"\b{re.escape(name)}\b", message):
+                if best is None or m.start() < best[0]:
+                    best = (m.start(), name, line, col)
+        if best is None:
+            return self._diagnostic(message, SEVERITY_ERROR)
+        _, name, line, col = best
+        return self._diagnostic(message, SEVERITY_ERROR, line, col, len(name))
+
+    def analyze(self, uri: str):
+        with self._lock:
+            if not (doc := self.documents.get(uri)):
+                return
+            # didChange updates the document without holding the lock
+            text, version = doc.text, doc.version
+            unsaved = [(doc.path, text)]
+            if doc.rainbow is None:
+                tu = self.index.parse(
+                    doc.path,
+                    self.args,
+                    unsaved_files=unsaved,
+                    options=clang.cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE,
+                )
+                doc.rainbow = IncrementalRainbow(tu, self.config, logger=self.logger)
+            else:
+                doc.rainbow.tu.reparse(unsaved_files=unsaved)
+
+            diagnostics = []
+            try:
+                scope = doc.rainbow.process_incremental(text.encode())
+            except errors.CPPSyntaxErrors:
+                for diag in doc.rainbow.tu.diagnostics:
+                    if diag.severity < clang.cindex.Diagnostic.Error:
+                        continue
+                    loc = diag.location
+                    if loc.file and loc.file.name != doc.path:
+                        continue
+                    diagnostics.append(
+                        self._diagnostic(
+                            diag.spelling,
+                            SEVERITY_ERROR,
+                            max(loc.line - 1, 0),
+                            max(loc.column - 1, 0),
+                        )
+                    )
+                # Start from scratch once the document is valid again
+                doc.rainbow = None
+                scope = None
+            except Exception as e:
+                diagnostics.append(self._diagnostic(str(e), SEVERITY_ERROR))
+                doc.rainbow = None
+                scope = None
+
+            if scope is not None:
+                locations = {}
+                for c in doc.rainbow.tu.cursor.get_children():
+                    loc = c.location
+                    if c.spelling and loc.file and loc.file.name == doc.path:
+                        locations[c.spelling] = (loc.line - 1, loc.column - 1)
+
+                collector = _MessageCollector()
+                self.config.logger.addHandler(collector)
+                try:
+                    result = self.config.run(scope)
+                finally:
+                    self.config.logger.removeHandler(collector)
+                for message in collector.messages:
+                    diagnostics.append(self._locate(doc, message, locations))
+                if result and len(collector.messages) == 0:
+                    diagnostics.append(
+                        self._diagnostic(
+                            "Call graph was rejected by the config", SEVERITY_ERROR
+                        )
+                    )
+                elif result is None:
+                    diagnostics.append(
+                        self._diagnostic(
+                            "Could not determine call graph validity", SEVERITY_WARNING
+                        )
+                    )
+
+            self.notify(
+                "textDocument/publishDiagnostics",
+                {"uri": uri, "version": version, "diagnostics": diagnostics},
+            )
+
+    def schedule(self, uri: str):
+        """Analyze the document once it hasn't changed for `debounce` seconds"""
+        doc = self.documents[uri]
+        if doc.timer:
+            doc.timer.cancel()
+            doc.timer = None
+        if self.debounce <= 0:
+            self.analyze(uri)
+            return
+        doc.timer = threading.Timer(self.debounce, self.analyze, [uri])
+        doc.timer.daemon = True
+        doc.timer.start()
+
+    def handle(self, message: Dict[str, Any]) -> bool:
+        """Returns False once the client asked the server to exit"""
+        method = message.get("method")
+        params = message.get("params", {})
+        msg_id = message.get("id")
+
+        if method == "initialize":
+            self.send(
+                {
+                    "id": msg_id,
+                    "result": {
+                        "capabilities": {
+                            "textDocumentSync": {
+                                "openClose": True,
+                                "change": SYNC_FULL,
+                                "save": True,
+                            }
+                        },
+                        "serverInfo": {"name": "rainbow"},
+                    },
+                }
+            )
+        elif method == "shutdown":
+            self._shutdown = True
+            self.send({"id": msg_id, "result": None})
+        elif method == "exit":
+            for doc in self.documents.values():
+                if doc.timer:
+                    doc.timer.cancel()
+            return False
+        elif method == "textDocument/didOpen":
+            item = params["textDocument"]
+            uri = item["uri"]
+            self.documents[uri] = Document(
+                uri, uri_to_path(uri), item["text"], item.get("version", 0)
+            )
+            self.schedule(uri)
+        elif method == "textDocument/didChange":
+            uri = params["textDocument"]["uri"]
+            if doc := self.documents.get(uri):
+                # We only advertise full document sync
+                doc.text = params["contentChanges"][-1]["text"]
+                doc.version = params["textDocument"].get("version", doc.version)
+                self.schedule(uri)
+        elif method == "textDocument/didSave":
+            uri = params["textDocument"]["uri"]
+            if uri in self.documents:
+                self.schedule(uri)
+        elif method == "textDocument/didClose":
+            uri = params["textDocument"]["uri"]
+            if doc := self.documents.pop(uri, None):
+                if doc.timer:
+                    doc.timer.cancel()
+            self.notify(
+                "textDocument/publishDiagnostics", {"uri": uri, "diagnostics": []}
+            )
+        elif msg_id is not None:
+            self.send(
+                {
+                    "id": msg_id,
+                    "error": {
+                        "code": METHOD_NOT_FOUND,
+                        "message": f"Unsupported method {method}",
+                    },
+                }
+            )
+        return True
+
+    def serve(self):
+        while message := self.read_message():
+            if not self.handle(message):
+                break
+
+
+@click.command(help="rainbow language server")
+@click.argument("config_file")
+@click.option("-c", "--clangLocation", type=Path, help="Path to libclang.so")
+@click.option(
+    "--debounce",
+    type=float,
+    default=0.1,
+    help="Seconds to wait after the last edit before re-analyzing a document",
+)
+@click.option("-a", "--arg", "args", multiple=True, help="Argument to pass to clang")
+def main(
+    config_file: str, clanglocation: Optional[Path], debounce: float, args: List[str]
+):
+    if not clanglocation:
+        clanglocation = Path("/usr/lib/x86_64-linux-gnu/libclang-15.so.1")
+    clang.cindex.Config.set_library_file(clanglocation)
+
+    # stdout is reserved for the protocol
+    logging.basicConfig(level=logging.NOTSET, stream=sys.stderr)
+    logger = logging.getLogger("rainbow")
+    logger.setLevel(logging.WARNING)
+    warnings.filterwarnings("ignore")
+
+    config = Config.from_json(Path(config_file), logger=logger.getChild("config"))
+    server = RainbowServer(
+        config,
+        sys.stdin.buffer,
+        sys.stdout.buffer,
+        debounce=debounce,
+        args=list(args),
+        logger=logger,
+    )
+    server.serve()
+
+
+if __name__ == "__main__":
+    main()
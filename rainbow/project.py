@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import json
+import os
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+from rainbow.graph import Graph
+
+
+def normalize_path(path: str) -> str:
+    return os.path.realpath(path)
+
+
+def files_changed_since(revision: str) -> Set[str]:
+    """Files that differ between `revision` and the working tree, according to
+    the git repository in the current directory"""
+    toplevel = subprocess.check_output(
+        ["git", "rev-parse", "--show-toplevel"], text=True
+    ).strip()
+    output = subprocess.check_output(
+        ["git", "diff", "--name-only", revision, "--"], text=True, cwd=toplevel
+    )
+    return {
+        normalize_path(os.path.join(toplevel, line))
+        for line in output.splitlines()
+        if line
+    }
+
+
+@dataclass
+class TUState:
+    """What we remember about a translation unit between runs"""
+
+    includes: List[str]
+    graph: Graph
+    # USRs of header functions whose bodies this translation unit walked, or
+    # skipped because another translation unit walked them
+    walked: List[str] = field(default_factory=list)
+    reused: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ProjectState:
+    """Per translation unit call graphs and include lists from the last run.
+
+    Combined with a list of changed files, this lets us re-extract only the
+    translation units that could have been affected by a change."""
+
+    tus: Dict[str, TUState] = field(default_factory=dict)
+    # Call graph components that passed each pattern in earlier runs, see
+    # `Config.run_incremental`
+    clean: Dict[str, Set[str]] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "ProjectState":
+        state = ProjectState()
+        if not path.exists():
+            return state
+        with path.open() as f:
+            data = json.load(f)
+        for source, tu in data["tus"].items():
+            state.tus[source] = TUState(
+                tu["includes"],
+                Graph.from_dict(tu["graph"]),
+                tu.get("walked", []),
+                tu.get("reused", []),
+            )
+        state.clean = {k: set(v) for k, v in data.get("clean", {}).items()}
+        return state
+
+    def save(self, path: Path):
+        data = {
+            "tus": {
+                source: {
+                    "includes": tu.includes,
+                    "graph": tu.graph.to_dict(),
+                    "walked": tu.walked,
+                    "reused": tu.reused,
+                }
+                for source, tu in self.tus.items()
+            },
+            "clean": {k: sorted(v) for k, v in self.clean.items()},
+        }
+        tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+        with tmp_path.open("w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def affected(self, sources: Iterable[str], changed: Set[str]) -> List[str]:
+        """Sources that must be re-extracted because they, or any file they
+        include, changed. Sources we have no record of are always affected."""
+        result = []
+        for source in sources:
+            tu = self.tus.get(normalize_path(source))
+            if tu is None or normalize_path(source) in changed:
+                result.append(source)
+            elif any(include in changed for include in tu.includes):
+                result.append(source)
+        return result
+
+    def update(
+        self,
+        source: str,
+        includes: Iterable[str],
+        graph: Graph,
+        walked: Iterable[str] = (),
+        reused: Iterable[str] = (),
+    ):
+        self.tus[normalize_path(source)] = TUState(
+            [normalize_path(i) for i in includes],
+            graph,
+            sorted(walked),
+            sorted(reused),
+        )
+
+    def header_summaries(self, source: str) -> Set[str]:
+        """Header functions that `source` doesn't need to walk, because
+        another translation unit already did"""
+        source = normalize_path(source)
+        return {
+            usr
+            for other, tu in self.tus.items()
+            if other != source
+            for usr in tu.walked
+        }
+
+    def orphaned(self, sources: Iterable[str]) -> List[str]:
+        """Sources that skipped a header function that no translation unit
+        walks anymore. These must be extracted again."""
+        walked = {usr for tu in self.tus.values() for usr in tu.walked}
+        return [
+            source
+            for source in sources
+            if any(usr not in walked for usr in self.tus[normalize_path(source)].reused)
+        ]
+
+    def retain(self, sources: Iterable[str]):
+        """Forget translation units that are no longer part of the project"""
+        keep = {normalize_path(s) for s in sources}
+        self.tus = {k: v for k, v in self.tus.items() if k in keep}
+
+    def graph(self, sources: Iterable[str]) -> Graph:
+        """The global call graph, stitched together from every source"""
+        return Graph.merge([self.tus[normalize_path(s)].graph for s in sources])
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Version 2 of the protocol spoken with executor subprocesses, see the
+"Executors" section of the README"""
+
+import functools
+import json
+import struct
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (IO, Any, Callable, Deque, Dict, Iterable, Iterator, List,
+                    Optional, Union)
+
+
+@functools.cache
+def _msgpack() -> Any:
+    """The msgpack module, or None if it isn't installed. Imported on first
+    use to keep startup fast."""
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+PROTOCOL_VERSION = 2
+
+HEADER = struct.Struct(">I")
+
+# Number of rows sent per frame by `serve`
+ROWS_PER_FRAME = 256
+
+# Either the text of a query, or a function returning the text in chunks. The
+# latter is written out without ever holding the whole query in memory, see
+# `query_frame`.
+Query = Union[str, Callable[[], Iterable[str]]]
+
+
+def supported_encodings() -> List[str]:
+    if _msgpack():
+        return ["msgpack", "json"]
+    return ["json"]
+
+
+def encode(message: Dict[str, Any], encoding: str) -> bytes:
+    if encoding == "msgpack":
+        assert _msgpack()
+        return _msgpack().packb(message)
+    return json.dumps(message).encode()
+
+
+def decode(data: bytes, encoding: str) -> Dict[str, Any]:
+    if encoding == "msgpack":
+        assert _msgpack()
+        return _msgpack().unpackb(data)
+    return json.loads(data.decode())
+
+
+def write_frame(stream: IO[bytes], payload: bytes):
+    stream.write(HEADER.pack(len(payload)))
+    stream.write(payload)
+
+
+def query_frame(
+    message_id: int, query: Query, limit: Optional[int], encoding: str
+) -> Iterator[bytes]:
+    """Encode a query message as a frame, in pieces. A streamed query is
+    produced twice: once to compute the size of the frame, and once to write
+    it."""
+    message: Dict[str, Any] = {"type": "query", "id": message_id}
+    if limit is not None:
+        message["limit"] = limit
+    if isinstance(query, str):
+        message["query"] = query
+        payload = encode(message, encoding)
+        yield HEADER.pack(len(payload)) + payload
+        return
+
+    if encoding == "msgpack":
+        msgpack = _msgpack()
+        assert msgpack and len(message) < 15
+        # A fixmap, the other fields, then the query as a str 32
+        prefix = bytes([0x80 | (len(message) + 1)])
+        for key, value in message.items():
+            prefix += msgpack.packb(key) + msgpack.packb(value)
+        size = sum(len(chunk.encode()) for chunk in query())
+        prefix += msgpack.packb("query") + b"\xdb" + struct.pack(">I", size)
+        suffix = b""
+        escape = str.encode
+    else:
+        prefix = (json.dumps(message)[:-1] + ', "query": "').encode()
+        suffix = b'"}'
+        # Escaping is done character by character, so chunks can be escaped
+        # separately
+        escape = lambda chunk: json.dumps(chunk)[1:-1].encode()
+        size = sum(len(escape(chunk)) for chunk in query())
+
+    yield HEADER.pack(len(prefix) + size + len(suffix)) + prefix
+    for chunk in query():
+        yield escape(chunk)
+    yield suffix
+
+
+def _read_exactly(stream: IO[bytes], size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream: IO[bytes]) -> Optional[bytes]:
+    """Read a single frame, or None if the stream was closed"""
+    header = _read_exactly(stream, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    payload = _read_exactly(stream, size)
+    if payload is None:
+        raise EOFError("Stream closed in the middle of a frame")
+    return payload
+
+
+class ProtocolError(Exception):
+    pass
+
+
+@dataclass
+class ExecutorConnection:
+    """The rainbow side of a version 2 connection"""
+
+    writer: IO[bytes]
+    reader: IO[bytes]
+    encoding: str = "json"
+
+    # Queries that were sent, but whose results haven't been read yet
+    _pending: Deque[Dict[str, Any]] = field(default_factory=deque)
+    _next_id: int = 0
+    _writer_thread: Optional[threading.Thread] = None
+    # The result being read, see `next_result`
+    _current: Optional["ResultStream"] = None
+
+    # Error messages reported by the executor
+    errors: List[str] = field(default_factory=list)
+
+    def handshake(self):
+        hello = {
+            "type": "hello",
+            "protocol": PROTOCOL_VERSION,
+            "encodings": supported_encodings(),
+        }
+        write_frame(self.writer, encode(hello, "json"))
+        self.writer.flush()
+
+        payload = read_frame(self.reader)
+        if payload is None:
+            raise ProtocolError("Executor exited during the handshake")
+        reply = decode(payload, "json")
+        if reply.get("type") != "hello" or reply.get("protocol") != PROTOCOL_VERSION:
+            raise ProtocolError(f"Unexpected handshake from executor: {reply}")
+        if reply.get("encoding") not in hello["encodings"]:
+            raise ProtocolError(f"Unsupported encoding: {reply.get('encoding')}")
+        self.encoding = reply["encoding"]
+
+    def submit(self, queries: List[Query], limit: Optional[int] = None):
+        """Send queries without waiting for their results. Frames are written
+        from a separate thread, so that the executor never blocks on writing
+        results that we aren't reading yet."""
+        messages = []
+        for query in queries:
+            messages.append((self._next_id, query))
+            self._pending.append({"id": self._next_id, "query": query})
+            self._next_id += 1
+        encoding = self.encoding
+
+        def write_all(previous: Optional[threading.Thread]):
+            if previous:
+                previous.join()
+            try:
+                for id_, query in messages:
+                    for piece in query_frame(id_, query, limit, encoding):
+                        self.writer.write(piece)
+                self.writer.flush()
+            except BrokenPipeError:
+                # The executor exited, reading its results will fail
+                pass
+
+        self._writer_thread = threading.Thread(
+            target=write_all, args=(self._writer_thread,), daemon=True
+        )
+        self._writer_thread.start()
+
+    def outstanding(self) -> int:
+        """Number of submitted queries whose results haven't been read"""
+        unfinished = self._current is not None and not self._current.finished
+        return len(self._pending) + int(unfinished)
+
+    def close(self):
+        if self._writer_thread:
+            self._writer_thread.join()
+        try:
+            self.writer.close()
+        except BrokenPipeError:
+            pass
+
+    def next_result(self, query: Optional[str] = None) -> Optional["ResultStream"]:
+        """The result of the oldest submitted query, or None if the executor
+        answered null or an error. Rows are read as they are iterated over. If
+        `query` is passed, it must be the query that was submitted."""
+        if self._current is not None:
+            # Skip the rows of the previous result nobody read
+            for _ in self._current:
+                pass
+            self._current = None
+
+        submitted = self._pending.popleft()
+        if query is not None and submitted["query"] != query:
+            raise ProtocolError("Results must be read in the order of submission")
+
+        message = self._read_message(submitted["id"])
+        if message["type"] == "rows":
+            self._current = ResultStream(self, submitted["id"], message["rows"])
+            return self._current
+        if message["type"] == "error":
+            # Same as a v1 executor answering null
+            self.errors.append(message.get("message", ""))
+        return None
+
+    def _read_message(self, id_: int) -> Dict[str, Any]:
+        payload = read_frame(self.reader)
+        if payload is None:
+            raise ProtocolError("Executor exited before answering all queries")
+        message = decode(payload, self.encoding)
+        if message.get("id") != id_ or message.get("type") not in [
+            "rows",
+            "done",
+            "error",
+        ]:
+            raise ProtocolError(f"Unexpected message from executor: {message}")
+        return message
+
+
+class ResultStream:
+    """The rows of one query, read from the executor frame by frame while they
+    are iterated over. An error after some of the rows were sent sets
+    `failed`."""
+
+    def __init__(self, conn: ExecutorConnection, id_: int, rows: List[Dict]):
+        self._conn = conn
+        self._id = id_
+        self._rows: Deque[Dict] = deque(rows)
+        self.finished = False
+        self.failed = False
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self
+
+    def __next__(self) -> Dict:
+        while len(self._rows) == 0:
+            if self.finished:
+                raise StopIteration
+            message = self._conn._read_message(self._id)
+            if message["type"] == "rows":
+                self._rows.extend(message["rows"])
+                continue
+            self.finished = True
+            if message["type"] == "error":
+                self.failed = True
+                self._conn.errors.append(message.get("message", ""))
+        return self._rows.popleft()
+
+
+def serve(
+    execute: Callable[[str], Optional[Iterable[Dict[str, Any]]]],
+    reader: IO[bytes],
+    writer: IO[bytes],
+):
+    """Run the executor side of a version 2 connection. `execute` takes a
+    query and returns its rows, or None. Meant to be used by executors written
+    in python."""
+    payload = read_frame(reader)
+    if payload is None:
+        return
+    hello = decode(payload, "json")
+    encoding = next(e for e in supported_encodings() if e in hello["encodings"])
+    reply = {"type": "hello", "protocol": PROTOCOL_VERSION, "encoding": encoding}
+    write_frame(writer, encode(reply, "json"))
+    writer.flush()
+
+    while (payload := read_frame(reader)) is not None:
+        message = decode(payload, encoding)
+        id_ = message["id"]
+        try:
+            rows = execute(message["query"])
+            if rows is not None:
+                limit = message.get("limit")
+                batch = []
+                for i, row in enumerate(rows):
+                    if limit is not None and i >= limit:
+                        break
+                    batch.append(row)
+                    if len(batch) == ROWS_PER_FRAME:
+                        frame = {"type": "rows", "id": id_, "rows": batch}
+                        write_frame(writer, encode(frame, encoding))
+                        batch = []
+                frame = {"type": "rows", "id": id_, "rows": batch}
+                write_frame(writer, encode(frame, encoding))
+            write_frame(writer, encode({"type": "done", "id": id_}, encoding))
+        except Exception as e:
+            error = {"type": "error", "id": id_, "message": str(e)}
+            write_frame(writer, encode(error, encoding))
+        writer.flush()
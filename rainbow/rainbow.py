@@ -1,23 +1,61 @@
 #!/usr/bin/env python3
+import ctypes
+import functools
 import logging
+import re
 import sys
+import threading
 import warnings
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
 
 import clang.cindex
 import click
-from clang.cindex import CursorKind, Diagnostic
+from clang.cindex import CursorKind, Diagnostic, TypeKind
 
 import rainbow.errors as errors
-from rainbow.config import Config
+from rainbow.cache import ASTCache, CostHistory, VerdictCache
+from rainbow.config import Config, run_configs
+from rainbow.graph import Graph
+from rainbow.project import ProjectState, files_changed_since, normalize_path
 from rainbow.scope import Scope
 
+# Every C++ binary operator, see `Rainbow.is_assignment`
+_BINARY_OPERATORS = {
+    ".*", "->*", "*", "/", "%", "+", "-", "<<", ">>", "<=>", "<", ">", "<=",
+    ">=", "==", "!=", "&", "^", "|", "&&", "||", ",", "=", "*=", "/=", "%=",
+    "+=", "-=", "<<=", ">>=", "&=", "^=", "|=", "and", "or", "bitand", "bitor",
+    "xor", "not_eq", "and_eq", "or_eq", "xor_eq",
+}  # fmt: skip
+_COMMENT_RE = re.compile(rb"/\*.*?\*/|//[^\n]*", re.DOTALL)
+
+# CXBinaryOperator_Assign from clang-c/Index.h
+_CX_BINARY_OPERATOR_ASSIGN = 22
+
+# Marks keys that were missing from a dict in `Rainbow._undo`
+_MISSING = object()
+
+
+@functools.cache
+def _binary_operator_kind_fn() -> Optional[Callable[[clang.cindex.Cursor], int]]:
+    """clang_getCursorBinaryOperatorKind, if the loaded libclang has it
+    (clang-17+)"""
+    try:
+        fn = clang.cindex.conf.lib.clang_getCursorBinaryOperatorKind
+    except AttributeError:
+        return None
+    fn.argtypes = [clang.cindex.Cursor]
+    fn.restype = ctypes.c_uint
+    return fn
+
 
 @dataclass
 class Rainbow:
-    tu: clang.cindex.TranslationUnit
+    # None once released, see `release`
+    tu: Optional[clang.cindex.TranslationUnit]
     config: Config
 
     _global_scope: Scope = field(default_factory=Scope.create_root)
@@ -28,14 +66,65 @@ class Rainbow:
 
     logger: logging.Logger = field(default_factory=lambda: logging.Logger("rainbow"))
 
-    _hash_to_scope: Dict[int, Scope] = field(default_factory=dict)
+    _hash_to_scope: Dict[Hashable, Scope] = field(default_factory=dict)
 
     _frontier: List[Tuple[clang.cindex.Cursor, Scope]] = field(default_factory=list)
 
+    # Configs whose patterns are checked against the same call graph as
+    # `config`. Their colors are tracked as labels namespaced by their prefix.
+    extra_configs: List[Config] = field(default_factory=list)
+
+    # Contents of source files, used to find operators without tokenizing
+    _source_cache: Dict[str, bytes] = field(default_factory=dict)
+
+    # USRs of functions defined in headers whose bodies were walked by another
+    # translation unit of the same project. Their bodies are skipped, and the
+    # call graphs are linked together by USR.
+    header_summaries: Set[str] = field(default_factory=set)
+    # USRs of functions defined in headers whose bodies we walked/skipped
+    walked_header_fns: Set[str] = field(default_factory=set)
+    reused_header_fns: Set[str] = field(default_factory=set)
+
+    # Log of the changes made to existing scopes, kept when not None so they
+    # can be rolled back, see `_record` and `_undo_to`
+    _undo: Optional[List[Tuple[Any, Any, Any]]] = None
+
     def _get_new_scope_id(self) -> int:
         self._scope_id_vendor += 1
         return self._scope_id_vendor
 
+    def _record(self, target: Any, key: Any = None):
+        """Log the current state of `target` before changing it: the length of
+        a list, the value of `key` in a dict, or the attribute `key` of a
+        Scope"""
+        if self._undo is None:
+            return
+        if isinstance(target, list):
+            self._undo.append((target, len(target), None))
+        elif isinstance(target, dict):
+            self._undo.append((target, key, target.get(key, _MISSING)))
+        else:
+            self._undo.append((target, key, getattr(target, key)))
+
+    def _undo_to(self, n: int):
+        """Roll back the changes logged after the first `n` ones"""
+        assert self._undo is not None
+        while len(self._undo) > n:
+            target, key, old = self._undo.pop()
+            if isinstance(target, list):
+                del target[key:]
+            elif isinstance(target, dict):
+                if old is _MISSING:
+                    del target[key]
+                else:
+                    target[key] = old
+            else:
+                setattr(target, key, old)
+
+    def _cursor_hash(self, node: clang.cindex.Cursor) -> Hashable:
+        """Key used to identify the declaration `node` refers to"""
+        return node.hash
+
     def is_lambda(
         self, node: clang.cindex.Cursor, kind: CursorKind
     ) -> Optional[clang.cindex.Cursor]:
@@ -66,68 +155,209 @@ class Rainbow:
     def is_var_decl(self, kind: CursorKind) -> bool:
         return kind == CursorKind.VAR_DECL
 
+    def _file_contents(self, filename: str) -> bytes:
+        if filename not in self._source_cache:
+            with open(filename, "rb") as f:
+                self._source_cache[filename] = f.read()
+        return self._source_cache[filename]
+
+    def _operator_spelling(
+        self, left: clang.cindex.Cursor, right: clang.cindex.Cursor
+    ) -> Optional[str]:
+        """Find the operator between two operands by looking at the source
+        text between their extents. Returns None if the operator can't be
+        determined this way (e.g. the expression comes from a macro)."""
+        # SourceLocation.file and .offset each query libclang again, so unpack
+        # both locations in one call
+        start_file, _, _, start = left.extent.end._get_instantiation()
+        end_file, _, _, end = right.extent.start._get_instantiation()
+        if start >= end or not start_file or not end_file:
+            return None
+        filename = start_file.name
+        if filename != end_file.name:
+            return None
+        try:
+            contents = self._file_contents(filename)
+        except OSError:
+            return None
+        text = _COMMENT_RE.sub(b" ", contents[start:end]).strip()
+        op = text.decode(errors="replace")
+        return op if op in _BINARY_OPERATORS else None
+
+    def _operator_spelling_from_tokens(
+        self, node: clang.cindex.Cursor, left: clang.cindex.Cursor
+    ) -> Optional[str]:
+        op_offset = len(list(left.get_tokens()))
+
+        # Get the token at op_offset
+        op = None
+        for _, token in zip(range(op_offset + 1), node.get_tokens()):
+            op = token
+        return op.spelling if op else None
+
     def is_assignment(
         self, node: clang.cindex.Cursor, kind: CursorKind
     ) -> Optional[Tuple[clang.cindex.Cursor, clang.cindex.Cursor]]:
         if kind == CursorKind.BINARY_OPERATOR:
             children = list(node.get_children())
-            left_child_tokens = list(children[0].get_tokens())
-            op_offset = len(left_child_tokens)
-
-            # Get the token at op_offset
-            op = None
-            for _, token in zip(range(op_offset + 1), node.get_tokens()):
-                op = token
-            if not op:
+            if binary_operator_kind := _binary_operator_kind_fn():
+                if binary_operator_kind(node) == _CX_BINARY_OPERATOR_ASSIGN:
+                    return (children[0], children[1])
                 return None
 
-            if op.spelling == "=":
+            op = self._operator_spelling(children[0], children[1])
+            if op is None:
+                op = self._operator_spelling_from_tokens(node, children[0])
+
+            if op == "=":
                 return (children[0], children[1])
             return None
         return None
 
     def is_function(
         self, node: clang.cindex.Cursor, kind: CursorKind
-    ) -> Optional[Tuple[str, int]]:
+    ) -> Optional[Tuple[str, Hashable]]:
         """Determine if `node` is a function definition, and if so, return the name of the function called if possible"""
         if kind in [CursorKind.FUNCTION_DECL, CursorKind.FUNCTION_TEMPLATE]:
-            hash_ = node.hash
+            hash_ = self._cursor_hash(node)
             if defn := node.get_definition():
-                hash_ = defn.hash
+                hash_ = self._cursor_hash(defn)
             return node.spelling, hash_
         if self.is_lambda(node, kind):
             if not node.semantic_parent:
                 return None
             parent = node.semantic_parent
             if self.is_var_decl(parent.kind):
-                return (parent.spelling, parent.hash)
+                return (parent.spelling, self._cursor_hash(parent))
             raise Exception("Unnamed lambda unsupported")
         return None
 
-    def is_call(self, node: clang.cindex.Cursor) -> Optional[Tuple[str, int]]:
+    def is_callable_type(self, type_: clang.cindex.Type) -> bool:
+        """Whether a parameter of this type could be called. Only builtin
+        types, enums, classes without `operator()`, and pointers and references
+        to them are ruled out: dependent types such as template parameters
+        could be anything."""
+        type_ = type_.get_canonical()
+        while type_.kind in [
+            TypeKind.POINTER,
+            TypeKind.LVALUEREFERENCE,
+            TypeKind.RVALUEREFERENCE,
+            TypeKind.MEMBERPOINTER,
+        ]:
+            type_ = type_.get_pointee().get_canonical()
+
+        if type_.kind in [TypeKind.DEPENDENT, TypeKind.OVERLOAD]:
+            return True
+        if TypeKind.VOID.value <= type_.kind.value <= TypeKind.IBM128.value:
+            return False
+        if type_.kind == TypeKind.ENUM:
+            return False
+        if type_.kind == TypeKind.RECORD:
+            return self._has_call_operator(type_.get_declaration())
+        return True
+
+    def _has_call_operator(self, decl: clang.cindex.Cursor) -> bool:
+        defn = decl.get_definition()
+        if defn is None or len(list(defn.get_children())) == 0:
+            # libclang doesn't expose the members of implicit instantiations
+            # such as `std::function<int()>`, look at the template instead
+            get_template = clang.cindex.conf.lib.clang_getSpecializedCursorTemplate
+            if template := get_template(defn or decl):
+                defn = template.get_definition()
+        if defn is None:
+            # We can't tell what an incomplete class can do
+            return True
+        for c in defn.get_children():
+            if c.spelling == "operator()":
+                return True
+            if c.kind == CursorKind.CXX_BASE_SPECIFIER:
+                if self._has_call_operator(c.type.get_canonical().get_declaration()):
+                    return True
+        return False
+
+    def is_call(self, node: clang.cindex.Cursor) -> Optional[Tuple[str, Hashable]]:
         """Determine if `node` is a function call, and if so, return the name of the function called if possible"""
         if node.kind != CursorKind.CALL_EXPR:
             return None
         if (spelling := node.spelling) != "operator()":
-            return spelling, node.hash
+            return spelling, self._cursor_hash(node)
 
         for c in node.get_children():
             if c.kind == CursorKind.UNEXPOSED_EXPR:
                 if c.spelling == "operator()":
                     continue
-                return c.spelling, c.referenced.hash
+                return c.spelling, self._cursor_hash(c.referenced)
         return None
 
+    @property
+    def configs(self) -> List[Config]:
+        return [self.config] + self.extra_configs
+
+    def is_label(self, node: clang.cindex.Cursor) -> Optional[Tuple[str, str]]:
+        """Determine if `node` is a tag defining a color for any of the configs,
+        and if so, return the prefix and the color"""
+        if node.kind != CursorKind.ANNOTATE_ATTR:
+            return None
+
+        annotation = node.spelling
+        prefix = None
+        for config in self.configs:
+            if annotation.startswith(config.prefix):
+                if prefix is None or len(config.prefix) > len(prefix):
+                    prefix = config.prefix
+        if prefix is None:
+            return None
+
+        color = annotation[len(prefix) :]
+        for config in self.configs:
+            if config.prefix == prefix and color in config.colors:
+                return prefix, color
+        raise errors.UnknownColorError(node.location, color)
+
     def is_color(self, node: clang.cindex.Cursor) -> Optional[str]:
-        """Determine if `node` is a tag defining a color"""
-        if node.kind == CursorKind.ANNOTATE_ATTR:
-            if node.spelling.startswith(self.config.prefix):
-                color = node.spelling[len(self.config.prefix) :]
-                if color not in self.config.colors:
-                    raise errors.UnknownColorError(node.location, color)
+        """Determine if `node` is a tag defining a color of the primary config,
+        see `colors_of` for the colors of every config"""
+        if label := self.is_label(node):
+            prefix, color = label
+            if prefix == self.config.prefix:
                 return color
         return None
 
+    def colors_of(
+        self, nodes: List[clang.cindex.Cursor], what: str
+    ) -> Tuple[Optional[str], Dict[str, str]]:
+        """The color and the labels of the extra configs that `nodes` tag
+        `what` with"""
+        color: Optional[str] = None
+        labels: Dict[str, str] = {}
+        for node in nodes:
+            if not (label := self.is_label(node)):
+                continue
+            prefix, label_color = label
+            if prefix == self.config.prefix:
+                if color is not None:
+                    raise Exception(f"Multiple colors found for {what}")
+                color = label_color
+            else:
+                if prefix in labels:
+                    raise Exception(f"Multiple colors found for {what}")
+                labels[prefix] = label_color
+        return color, labels
+
+    def _check_labels(
+        self,
+        loc: clang.cindex.SourceLocation,
+        name: str,
+        labels: Dict[str, str],
+        new_labels: Dict[str, str],
+    ):
+        """Same as comparing colors, for the colors of the extra configs"""
+        for prefix in sorted(set(labels) | set(new_labels)):
+            if labels.get(prefix) != new_labels.get(prefix):
+                raise errors.InvalidAssignmentError(
+                    loc, name, labels.get(prefix), new_labels.get(prefix)
+                )
+
     def is_unsupported(self, kind: CursorKind):
         unsupported_types = [
             CursorKind.CLASS_TEMPLATE,
@@ -176,10 +406,11 @@ class Rainbow:
         loc: clang.cindex.SourceLocation,
         alias: str,
         color: Optional[str],
+        labels: Dict[str, str],
         original_fn_node: clang.cindex.Cursor,
         original_name: str,
     ) -> bool:
-        resolved = self._hash_to_scope.get(original_fn_node.hash)
+        resolved = self._hash_to_scope.get(self._cursor_hash(original_fn_node))
         if not resolved:
             resolved = scope.resolve_function(original_name)
 
@@ -188,26 +419,27 @@ class Rainbow:
 
         if resolved.color != color:
             raise errors.InvalidAssignmentError(loc, alias, color, resolved.color)
+        self._check_labels(loc, alias, labels, resolved.labels)
 
         scope_id = self._get_new_scope_id()
+        self._record(scope.functions, alias)
         alias = Scope.create_function(
             scope_id,
             scope,
             alias,
             resolved.color,
             resolved.params_to_colors,
+            resolved.labels,
+            resolved.params.keys(),
+            resolved.params_to_labels,
         )
+        alias.alias_of = resolved
         alias.register_call_scope(resolved)
         return True
 
     def _process_alias_decl(self, node: clang.cindex.Cursor, scope: Scope) -> bool:
         children = list(node.get_children())
-
-        color = None
-        for c in children[:-1]:
-            if child_color := self.is_color(c):
-                assert color is None
-                color = child_color
+        color, labels = self.colors_of(children[:-1], f"alias {node.spelling}")
 
         if len(children) < 1:
             return False
@@ -224,6 +456,7 @@ class Rainbow:
                         node.location,
                         node.spelling,
                         color,
+                        labels,
                         child.referenced,
                         child.spelling,
                     )
@@ -242,6 +475,7 @@ class Rainbow:
                                     node.location,
                                     node.spelling,
                                     color,
+                                    labels,
                                     child.referenced,
                                     child.spelling,
                                 )
@@ -277,56 +511,80 @@ class Rainbow:
                             lhs_fn.color,
                             rhs_fn.color,
                         )
+                    self._check_labels(
+                        lhs.location, lhs.spelling, lhs_fn.labels, rhs_fn.labels
+                    )
+                    for param in lhs_fn.params_to_colors:
+                        self._check_labels(
+                            lhs.location,
+                            f"{lhs.spelling}({param})",
+                            lhs_fn.params_to_labels.get(param, {}),
+                            rhs_fn.params_to_labels.get(param, {}),
+                        )
 
                     return self._process_alias_function(
                         scope,
                         lhs.location,
                         lhs.spelling,
                         lhs_fn.color,
+                        lhs_fn.labels,
                         child.referenced,
                         child.spelling,
                     )
         return False
 
     def _process_function(
-        self, fnname: str, hash_: int, node: clang.cindex.Cursor, scope: Scope
+        self, fnname: str, hash_: Hashable, node: clang.cindex.Cursor, scope: Scope
     ) -> Tuple[Optional[clang.cindex.Cursor], Scope]:
         # TODO Also need to do a pass verifing that all passed in params have
         # the right colors.
         params_to_colors: Dict[str, Optional[str]] = {}
+        params_to_labels: Dict[str, Dict[str, str]] = {}
+        callable_params: Set[str] = set()
         fn_color: Optional[str] = None
+        # Colors from the extra configs, keyed by prefix
+        fn_labels: Dict[str, str] = {}
         body: Optional[clang.cindex.Cursor] = None
+
+        def record_color(c: clang.cindex.Cursor) -> bool:
+            nonlocal fn_color
+            if not (label := self.is_label(c)):
+                return False
+            prefix, color = label
+            if prefix == self.config.prefix:
+                if fn_color is not None:
+                    raise Exception(f"Multiple colors found for function {fnname}")
+                fn_color = color
+            else:
+                if prefix in fn_labels:
+                    raise Exception(f"Multiple colors found for function {fnname}")
+                fn_labels[prefix] = color
+            return True
+
         if lambda_node := self.is_lambda(node, node.kind):
             parent = node.semantic_parent
             if parent:
                 for c in parent.get_children():
-                    if color := self.is_color(c):
-                        if fn_color is not None:
-                            raise Exception(
-                                f"Multiple colors found for function {fnname}"
-                            )
-                        fn_color = color
+                    record_color(c)
             node = lambda_node
 
         for c in node.get_children():
-            if color := self.is_color(c):
-                if fn_color is not None:
-                    raise Exception(f"Multiple colors found for function {fnname}")
-                fn_color = color
+            if record_color(c):
+                pass
             elif c.kind == CursorKind.PARM_DECL:
                 param_name = c.spelling
                 if not param_name:
                     param_name = f"!unnamed_param{len(params_to_colors)}"
-                param_color = None
-                for param_child in c.get_children():
-                    if color := self.is_color(param_child):
-                        if param_color is not None:
-                            raise Exception(
-                                f"Multiple colors found for param {param_name} of function {fnname}"
-                            )
-                        param_color = color
+                param_color, param_labels = self.colors_of(
+                    list(c.get_children()),
+                    f"param {param_name} of function {fnname}",
+                )
                 scope_id = self._get_new_scope_id()
                 params_to_colors[param_name] = param_color
+                if param_labels:
+                    params_to_labels[param_name] = param_labels
+                if self.is_callable_type(c.type):
+                    callable_params.add(param_name)
             elif self.is_scope(c.kind):
                 if body is not None:
                     raise Exception("?")
@@ -337,22 +595,42 @@ class Rainbow:
                 if fn.color != fn_color:
                     raise Exception(f"Multiple colors found for function {fnname}")
             else:
+                self._record(fn, "color")
                 fn.color = fn_color
 
+            for prefix, color in fn_labels.items():
+                if fn.labels.get(prefix, color) != color:
+                    raise Exception(f"Multiple colors found for function {fnname}")
+                self._record(fn.labels, prefix)
+                fn.labels[prefix] = color
+
             for param_name, param_color in params_to_colors.items():
-                if param_name in fn.params:
-                    if fn.params[param_name].color != param_color:
+                if param_name in fn.params_to_colors:
+                    param_labels = params_to_labels.get(param_name)
+                    if (
+                        fn.params_to_colors[param_name] != param_color
+                        or fn.params_to_labels.get(param_name) != param_labels
+                    ):
                         raise Exception(
                             f"Multiple colors found for param {param_name} of function {fnname}"
                         )
                 else:
                     raise Exception(
-                        f"Mismatched parameter names for {fn.name}! {list(fn.params.keys())} vs {list(params_to_colors.keys())}"
+                        f"Mismatched parameter names for {fn.name}! {list(fn.params_to_colors.keys())} vs {list(params_to_colors.keys())}"
                     )
         else:
             scope_id = self._get_new_scope_id()
+            self._record(scope.functions, fnname)
+            self._record(self._hash_to_scope, hash_)
             fn = Scope.create_function(
-                scope_id, scope, fnname, fn_color, params_to_colors
+                scope_id,
+                scope,
+                fnname,
+                fn_color,
+                params_to_colors,
+                fn_labels,
+                callable_params,
+                params_to_labels,
             )
             self._hash_to_scope[hash_] = fn
 
@@ -408,7 +686,8 @@ class Rainbow:
         child = children[0]
 
         if child.kind == CursorKind.DECL_REF_EXPR:
-            if child.referenced.hash not in self._hash_to_scope:
+            child_hash = self._cursor_hash(child.referenced)
+            if child_hash not in self._hash_to_scope:
                 try:
                     if fn := scope.resolve_function(child.spelling):
                         return fn
@@ -418,7 +697,7 @@ class Rainbow:
                     f"Found functional parameter {child.spelling}, but could not lookup defn"
                 )
                 return None
-            return self._hash_to_scope[child.referenced.hash]
+            return self._hash_to_scope[child_hash]
         elif child.kind == CursorKind.UNEXPOSED_EXPR:
             # We might have an anonymous lambda passed in as a parameter - treat
             # it as an uncolored functions, but parse function calls within
@@ -429,7 +708,7 @@ class Rainbow:
                 if child.kind == CursorKind.LAMBDA_EXPR:
                     fn_body, fn = self._process_function(
                         f"!unnamed_lambda{len(scope.functions)}",
-                        child.hash,
+                        self._cursor_hash(child),
                         child,
                         scope,
                     )
@@ -440,6 +719,22 @@ class Rainbow:
                     return fn
             return None
 
+    def _reuse_header_summary(
+        self, node: clang.cindex.Cursor, fn: Scope, scope: Scope
+    ) -> bool:
+        """Check if the body of the global function `fn`, defined in a header,
+        was already walked in another translation unit. If so, its callees are
+        already known and the body doesn't need to be walked again."""
+        if scope is not self._global_scope or fn.usr is None:
+            return False
+        if not node.location.file or node.location.file.name == self.tu.spelling:
+            return False
+        if fn.usr in self.header_summaries:
+            self.reused_header_fns.add(fn.usr)
+            return True
+        self.walked_header_fns.add(fn.usr)
+        return False
+
     def _process(self, root: clang.cindex.Cursor, r_scope: Scope):
         self._frontier = [(root, r_scope)]
         while len(self._frontier) > 0:
@@ -459,6 +754,7 @@ class Rainbow:
             if self.is_scope(kind):
                 scope_id = self._get_new_scope_id()
                 new_scope = Scope(scope_id, scope)
+                self._record(scope.child_scopes)
                 scope.child_scopes.append(new_scope)
                 self._frontier = [
                     (c, new_scope) for c in node.get_children()
@@ -468,6 +764,12 @@ class Rainbow:
             if result := self.is_function(node, kind):
                 fnname, hash_ = result
                 fn_body, fn = self._process_function(fnname, hash_, node, scope)
+                if kind in [CursorKind.FUNCTION_DECL, CursorKind.FUNCTION_TEMPLATE]:
+                    if fn.usr is None:
+                        self._record(fn, "usr")
+                        fn.usr = node.get_usr() or None
+                if fn_body and self._reuse_header_summary(node, fn, scope):
+                    continue
                 if fn_body:
                     self._frontier = [
                         (c, fn) for c in fn_body.get_children()
@@ -494,6 +796,7 @@ class Rainbow:
                     except errors.FunctionResolutionError:
                         fn = None
                 if fn:
+                    self._record(scope.called_functions)
                     scope.register_call_scope(fn)
                     params = list(node.get_children())[1:]
                     if (
@@ -502,15 +805,18 @@ class Rainbow:
                         and params[0].spelling == "operator()"
                     ):
                         params = params[1:]
-                    if len(params) != len(fn.params):
+                    param_names = list(fn.params_to_colors)
+                    if len(params) != len(param_names):
                         self.logger.warn(
                             f"Could not verify parameters passed into {fn.name} @ {node.location}"
                         )
                     else:
-                        for i, c, param_scope in zip(
-                            range(len(params)), params, fn.params.values()
+                        for i, c, param_name in zip(
+                            range(len(params)), params, param_names
                         ):
                             if param := self._is_fn_param(scope, c):
+                                self._record(fn.params, param_name)
+                                param_scope = fn.get_param(param_name)
                                 if param_scope.color:
                                     if (
                                         param.color is not None
@@ -522,11 +828,23 @@ class Rainbow:
                                             param_scope.color,
                                             param.color,
                                         )
+                                for prefix, color in param_scope.labels.items():
+                                    if param.labels.get(prefix, color) != color:
+                                        raise errors.InvalidAssignmentError(
+                                            node.location,
+                                            f"(Parameter {i} of {fnname})",
+                                            color,
+                                            param.labels[prefix],
+                                        )
+                                self._record(param_scope.called_functions)
                                 param_scope.register_call_scope(param)
                             else:
+                                param_color = fn.params_to_colors[param_name]
                                 assert (
-                                    param_scope.color is None
-                                ), f"{param_scope.name}, {param_scope.color}"
+                                    param_color is None
+                                ), f"{param_name}, {param_color}"
+                                param_labels = fn.params_to_labels.get(param_name)
+                                assert not param_labels, f"{param_name}, {param_labels}"
                                 continue
 
                 else:
@@ -535,8 +853,7 @@ class Rainbow:
                     self.logger.warning("Could not resolve function call %s" % fnname)
             self._frontier = [(c, scope) for c in node.get_children()] + self._frontier
 
-    def process(self) -> Scope:
-        """Process the input file and extract the call graph, and colors for every function"""
+    def _check_diagnostics(self):
         error_count = 0
         for diag in self.tu.diagnostics:
             if diag.severity == Diagnostic.Warning:
@@ -547,11 +864,25 @@ class Rainbow:
         if error_count > 0:
             raise errors.CPPSyntaxErrors()
 
+    def process(self) -> Scope:
+        """Process the input file and extract the call graph, and colors for every function"""
+        assert self.tu, "The translation unit was released"
+        self._check_diagnostics()
         self._process(self.tu.cursor, self._global_scope)
         return self._global_scope
 
+    def release(self):
+        """Drop the translation unit, and the cursors and file contents held on
+        to by the walker. The extracted call graph stays available, and the
+        translation unit can be freed once the caller drops its own references
+        to it."""
+        self.tu = None
+        self._frontier = []
+        self._source_cache = {}
+
     def should_reject(self) -> Optional[bool]:
-        return self.config.run(self._global_scope)
+        graph = Graph.from_scope(self._global_scope, self.config.collapse_aliases)
+        return run_configs(self.config, self.extra_configs, graph)
 
     def run(self) -> Optional[bool]:
         """Returns True if the program should be rejected, False if it should be
@@ -560,8 +891,137 @@ class Rainbow:
         return self.should_reject()
 
 
+@dataclass
+class Extraction:
+    """What is kept of a translation unit after its AST is released"""
+
+    source: str
+    includes: List[str]
+    graph: Graph
+    walked: Set[str]
+    reused: Set[str]
+
+
+def thread_local_parser(
+    cache: Optional[ASTCache] = None,
+) -> Callable[[str], clang.cindex.TranslationUnit]:
+    """A function that parses a source file, optionally through `cache`. A
+    libclang index must not be used by several threads at once, so every thread
+    that calls it gets its own."""
+    indexes = threading.local()
+
+    def parse(cpp_file: str) -> clang.cindex.TranslationUnit:
+        if not hasattr(indexes, "index"):
+            indexes.index = clang.cindex.Index.create()
+        if cache:
+            return cache.parse(indexes.index, cpp_file)
+        return indexes.index.parse(cpp_file)
+
+    return parse
+
+
+def extract(
+    cpp_file: str,
+    config: Config,
+    parse: Callable[[str], clang.cindex.TranslationUnit],
+    logger: logging.Logger,
+    extra_configs: List[Config],
+    header_summaries: Set[str],
+) -> Extraction:
+    """Parse and walk a single source file. The translation unit is disposed
+    of when this returns: nothing in the result refers to a cursor."""
+    tu = parse(cpp_file)
+    rainbow = Rainbow(
+        tu,
+        config,
+        logger=logger,
+        extra_configs=extra_configs,
+        header_summaries=header_summaries,
+    )
+    graph = Graph.from_scope(rainbow.process(), config.collapse_aliases)
+    rainbow.release()
+    includes = [i.include.name for i in tu.get_includes()]
+    return Extraction(
+        cpp_file,
+        includes,
+        graph,
+        rainbow.walked_header_fns,
+        rainbow.reused_header_fns,
+    )
+
+
+def analyze_project(
+    cpp_files: List[str],
+    config: Config,
+    parse: Callable[[str], clang.cindex.TranslationUnit],
+    logger: logging.Logger,
+    state: Optional[Path] = None,
+    changed: Optional[Set[str]] = None,
+    extra_configs: Optional[List[Config]] = None,
+    jobs: int = 1,
+) -> Optional[bool]:
+    """Extract the call graph of every file in `cpp_files` and check the
+    combined graph against `config` and `extra_configs`.
+
+    If `changed` is supplied, only files affected by the changed paths are
+    re-extracted, and the call graphs of all other files are loaded from
+    `state`. At most `jobs` translation units are parsed and walked at the
+    same time, which bounds how many ASTs are in memory."""
+    project = ProjectState.load(state) if state else ProjectState()
+    to_extract = cpp_files
+    if changed is not None:
+        to_extract = project.affected(cpp_files, changed)
+    logger.info(f"Extracting call graphs from {len(to_extract)} file(s)")
+
+    def record(result: Extraction):
+        project.update(
+            result.source,
+            result.includes,
+            result.graph,
+            result.walked,
+            result.reused,
+        )
+
+    project.retain(cpp_files)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while len(to_extract) > 0:
+            pending = list(reversed(to_extract))
+            in_flight: Set[Future] = set()
+            while pending or in_flight:
+                # Header summaries are computed at submission, so that sources
+                # submitted later can reuse what earlier sources walked
+                while pending and len(in_flight) < jobs:
+                    cpp_file = pending.pop()
+                    in_flight.add(
+                        pool.submit(
+                            extract,
+                            cpp_file,
+                            config,
+                            parse,
+                            logger,
+                            extra_configs or [],
+                            project.header_summaries(cpp_file),
+                        )
+                    )
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future.result())
+            # A source that walked a header function for others might not
+            # include that header anymore
+            to_extract = project.orphaned(cpp_files)
+    result = run_configs(
+        config,
+        extra_configs or [],
+        project.graph(cpp_files),
+        project.clean if state else None,
+    )
+    if state:
+        project.save(state)
+    return result
+
+
 @click.command(help="rainbow - arbitrary function coloring for c++!")
-@click.argument("cpp_file")
+@click.argument("cpp_files", nargs=-1, required=True)
 @click.argument("config_file")
 @click.option("-c", "--clangLocation", type=Path, help="Path to libclang.so")
 @click.option(
@@ -571,12 +1031,83 @@ class Rainbow:
     help="Increase verbosity (can be supplied multiple times)",
 )
 @click.option("-q", "--quiet", is_flag=True, help="Suppress output")
+@click.option(
+    "--ast-cache",
+    type=Path,
+    help="Directory to save parsed translation units in and reload them from",
+)
+@click.option(
+    "--ast-cache-max-size",
+    type=int,
+    help="Evict the least recently used ASTs once the cache exceeds this many bytes",
+)
+@click.option(
+    "--ast-cache-max-age",
+    type=float,
+    help="Evict ASTs that have not been used for this many seconds",
+)
+@click.option(
+    "--verdict-cache",
+    type=Path,
+    help="Directory to save verdicts in, reused when the call graph is unchanged",
+)
+@click.option(
+    "--state",
+    type=Path,
+    help="File to store the call graph of every source file in between runs",
+)
+@click.option(
+    "--changed",
+    multiple=True,
+    help="Only re-analyze sources affected by this path (requires --state)",
+)
+@click.option(
+    "--changed-since",
+    help="Only re-analyze sources affected by changes since this git revision "
+    + "(requires --state)",
+)
+@click.option(
+    "--config",
+    "extra_config_files",
+    multiple=True,
+    help="Additional config to check against the same call graph "
+    + "(can be supplied multiple times)",
+)
+@click.option(
+    "--fail-fast",
+    is_flag=True,
+    help="Stop checking patterns after the first one that finds errors",
+)
+@click.option(
+    "--cost-history",
+    type=Path,
+    help="File to record how long every pattern takes in, cheaper patterns run "
+    + "first",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of source files to parse and walk at the same time",
+)
 def main(
-    cpp_file: str,
+    cpp_files: List[str],
     config_file: str,
     clanglocation: Optional[Path],
     verbose: int,
     quiet: bool,
+    ast_cache: Optional[Path],
+    ast_cache_max_size: Optional[int],
+    ast_cache_max_age: Optional[float],
+    verdict_cache: Optional[Path],
+    state: Optional[Path],
+    changed: List[str],
+    changed_since: Optional[str],
+    extra_config_files: List[str],
+    fail_fast: bool,
+    cost_history: Optional[Path],
+    jobs: int,
 ):
     if not clanglocation:
         clanglocation = Path("/usr/lib/x86_64-linux-gnu/libclang-15.so.1")
@@ -600,16 +1131,62 @@ def main(
     if verbose < 3:
         warnings.filterwarnings("ignore")
 
+    if (changed or changed_since) and not state:
+        print("--changed and --changed-since require --state", file=sys.stderr)
+        sys.exit(1)
+
     config = Config.from_json(Path(config_file), logger=logger)
+    extra_configs = [
+        Config.from_json(Path(f), logger=logger.getChild(f"config{i}"))
+        for i, f in enumerate(extra_config_files)
+    ]
+
+    for c in [config] + extra_configs:
+        c.fail_fast = fail_fast
+
+    if verdict_cache:
+        verdicts = VerdictCache(verdict_cache, logger.getChild("cache"))
+        for c in [config] + extra_configs:
+            c.verdict_cache = verdicts
+
+    if cost_history:
+        history = CostHistory.load(cost_history)
+        for c in [config] + extra_configs:
+            c.cost_history = history
+
+    cache = None
+    if ast_cache:
+        cache = ASTCache(
+            ast_cache, ast_cache_max_size, ast_cache_max_age, logger.getChild("cache")
+        )
+    parse = thread_local_parser(cache)
+
+    changed_paths = None
+    if changed or changed_since:
+        changed_paths = {normalize_path(p) for p in changed}
+        if changed_since:
+            changed_paths |= files_changed_since(changed_since)
 
-    index = clang.cindex.Index.create()
-    tu = index.parse(cpp_file)
     # TODO set compilation db if it exists
-    rainbow = Rainbow(tu, config, logger=logger)
     try:
-        found_invalid = rainbow.run()
+        if len(cpp_files) == 1 and not state:
+            rainbow = Rainbow(
+                parse(cpp_files[0]), config, logger=logger, extra_configs=extra_configs
+            )
+            found_invalid = rainbow.run()
+        else:
+            found_invalid = analyze_project(
+                list(cpp_files),
+                config,
+                parse,
+                logger,
+                state,
+                changed_paths,
+                extra_configs,
+                jobs,
+            )
     except Exception as e:
-        rainbow.logger.error(str(e))
+        logger.error(str(e))
         raise e
         sys.exit(1)
 
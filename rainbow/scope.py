@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set
 
 from rainbow.errors import FunctionResolutionError
+from rainbow.graph import Graph
 
 
 @dataclass
@@ -18,13 +19,36 @@ class Scope:
     color: Optional[str] = None
     params_to_colors: Dict[str, Optional[str]] = field(default_factory=dict)
     is_param: bool = False
+    # Colors from additional configs, keyed by the config's prefix
+    labels: Dict[str, str] = field(default_factory=dict)
+    # Same as `labels`, for every parameter that has any
+    params_to_labels: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    # Clang USR of the function's declaration, identifies the function across
+    # translation units
+    usr: Optional[str] = None
+    # The function this one is an alias of, for `auto alias = fn;` and
+    # `alias = fn;`
+    alias_of: Optional["Scope"] = None
+    # Parameters that get a Scope up front, in addition to colored ones. None
+    # means every parameter. The others only get one when a function is passed
+    # to them, see `get_param`.
+    callable_params: Optional[Set[str]] = None
 
     params: Dict[str, "Scope"] = field(init=False)
 
     def __post_init__(self):
         params = {}
         for param, pcolor in self.params_to_colors.items():
-            params[param] = Scope.create_param(self.id_, self, param, pcolor)
+            labels = self.params_to_labels.get(param)
+            if (
+                self.callable_params is None
+                or param in self.callable_params
+                or pcolor is not None
+                or labels
+            ):
+                params[param] = Scope.create_param(
+                    self.id_, self, param, pcolor, labels
+                )
         self.params = params
 
     @classmethod
@@ -39,16 +63,51 @@ class Scope:
         name: str,
         color: Optional[str],
         params: Dict[str, Optional[str]],
+        labels: Optional[Dict[str, str]] = None,
+        callable_params: Optional[Iterable[str]] = None,
+        param_labels: Optional[Dict[str, Dict[str, str]]] = None,
     ) -> "Scope":
-        fs = Scope(id_, parent, name=name, color=color, params_to_colors=params)
+        fs = Scope(
+            id_,
+            parent,
+            name=name,
+            color=color,
+            params_to_colors=params,
+            labels=dict(labels or {}),
+            callable_params=None if callable_params is None else set(callable_params),
+            params_to_labels={
+                param: dict(labels) for param, labels in (param_labels or {}).items()
+            },
+        )
         parent.functions[name] = fs
         return fs
 
     @classmethod
     def create_param(
-        cls, id_: int, parent: "Scope", name: str, color: Optional[str]
+        cls,
+        id_: int,
+        parent: "Scope",
+        name: str,
+        color: Optional[str],
+        labels: Optional[Dict[str, str]] = None,
     ) -> "Scope":
-        return Scope(id_, parent, name=name, color=color, is_param=True)
+        return Scope(
+            id_,
+            parent,
+            name=name,
+            color=color,
+            is_param=True,
+            labels=dict(labels or {}),
+        )
+
+    def get_param(self, name: str) -> "Scope":
+        """The Scope of the parameter `name`, created on first use for
+        parameters that didn't get one up front"""
+        if name not in self.params:
+            color = self.params_to_colors[name]
+            labels = self.params_to_labels.get(name)
+            self.params[name] = Scope.create_param(self.id_, self, name, color, labels)
+        return self.params[name]
 
     def register_call_scope(self, fn: "Scope"):
         self.called_functions.append(fn)
@@ -92,33 +151,6 @@ class Scope:
         assert self.name
         return f"`{name}__param__{self.name}__{self.id_}`"
 
-    def _scope_fns_to_cypher(self, first: bool, output: str) -> Tuple[bool, str]:
-        def fn_to_cypher(fn: Scope) -> str:
-            def cypher_node(alias, name, color) -> str:
-                color_str = f":{color}" if color else ""
-                return f"({alias}{color_str} {{name: '{name}'}})"
-
-            output = cypher_node(fn.alias(), fn.name, fn.color)
-            for param, param_scope in fn.params.items():
-                if not param:
-                    continue
-                output += ", "
-                output += fn_to_cypher(param_scope)
-            return output
-
-        for f in self.functions:
-            if not first:
-                output += ",\n  "
-            first = False
-
-            fn = self.functions[f]
-            output += fn_to_cypher(fn)
-            first, output = fn._scope_fns_to_cypher(first, output)
-
-        for c in self.child_scopes:
-            first, output = c._scope_fns_to_cypher(first, output)
-        return (first, output)
-
     def resolve_function(self, fnname: str) -> Optional["Scope"]:
         if self.name and self.name == fnname:
             return self
@@ -129,49 +161,22 @@ class Scope:
         if fnname in self.params:
             return self.params[fnname]
 
+        if fnname in self.params_to_colors:
+            # Parameters that can't be called still shadow outer functions
+            return None
+
         if not self.parent_scope:
             return None
         return self.parent_scope.resolve_function(fnname)
 
-    def _calls_to_cypher(self):
-        def resolve_called_functions(s: Scope, ret_val: List[Scope]):
-            ret_val += s.called_functions
-            for cs in s.child_scopes:
-                resolve_called_functions(cs, ret_val)
-
-        def scope_calls_to_cypher(fn: Scope, output: str) -> str:
-            called = []
-            resolve_called_functions(fn, called)
-            for c in called:
-                output += ",\n  "
-                output += f"({fn.alias()}) -[:CALLS]-> ({c.alias()})"
-            for fn_scope in fn.params.values():
-                output = scope_calls_to_cypher(fn_scope, output)
-            for fn_scope in fn.functions.values():
-                output = scope_calls_to_cypher(fn_scope, output)
-            return output
-
-        def scope_functions_to_cypher(scope: Scope, output: str) -> str:
-            for fn_def in scope.functions.values():
-                output = scope_calls_to_cypher(fn_def, output)
-                output = scope_functions_to_cypher(fn_def, output)
-            for child_scope in scope.child_scopes:
-                output = scope_functions_to_cypher(child_scope, output)
-            return output
-
-        output = ""
-        for fn in self.functions.values():
-            output = scope_calls_to_cypher(fn, output)
-            output = scope_functions_to_cypher(fn, output)
-        return output
-
     def to_cypher(self) -> str:
         """Must only be called after `self.process`.
         Outputs the call graph as an openCypher CREATE query, tagging all functions with their colors
         """
+        return Graph.from_scope(self).to_cypher()
 
-        _, output = self._scope_fns_to_cypher(True, "")
-        output += self._calls_to_cypher()
-        if output == "":
-            return "RETURN 0"
-        return "CREATE " + output
+    def iter_cypher(self) -> Iterator[str]:
+        """Must only be called after `self.process`.
+        Same as `to_cypher`, but yields the query in chunks, see `Graph.iter_cypher`
+        """
+        return Graph.from_scope(self).iter_cypher()
@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from rainbow.executors import Executor
+from rainbow.graph import Graph
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<str>'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")"
+    + r"|(?P<op>-->|<--|->|<-|-)"
+    + r"|(?P<ident>[A-Za-z_]\w*|`[^`]+`)"
+    + r"|(?P<punct>[()\[\]{}:,=*.]))"
+)
+
+_SCHEMA = [
+    "DROP TABLE IF EXISTS nodes",
+    "DROP TABLE IF EXISTS labels",
+    "DROP TABLE IF EXISTS edges",
+    "CREATE TABLE nodes (id INTEGER PRIMARY KEY, alias TEXT, name TEXT)",
+    "CREATE TABLE labels (node INTEGER, label TEXT)",
+    "CREATE TABLE edges (src INTEGER, dst INTEGER)",
+]
+
+_INDEXES = [
+    "CREATE INDEX labels_by_label ON labels (label, node)",
+    "CREATE INDEX labels_by_node ON labels (node, label)",
+    "CREATE INDEX edges_by_src ON edges (src, dst)",
+    "CREATE INDEX edges_by_dst ON edges (dst, src)",
+]
+
+
+class UnsupportedPattern(Exception):
+    pass
+
+
+@dataclass
+class _Node:
+    var: Optional[str]
+    labels: List[str] = field(default_factory=list)
+    props: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class _Rel:
+    types: List[str]
+    variable_length: bool
+    reverse: bool
+
+
+@dataclass
+class _Path:
+    var: Optional[str]
+    nodes: List[_Node]
+    rels: List[_Rel]
+
+
+# WHERE clauses are parsed into tuples:
+#   ("and", lhs, rhs), ("or", lhs, rhs), ("not", expr)
+#   ("labels", var, [labels])            var:A:B
+#   ("pattern", _Path)                   (x)-->(:A)
+#   ("any", var, path_var, expr)         any(var IN nodes(path_var) WHERE expr)
+Expr = Tuple
+
+
+class _Parser:
+    """Parser for the subset of openCypher patterns that SQLiteExecutor can
+    translate"""
+
+    def __init__(self, text: str):
+        self.tokens: List[str] = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _TOKEN_RE.match(text, pos)
+            if not m or m.end() == pos:
+                raise UnsupportedPattern(f"Unexpected input: {text[pos:]}")
+            token = m.group(m.lastgroup) if m.lastgroup else ""
+            if m.lastgroup == "ident" and token.startswith("`"):
+                token = token[1:-1]
+            self.tokens.append(token)
+            pos = m.end()
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> Optional[str]:
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return None
+
+    def next(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise UnsupportedPattern("Unexpected end of pattern")
+        self.pos += 1
+        return token
+
+    def expect(self, expected: str):
+        token = self.next()
+        if token.upper() != expected.upper():
+            raise UnsupportedPattern(f"Expected {expected}, found {token}")
+
+    def accept(self, expected: str) -> bool:
+        token = self.peek()
+        if token is not None and token.upper() == expected.upper():
+            self.pos += 1
+            return True
+        return False
+
+    def identifier(self) -> str:
+        token = self.next()
+        if not re.match(r"^\w+$", token):
+            raise UnsupportedPattern(f"Expected an identifier, found {token}")
+        return token
+
+    def parse_match(self) -> Tuple[_Path, Optional[Expr]]:
+        path_var = None
+        if self.peek(1) == "=":
+            path_var = self.identifier()
+            self.expect("=")
+        path = self.parse_path()
+        path.var = path_var
+
+        where = None
+        if self.accept("WHERE"):
+            where = self.parse_or()
+        if self.peek() is not None:
+            raise UnsupportedPattern(f"Unexpected {self.peek()}")
+        return path, where
+
+    def parse_path(self) -> _Path:
+        nodes = [self.parse_node()]
+        rels = []
+        while self.peek() in ["-->", "<--", "-", "<-"]:
+            rels.append(self.parse_rel())
+            nodes.append(self.parse_node())
+        return _Path(None, nodes, rels)
+
+    def parse_node(self) -> _Node:
+        self.expect("(")
+        node = _Node(None)
+        if self.peek() not in [":", "{", ")"]:
+            node.var = self.identifier()
+        while self.accept(":"):
+            node.labels.append(self.identifier())
+        if self.accept("{"):
+            while not self.accept("}"):
+                key = self.identifier()
+                self.expect(":")
+                value = self.next()
+                if value[0] not in "'\"":
+                    raise UnsupportedPattern("Only string properties are supported")
+                node.props[key] = value[1:-1]
+                self.accept(",")
+        self.expect(")")
+        return node
+
+    def parse_rel(self) -> _Rel:
+        token = self.next()
+        if token == "-->":
+            return _Rel([], False, False)
+        if token == "<--":
+            return _Rel([], False, True)
+
+        reverse = token == "<-"
+        self.expect("[")
+        types = []
+        variable_length = False
+        if self.peek() not in [":", "*", "]"]:
+            raise UnsupportedPattern("Relationship variables are not supported")
+        if self.accept(":"):
+            types.append(self.identifier())
+        if self.accept("*"):
+            variable_length = True
+        self.expect("]")
+        end = self.next()
+        if (reverse and end != "-") or (not reverse and end != "->"):
+            raise UnsupportedPattern("Undirected relationships are not supported")
+        return _Rel(types, variable_length, reverse)
+
+    def parse_or(self) -> Expr:
+        expr = self.parse_and()
+        while self.accept("OR"):
+            expr = ("or", expr, self.parse_and())
+        return expr
+
+    def parse_and(self) -> Expr:
+        expr = self.parse_not()
+        while self.accept("AND"):
+            expr = ("and", expr, self.parse_not())
+        return expr
+
+    def parse_not(self) -> Expr:
+        if self.accept("NOT"):
+            return ("not", self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self) -> Expr:
+        if self.peek() == "(":
+            # Either a pattern predicate or a parenthesized expression
+            start = self.pos
+            try:
+                path = self.parse_path()
+                if len(path.rels) > 0:
+                    return ("pattern", path)
+            except UnsupportedPattern:
+                pass
+            self.pos = start
+            self.expect("(")
+            expr = self.parse_or()
+            self.expect(")")
+            return expr
+
+        if (self.peek() or "").upper() == "ANY" and self.peek(1) == "(":
+            self.next()
+            self.expect("(")
+            var = self.identifier()
+            self.expect("IN")
+            self.expect("nodes")
+            self.expect("(")
+            path_var = self.identifier()
+            self.expect(")")
+            self.expect("WHERE")
+            expr = self.parse_or()
+            self.expect(")")
+            return ("any", var, path_var, expr)
+
+        var = self.identifier()
+        labels = []
+        while self.accept(":"):
+            labels.append(self.identifier())
+        if not labels:
+            raise UnsupportedPattern(f"Unsupported expression at {var}")
+        return ("labels", var, labels)
+
+
+# `[n IN nodes(p) | n.name]`, optionally followed by the first label of every
+# node, the way examples/full/config.json reports call chains
+_CHAIN_RE = re.compile(
+    r"^\s*\[\s*(?P<var>\w+)\s+IN\s+nodes\s*\(\s*(?P<path>\w+)\s*\)\s*\|"
+    + r"\s*(?P=var)\s*\.\s*name\s*(?P<label>\+\s*\(\s*\[\s*(?P<l>\w+)\s+IN"
+    + r"\s+labels\s*\(\s*(?P=var)\s*\)\s*\|\s*(?P<q>['\"]):(?P=q)\s*\+\s*(?P=l)"
+    + r"\s*\]\s*\+\s*\[\s*(?P<q2>['\"])(?P=q2)\s*\]\s*\)\s*\[\s*0\s*\]\s*)?\]\s*$",
+    re.IGNORECASE,
+)
+
+
+def _chain_projection(value: str) -> Optional[Tuple[str, bool]]:
+    """The path variable of a projection that lists the nodes of a path, and
+    whether the nodes are followed by their label"""
+    m = _CHAIN_RE.match(value)
+    if not m:
+        return None
+    return m.group("path"), m.group("label") is not None
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _not_in_trail(rowid: str, trail: str) -> str:
+    return f"instr({trail}.trail, ',' || {rowid} || ',') = 0"
+
+
+def _conjuncts(expr: Optional[Expr]) -> List[Expr]:
+    if expr is None:
+        return []
+    if expr[0] == "and":
+        return _conjuncts(expr[1]) + _conjuncts(expr[2])
+    return [expr]
+
+
+@dataclass
+class _Select:
+    ctes: List[str] = field(default_factory=list)
+    tables: List[str] = field(default_factory=list)
+    conditions: List[str] = field(default_factory=list)
+    # Variable -> SQL expression for the id of the node bound to it
+    bindings: Dict[str, str] = field(default_factory=dict)
+    # SQL expression for the ids of the nodes on the path, separated by
+    # commas, if requested
+    path: Optional[str] = None
+
+    def to_sql(self, columns: str) -> str:
+        sql = ""
+        if self.ctes:
+            sql += "WITH RECURSIVE " + ", ".join(self.ctes) + " "
+        sql += f"SELECT {columns}"
+        if self.tables:
+            sql += " FROM " + ", ".join(self.tables)
+        if self.conditions:
+            sql += " WHERE " + " AND ".join(self.conditions)
+        return sql
+
+
+class _Translator:
+    """Translates a parsed pattern to SQL over the nodes/labels/edges tables"""
+
+    def __init__(self):
+        self.counter = 0
+
+    def _alias(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def node_conditions(self, id_: str, node: _Node) -> List[str]:
+        conditions = [
+            f"EXISTS (SELECT 1 FROM labels WHERE node = {id_} AND label = {_quote(l)})"
+            for l in node.labels
+        ]
+        for key, value in node.props.items():
+            if key != "name":
+                raise UnsupportedPattern(f"Unsupported property {key}")
+            conditions.append(
+                f"EXISTS (SELECT 1 FROM nodes WHERE id = {id_} AND name = {_quote(value)})"
+            )
+        return conditions
+
+    def expression(self, expr: Expr, bindings: Dict[str, str]) -> str:
+        kind = expr[0]
+        if kind == "and":
+            lhs = self.expression(expr[1], bindings)
+            return f"({lhs} AND {self.expression(expr[2], bindings)})"
+        if kind == "or":
+            lhs = self.expression(expr[1], bindings)
+            return f"({lhs} OR {self.expression(expr[2], bindings)})"
+        if kind == "not":
+            return f"(NOT {self.expression(expr[1], bindings)})"
+        if kind == "labels":
+            if expr[1] not in bindings:
+                raise UnsupportedPattern(f"Unknown variable {expr[1]}")
+            return " AND ".join(
+                self.node_conditions(bindings[expr[1]], _Node(None, expr[2]))
+            )
+        if kind == "pattern":
+            select = self.select(expr[1], None, bindings)
+            return f"EXISTS ({select.to_sql('1')})"
+        raise UnsupportedPattern(f"Unsupported expression {kind}")
+
+    def select(
+        self,
+        path: _Path,
+        where: Optional[Expr],
+        outer: Dict[str, str],
+        with_path: bool = False,
+    ) -> _Select:
+        result = _Select()
+        bindings = dict(outer)
+
+        # `NOT any(n IN nodes(p) WHERE ...)` restricts every node on the path
+        restrictions = []
+        remaining = []
+        for conjunct in _conjuncts(where):
+            if (
+                conjunct[0] == "not"
+                and conjunct[1][0] == "any"
+                and conjunct[1][2] == path.var
+            ):
+                restrictions.append(conjunct[1])
+            else:
+                remaining.append(conjunct)
+
+        def allowed(id_: str) -> List[str]:
+            return [
+                f"NOT {self.expression(expr, {var: id_})}"
+                for _, var, _, expr in restrictions
+            ]
+
+        ids = []
+        for node in path.nodes:
+            if node.var and node.var in outer:
+                id_ = outer[node.var]
+            else:
+                alias = self._alias("n")
+                result.tables.append(f"nodes AS {alias}")
+                id_ = f"{alias}.id"
+                if node.var in bindings:
+                    result.conditions.append(f"{id_} = {bindings[node.var]}")
+                elif node.var:
+                    bindings[node.var] = id_
+            result.conditions += self.node_conditions(id_, node)
+            result.conditions += allowed(id_)
+            ids.append(id_)
+
+        # A variable length relationship on its own only needs reachability.
+        # Otherwise every trail is enumerated, to project the path and to keep
+        # the relationships of the pattern from sharing an edge.
+        trails = with_path or (
+            len(path.rels) > 1 and any(rel.variable_length for rel in path.rels)
+        )
+        fixed_edges: List[str] = []
+        trail_rels: List[str] = []
+        # SQL expression for the nodes between the ends of every relationship
+        via: List[Optional[str]] = []
+        for i, rel in enumerate(path.rels):
+            src, dst = ids[i], ids[i + 1]
+            src_node = path.nodes[i]
+            if rel.reverse:
+                src, dst = dst, src
+                src_node = path.nodes[i + 1]
+
+            if rel.types and "CALLS" not in rel.types:
+                result.conditions.append("0")
+
+            if not rel.variable_length:
+                edge = self._alias("e")
+                result.tables.append(f"edges AS {edge}")
+                result.conditions.append(f"{edge}.src = {src}")
+                result.conditions.append(f"{edge}.dst = {dst}")
+                for other in fixed_edges:
+                    result.conditions.append(f"{edge}.rowid != {other}.rowid")
+                for other in trail_rels:
+                    result.conditions.append(_not_in_trail(f"{edge}.rowid", other))
+                fixed_edges.append(edge)
+                via.append(None)
+                continue
+
+            seed = ["1"]
+            seed += self.node_conditions("e.src", src_node)
+            seed += allowed("e.src") + allowed("e.dst")
+            step = ["1"] + allowed("e.dst")
+            cte = self._alias("reach")
+            alias = self._alias("r")
+            if not trails:
+                # Every node reachable from a candidate start node, in one or
+                # more hops, without passing through a restricted node
+                result.ctes.append(
+                    f"{cte}(start, node) AS ("
+                    + "SELECT e.src, e.dst FROM edges AS e WHERE "
+                    + " AND ".join(seed)
+                    + f" UNION SELECT r.start, e.dst FROM {cte} AS r"
+                    + " JOIN edges AS e ON e.src = r.node WHERE "
+                    + " AND ".join(step)
+                    + ")"
+                )
+            else:
+                # Same, but one row per trail: `trail` holds the rowids of its
+                # edges and `via` the nodes between its ends, both with leading
+                # commas. `via` is in the order of the pattern.
+                if rel.reverse:
+                    extend = "',' || r.node || r.via"
+                else:
+                    extend = "r.via || ',' || r.node"
+                step.append(_not_in_trail("e.rowid", "r"))
+                result.ctes.append(
+                    f"{cte}(start, node, trail, via) AS ("
+                    + "SELECT e.src, e.dst, ',' || e.rowid || ',', ''"
+                    + " FROM edges AS e WHERE "
+                    + " AND ".join(seed)
+                    + " UNION ALL SELECT r.start, e.dst,"
+                    + f" r.trail || e.rowid || ',', {extend} FROM {cte} AS r"
+                    + " JOIN edges AS e ON e.src = r.node WHERE "
+                    + " AND ".join(step)
+                    + ")"
+                )
+                for other in fixed_edges:
+                    result.conditions.append(_not_in_trail(f"{other}.rowid", alias))
+                for other in trail_rels:
+                    result.conditions.append(
+                        "NOT EXISTS (SELECT 1 FROM edges AS e WHERE "
+                        + f"NOT {_not_in_trail('e.rowid', alias)} AND "
+                        + f"NOT {_not_in_trail('e.rowid', other)})"
+                    )
+                trail_rels.append(alias)
+            result.tables.append(f"{cte} AS {alias}")
+            result.conditions.append(f"{alias}.start = {src}")
+            result.conditions.append(f"{alias}.node = {dst}")
+            via.append(f"{alias}.via")
+
+        if with_path:
+            parts = [ids[0]]
+            for i, nodes in enumerate(via):
+                if nodes is not None:
+                    parts.append(nodes)
+                parts += ["','", ids[i + 1]]
+            result.path = "(" + " || ".join(parts) + ")"
+
+        for conjunct in remaining:
+            result.conditions.append(self.expression(conjunct, bindings))
+        result.bindings = {k: v for k, v in bindings.items() if k not in outer}
+        return result
+
+
+def translate(
+    match_pattern: str,
+    on_match: Optional[Dict[str, str]],
+    return_rows: bool,
+    limit: Optional[int] = None,
+) -> Tuple[str, List[str], Dict[str, bool]]:
+    """Translate a pattern to a SQL query and the names of its columns. The
+    columns that list the nodes of the path hold their ids, see
+    `SQLiteExecutor.chain`, and are returned along with whether the nodes are
+    reported with their label. `limit` bounds the number of rows returned by
+    queries that return rows."""
+    suffix = f" LIMIT {int(limit)}" if limit is not None else ""
+    path, where = _Parser(match_pattern).parse_match()
+    chains = {}
+    for key, value in (on_match or {}).items():
+        if chain := _chain_projection(value):
+            if chain[0] != path.var:
+                raise UnsupportedPattern(f"Unknown path {chain[0]}")
+            chains[key] = chain[1]
+    select = _Translator().select(path, where, {}, len(chains) > 0)
+
+    def name_of(var: str) -> str:
+        if var not in select.bindings:
+            raise UnsupportedPattern(f"Unknown variable {var}")
+        return f"(SELECT name FROM nodes WHERE id = {select.bindings[var]})"
+
+    if on_match:
+        columns = []
+        for key, value in on_match.items():
+            if key in chains:
+                columns.append(f"{select.path} AS {_quote(key)}")
+                continue
+            m = re.match(r"^\s*(\w+)(?:\s*\.\s*name)?\s*$", value)
+            if not m:
+                raise UnsupportedPattern(f"Unsupported projection {value}")
+            columns.append(f"{name_of(m.group(1))} AS {_quote(key)}")
+        if chains:
+            # Distinct paths can have the same chain of names, the rows are
+            # deduplicated and limited once the names are known
+            suffix = ""
+        sql = select.to_sql("DISTINCT " + ", ".join(columns))
+        return sql + suffix, list(on_match), chains
+    if return_rows:
+        variables = list(select.bindings)
+        columns = [f"{name_of(v)} AS {_quote(v)}" for v in variables]
+        return select.to_sql(", ".join(columns) or "1") + suffix, variables, chains
+    return f"SELECT EXISTS ({select.to_sql('1')})", ["invalidcalls"], chains
+
+
+class SQLiteExecutor(Executor):
+    """Evaluate patterns with SQLite.
+
+    The call graph is stored in `nodes`, `labels` and `edges` tables, in memory
+    or in the file given by the `path` option. Patterns are translated to SQL,
+    using recursive common table expressions for variable length
+    relationships. Only a subset of openCypher is supported: chains of nodes
+    with labels and `name` properties, `-->`, `-[:CALLS]->` and
+    `-[:CALLS*]->` relationships, WHERE clauses made of label checks, pattern
+    predicates and `NOT any(n IN nodes(p) WHERE ...)`, and `on_match`
+    projections of `var.name` and `[n IN nodes(p) | n.name]` (optionally
+    followed by the first label of `n`, as in examples/full/config.json). As in
+    openCypher, no edge is used twice by one match. Other patterns have an
+    unknown result."""
+
+    interruptible = True
+
+    def load(self, graph: Graph):
+        self.db = sqlite3.connect(self.options.get("path", ":memory:"))
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+
+        ids: Dict[str, int] = {}
+        rows = []
+        labels = []
+        # How nodes are reported in chains, by id
+        self.names: Dict[int, Optional[str]] = {}
+        self.labels: Dict[int, str] = {}
+        for alias, node in graph.nodes.items():
+            ids[alias] = len(ids)
+            rows.append((ids[alias], alias, node.name))
+            self.names[ids[alias]] = node.name
+            if node.color:
+                labels.append((ids[alias], node.color))
+                self.labels[ids[alias]] = node.color
+        edges = []
+        for src, dst in graph.edges:
+            for alias in [src, dst]:
+                # Edges can refer to anonymous nodes, see Graph.get_node
+                if alias not in ids:
+                    ids[alias] = len(ids)
+                    rows.append((ids[alias], alias, None))
+                    self.names[ids[alias]] = None
+            edges.append((ids[src], ids[dst]))
+
+        self.db.executemany("INSERT INTO nodes VALUES (?, ?, ?)", rows)
+        self.db.executemany("INSERT INTO labels VALUES (?, ?)", labels)
+        self.db.executemany("INSERT INTO edges VALUES (?, ?)", edges)
+        for statement in _INDEXES:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def query(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        self.config.logger.warning("The sqlite executor can't run openCypher queries")
+        return None
+
+    def run_pattern(self, pattern) -> Optional[List[Dict[str, Any]]]:
+        try:
+            sql, columns, chains = translate(
+                pattern.match_pattern,
+                pattern.on_match,
+                pattern.error_msg is not None,
+                pattern.max_messages,
+            )
+        except UnsupportedPattern as e:
+            self.config.logger.warning(
+                f"Unsupported pattern for the sqlite executor ({e}): "
+                + pattern.match_pattern
+            )
+            return None
+
+        rows = []
+        try:
+            for row in self.db.execute(sql):
+                rows.append(dict(zip(columns, row)))
+        except sqlite3.OperationalError as e:
+            # Raised when the query is interrupted, see `interrupt`
+            self.config.logger.warning(f"sqlite query failed: {e}")
+            return None
+        if columns == ["invalidcalls"]:
+            # Same as `RETURN true AS invalidcalls LIMIT 1`
+            return [{"invalidcalls": True}] if rows[0]["invalidcalls"] else []
+        if chains:
+            distinct = {}
+            for row in rows:
+                for key, with_label in chains.items():
+                    row[key] = self.chain(row[key], with_label)
+                distinct.setdefault(repr(row), row)
+            rows = list(distinct.values())[: pattern.max_messages]
+        return rows
+
+    def chain(self, path: str, with_label: bool) -> List[Optional[str]]:
+        """The names of the nodes in `path`, a comma separated list of ids,
+        optionally followed by their label"""
+        result = []
+        for id_ in map(int, path.split(",")):
+            name = self.names[id_]
+            if with_label and name is not None and id_ in self.labels:
+                name += ":" + self.labels[id_]
+            result.append(name)
+        return result
+
+    def interrupt(self):
+        self.db.interrupt()
+
+    def close(self):
+        if hasattr(self, "db"):
+            self.db.close()
@@ -0,0 +1,201 @@
+import logging
+import os
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import clang.cindex
+import utils
+
+from rainbow.cache import ASTCache, VerdictCache
+from rainbow.config import Pattern
+from rainbow.executors import SpycyExecutor
+from rainbow.rainbow import Rainbow, thread_local_parser
+
+
+class TestASTCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        self.header = self.root / "header.h"
+        self.header.write_text(
+            textwrap.dedent(
+                """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+        """
+            )
+        )
+        self.source = self.root / "source.cpp"
+        self.source.write_text(
+            textwrap.dedent(
+                """\
+                #include "header.h"
+                COLOR(RED) int main() { return ret0(); }
+        """
+            )
+        )
+        self.index = clang.cindex.Index.create()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_reload(self):
+        cache = ASTCache(self.root / "cache")
+        cache.parse(self.index, str(self.source))
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        tu = cache.parse(self.index, str(self.source))
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # The reloaded AST must be usable by rainbow
+        sut = utils.createRainbow("", "", ["RED", "BLUE"], ["(:RED)-->(:BLUE)"])
+        sut = Rainbow(tu, sut.config, logger=sut.logger)
+        assert sut.run()
+
+    def test_threads(self):
+        cache = ASTCache(self.root / "cache")
+        parse = thread_local_parser(cache)
+        tus = []
+
+        def worker():
+            tus.append(parse(str(self.source)))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert cache.hits + cache.misses == 4 and cache.misses >= 1
+        # Every thread parsed with its own index
+        assert len({id(tu.index) for tu in tus}) == 4
+        tu = parse(str(self.source))
+        assert tu.index is parse(str(self.source)).index
+
+        sut = utils.createRainbow("", "", ["RED", "BLUE"], ["(:RED)-->(:BLUE)"])
+        sut = Rainbow(tu, sut.config, logger=sut.logger)
+        assert sut.run()
+        # The walker doesn't keep the translation unit alive once released
+        sut.release()
+        assert sut.tu is None
+
+    def test_invalidation(self):
+        cache = ASTCache(self.root / "cache")
+        cache.parse(self.index, str(self.source))
+
+        # Changing the flags or an included file must force a re-parse
+        cache.parse(self.index, str(self.source), ["-DFOO"])
+        assert (cache.hits, cache.misses) == (0, 2)
+
+        self.header.write_text("int ret0() { return 0; }\n#define COLOR(X)\n")
+        cache.parse(self.index, str(self.source))
+        assert (cache.hits, cache.misses) == (0, 3)
+        cache.parse(self.index, str(self.source))
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_broken_entries(self):
+        cache_dir = self.root / "cache"
+        cache = ASTCache(cache_dir)
+        cache.parse(self.index, str(self.source))
+
+        # A truncated manifest is a cache miss
+        for manifest in cache_dir.glob("*.json"):
+            manifest.write_text('{"includes": {')
+        with self.assertLogs(cache.logger, logging.WARNING):
+            cache.parse(self.index, str(self.source))
+        assert (cache.hits, cache.misses) == (0, 2)
+
+        # So is an AST that can't be written
+        error = clang.cindex.TranslationUnitSaveError(1, "disk full")
+        with mock.patch.object(clang.cindex.TranslationUnit, "save", side_effect=error):
+            with self.assertLogs(cache.logger, logging.WARNING):
+                tu = cache.parse(self.index, str(self.source), ["-DFOO"])
+        assert tu is not None
+        assert len(list(cache_dir.glob("*.ast"))) == 1
+        assert len(list(cache_dir.glob("*.tmp"))) == 0
+
+    def test_eviction(self):
+        cache_dir = self.root / "cache"
+        cache = ASTCache(cache_dir)
+        cache.parse(self.index, str(self.source))
+        cache.parse(self.index, str(self.source), ["-DFOO"])
+        assert len(list(cache_dir.glob("*.ast"))) == 2
+
+        # Age out the first entry
+        for path in cache_dir.iterdir():
+            if path.suffix == ".ast" or path.suffix == ".json":
+                old = time.time() - 3600
+                os.utime(path, (old, old))
+        cache.parse(self.index, str(self.source), ["-DBAR"])
+        cache.max_age = 60
+        cache.evict()
+        assert len(list(cache_dir.glob("*.ast"))) == 1
+
+        cache.max_size = 0
+        cache.evict()
+        assert len(list(cache_dir.iterdir())) == 0
+
+
+class TestVerdictCache(unittest.TestCase):
+    def run_rainbow(self, src):
+        sut = utils.createRainbow(
+            textwrap.dedent(src),
+            "",
+            ["RED", "BLUE"],
+            ["(:RED)-->(:BLUE)"],
+        )
+        sut.config.patterns = [
+            Pattern("(a:RED)-->(b:BLUE)", {"a": "a.name", "b": "b.name"}, "%a calls %b")
+        ]
+        sut.config.logger = logging.getLogger("rainbow.test_verdict")
+        sut.config.verdict_cache = self.cache
+        with self.assertLogs(sut.config.logger, logging.ERROR) as logs:
+            result = sut.run()
+        return result, [r.getMessage() for r in logs.records]
+
+    def test_reuse(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.cache = VerdictCache(Path(tmpdir))
+            result, messages = self.run_rainbow(
+                """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+            """
+            )
+            assert result
+            assert messages == ["main calls ret0"]
+            assert self.cache.misses == 1
+
+            # Same call graph: different order, comments, and scope ids
+            src = """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                int unused_global = 0;
+                COLOR(BLUE) int ret0();
+                // comment
+                COLOR(RED) int main() { return ret0(); }
+                COLOR(BLUE) int ret0() { return unused_global; }
+            """
+            # The executor isn't started
+            with mock.patch.object(SpycyExecutor, "load", side_effect=Exception):
+                result, messages = self.run_rainbow(src)
+            assert result
+            assert messages == ["main calls ret0"]
+            assert self.cache.hits == 1
+
+    def test_malformed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.cache = VerdictCache(Path(tmpdir))
+            for data in ["{", "{}", "[]", '{"verdict": true, "messages": 1}']:
+                (Path(tmpdir) / "key.verdict.json").write_text(data)
+                assert self.cache.get("key") is None
+            assert self.cache.misses == 4
+            assert self.cache.hits == 0
+
+
+if __name__ == "__main__":
+    utils.main()
@@ -1,9 +1,37 @@
+import logging
+import tempfile
 import textwrap
+import threading
+import time
 import unittest
+from pathlib import Path
 
 import utils
 
 from rainbow import errors
+from rainbow.cache import CostHistory
+from rainbow.config import Config, Pattern
+from rainbow.executors import SpycyExecutor
+from rainbow.graph import Graph, Node
+
+
+class HangingExecutor(SpycyExecutor):
+    """Hangs on patterns matching BLUE functions until it is interrupted"""
+
+    interruptible = True
+
+    def load(self, graph):
+        super().load(graph)
+        self.interrupted = threading.Event()
+
+    def run_pattern(self, pattern):
+        if ":BLUE" in pattern.match_pattern:
+            self.interrupted.wait(30)
+            return None
+        return super().run_pattern(pattern)
+
+    def interrupt(self):
+        self.interrupted.set()
 
 
 class End2EndTests(unittest.TestCase):
@@ -126,6 +154,345 @@ class End2EndTests(unittest.TestCase):
         sut = utils.createRainbow(src, "", ["RED", "BLUE"], ["(:RED)-[*]->(:BLUE)"])
         assert sut.run()
 
+    def test_collapse_aliases(self):
+        src = textwrap.dedent(
+            """\
+                #include <functional>
+
+                #define COLOR(X) [[clang::annotate(#X)]]
+                int call(COLOR(RED) std::function<int(void)> cb) { return cb(); }
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int ret1() { return 1; }
+                COLOR(RED) int main() {
+                    COLOR(BLUE) auto* a1 = ret0;
+                    COLOR(BLUE) auto* a2 = a1;
+                    COLOR(RED) auto* a3 = ret1;
+                    auto call_alias = call;
+                    return a2() + call_alias(a3);
+                }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], ["(:RED)-->(:BLUE)"])
+        scope = sut.process()
+        full = Graph.from_scope(scope)
+        graph = Graph.from_scope(scope, collapse_aliases=True)
+        assert len(graph.nodes) < len(full.nodes)
+        assert len(graph.edges) < len(full.edges)
+
+        names = {alias: n.name for alias, n in graph.nodes.items()}
+        edges = {(names.get(src), names.get(dst)) for src, dst in graph.edges}
+        assert ("main", "ret0") in edges
+        assert ("main", "call") in edges
+        # The parameter of the alias is the parameter of `call`
+        assert ("cb", "ret1") in edges
+        ret0 = next(n for n in graph.nodes.values() if n.name == "ret0")
+        assert sorted(ret0.aliases) == ["a1", "a2"]
+        assert ret0.display() == "ret0:BLUE (as a1, a2)"
+
+        # Verdicts don't change
+        assert sut.should_reject()
+        sut.config.collapse_aliases = True
+        assert sut.should_reject()
+
+    def test_contract_chains(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                int helper1() { return ret0(); }
+                int helper0() { return helper1(); }
+                int unrelated() { return 0; }
+                COLOR(RED) int main() { return helper0() + unrelated(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "contract_chains": True,
+                "patterns": [
+                    {
+                        "pattern": "p = (:RED)-[:CALLS*]->(:BLUE)",
+                        "on_match": {
+                            "chain": "[n in nodes(p) | n.name + ([l in labels(n) | ':' + l] + [''])[0]]"
+                        },
+                        "msg": "%chain",
+                    }
+                ],
+            },
+            logging.getLogger("rainbow.test_contract_chains"),
+        )
+        with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+            assert sut.run()
+        messages = [r.getMessage() for r in logs.records]
+        assert "Contracted the call graph from 5 to 2 functions" in messages
+        assert "['main:RED', 'helper0', 'helper1', 'ret0:BLUE']" in messages
+
+        # Patterns that look at uncolored functions need the whole call graph
+        sut.config.patterns.append(Pattern("(:RED)-->(x) WHERE x.name = 'unrelated'"))
+        with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+            assert sut.run()
+        messages = [r.getMessage() for r in logs.records]
+        assert not any(m.startswith("Contracted") for m in messages)
+
+    def test_multiple_configs(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate("COLOR::" #X)]]
+                #define LOCKING(X) [[clang::annotate("LOCKING::" #X)]]
+                COLOR(BLUE) LOCKING(BLOCKING) int ret0() { return 0; }
+                COLOR(RED) int handler() { return ret0(); }
+                LOCKING(NONBLOCKING) int main() { return handler(); }
+        """
+        )
+        sut = utils.createRainbow(
+            src, "COLOR::", ["RED", "BLUE"], ["(:RED)-[*]->(:BLUE)"]
+        )
+        locking = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "LOCKING::",
+                "colors": ["BLOCKING", "NONBLOCKING"],
+                "patterns": ["(:NONBLOCKING)-[*]->(:BLOCKING)"],
+            },
+        )
+        sut.extra_configs.append(locking)
+        assert sut.run()
+
+        # Each config only sees its own colors
+        sut.config.patterns = []
+        assert sut.run()
+        locking.patterns = []
+        assert not sut.run()
+
+    def test_multiple_configs_parameters(self):
+        src = textwrap.dedent(
+            """\
+                #include <functional>
+
+                #define COLOR(X) [[clang::annotate("COLOR::" #X)]]
+                #define LOCKING(X) [[clang::annotate("LOCKING::" #X)]]
+                LOCKING(TAKES) int lock() { return 0; }
+                COLOR(BLUE) int ret0() { return 0; }
+                int locked() { return lock(); }
+                int blue() { return ret0(); }
+                int call(
+                    COLOR(RED) LOCKING(REQUIRED) std::function<int(void)> cb
+                ) { return cb(); }
+                int main() { return call(locked) + call(blue); }
+        """
+        )
+        color = ("COLOR::", ["RED", "BLUE"], ["(:RED)-[*]->(:BLUE)"])
+        locking = ("LOCKING::", ["TAKES", "REQUIRED"], ["(:REQUIRED)-[*]->(:TAKES)"])
+        no_patterns = ("COLOR::", ["RED", "BLUE"], [])
+
+        def create(src, *configs):
+            sut = utils.createRainbow(src, *configs[0])
+            for prefix, colors, patterns in configs[1:]:
+                sut.extra_configs.append(
+                    Config.from_dict(
+                        Path("."),
+                        {"prefix": prefix, "colors": colors, "patterns": patterns},
+                    )
+                )
+            return sut
+
+        # The parameter has the same colors whether its config runs on its own
+        # or together with another one
+        cb = create(src, locking).process().functions["call"].params["cb"]
+        assert cb.color == "REQUIRED"
+        cb = create(src, color, locking).process().functions["call"].params["cb"]
+        assert cb.color == "RED"
+        assert cb.labels == {"LOCKING::": "REQUIRED"}
+
+        assert create(src, color).run()
+        assert create(src, locking).run()
+        assert not create(src, no_patterns).run()
+        assert create(src, no_patterns, locking).run()
+
+        # Passing or aliasing a function with another color of an extra config
+        # is an invalid assignment too
+        invalid = [
+            src.replace("call(locked)", "call(lock)"),
+            src.replace("int main() {", "int main() { auto alias = lock;"),
+        ]
+        for invalid_src in invalid:
+            for configs in [[locking], [no_patterns, locking]]:
+                with self.assertRaises(errors.InvalidAssignmentError):
+                    create(invalid_src, *configs).process()
+
+    def test_fail_fast_and_max_messages(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int a() { return ret0(); }
+                COLOR(RED) int b() { return ret0(); }
+                COLOR(RED) int c() { return ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "max_messages": 2,
+                "patterns": [
+                    "(:RED)-->(:BLUE)",
+                    {
+                        "pattern": "(x:RED)-->(:BLUE)",
+                        "on_match": {"x": "x.name"},
+                        "msg": "%x calls BLUE",
+                    },
+                ],
+            },
+            logging.getLogger("rainbow.test_fail_fast"),
+        )
+        assert sut.config.patterns[0].assemble_query().endswith("LIMIT 1")
+        assert sut.config.patterns[1].assemble_query().endswith("LIMIT 2")
+
+        with self.assertLogs(sut.config.logger, logging.ERROR) as logs:
+            assert sut.run()
+        assert len(logs.records) == 2
+
+        # The first pattern already rejects the program
+        sut.config.fail_fast = True
+        with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+            assert sut.run()
+        assert not any("calls BLUE" in r.getMessage() for r in logs.records)
+
+    def test_pattern_timeout(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": [
+                    {"pattern": "(:RED)-[:CALLS*]->(:BLUE)", "timeout": 0.2},
+                    "(:BLUE)-->(:RED)",
+                ],
+            },
+            logging.getLogger("rainbow.test_pattern_timeout"),
+        )
+        sut.config.executor_plugin = HangingExecutor
+        start = time.time()
+        with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+            assert sut.run() is None
+        assert time.time() - start < 10
+        messages = [r.getMessage() for r in logs.records]
+        assert "Pattern 0 timed out after 0.2s" in messages
+        assert "Pattern 0 returned unknown" in messages
+        assert any(m.startswith("Pattern 1 took") for m in messages)
+
+    def test_abandoned_pattern(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": [
+                    {
+                        "pattern": "(a:RED)-[:CALLS*]->(:BLUE)",
+                        "on_match": {"a": "a.name"},
+                        "msg": "%a calls BLUE",
+                        "timeout": 0.2,
+                    },
+                    "(:RED)-->(:BLUE)",
+                ],
+            },
+            logging.getLogger("rainbow.test_abandoned_pattern"),
+        )
+        release = threading.Event()
+        loads = []
+
+        class StuckExecutor(SpycyExecutor):
+            """Can't be interrupted, the first pattern it runs is stuck until
+            `release` is set"""
+
+            def load(self, graph):
+                super().load(graph)
+                loads.append(self)
+
+            def run_pattern(self, pattern):
+                if len(loads) == 1:
+                    release.wait(30)
+                return super().run_pattern(pattern)
+
+        sut.config.executor_plugin = StuckExecutor
+        start = time.time()
+        with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+            assert sut.run()
+            # The abandoned pattern doesn't report anything once it finishes
+            release.set()
+            time.sleep(0.1)
+        assert time.time() - start < 10
+        messages = [r.getMessage() for r in logs.records]
+        assert "Pattern 0 timed out after 0.2s" in messages
+        assert "Pattern 0 returned unknown" in messages
+        assert "Pattern 1 found errors" in messages
+        assert "main calls BLUE" not in messages
+        # The second pattern ran on a new executor
+        assert len(loads) == 2
+
+    def test_cost_history(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": ["(:RED)-[:CALLS*]->(:BLUE)", "(:RED)-->(:BLUE)"],
+            },
+            logging.getLogger("rainbow.test_cost_history"),
+        )
+        keys = [sut.config.pattern_key(p) for p in sut.config.patterns]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "costs.json"
+            sut.config.cost_history = CostHistory(path, {keys[0]: 10.0})
+            graph = Graph({"a": Node("a", "a", "RED"), "b": Node("b", "b", "BLUE")})
+            assert sut.config.schedule(graph) == [1, 0]
+
+            # Only the cheaper pattern runs before failing fast
+            sut.config.fail_fast = True
+            with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+                assert sut.run()
+            messages = [r.getMessage() for r in logs.records]
+            assert any(m.startswith("Pattern 1 took") for m in messages)
+            assert not any(m.startswith("Pattern 0 took") for m in messages)
+
+            sut.config.fail_fast = False
+            assert sut.run()
+            costs = CostHistory.load(path).costs
+            assert set(costs) == set(keys)
+            # Averaged with the previous cost
+            assert 5.0 <= costs[keys[0]] < 10.0
+
 
 if __name__ == "__main__":
     utils.main()
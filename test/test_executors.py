@@ -0,0 +1,197 @@
+import logging
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import utils
+
+from rainbow.cache import CostHistory
+from rainbow.config import Config
+from rainbow.executors import Executor, SpycyExecutor, find_executor
+
+
+class EdgeCountingExecutor(Executor):
+    """Answers every pattern with whether a RED function calls a BLUE one"""
+
+    loaded = []
+
+    def load(self, graph):
+        self.graph = graph
+        EdgeCountingExecutor.loaded.append(graph)
+
+    def run_pattern(self, pattern):
+        invalid = any(
+            self.graph.get_node(src).color == "RED"
+            and self.graph.get_node(dst).color == "BLUE"
+            for src, dst in self.graph.edges
+        )
+        return [{"invalidcalls": invalid}]
+
+
+class SlowCleanExecutor(EdgeCountingExecutor):
+    """Takes a while to find out that a graph has no RED to BLUE call, and
+    only finds one once it started looking at such a graph"""
+
+    started = threading.Event()
+
+    def run_pattern(self, pattern):
+        rows = super().run_pattern(pattern)
+        if rows[0]["invalidcalls"]:
+            SlowCleanExecutor.started.wait(3)
+        else:
+            SlowCleanExecutor.started.set()
+            time.sleep(3)
+        return rows
+
+
+class TestExecutorPlugins(unittest.TestCase):
+    def test_find_executor(self):
+        assert find_executor("spycy") is SpycyExecutor
+        with self.assertRaisesRegex(AssertionError, "Could not find"):
+            find_executor("does-not-exist")
+
+        with self.assertRaisesRegex(AssertionError, "exclusive"):
+            Config.from_dict(
+                Path("."),
+                {
+                    "colors": [],
+                    "patterns": [],
+                    "executor": "examples/executors/echo.sh",
+                    "executor_plugin": "spycy",
+                },
+            )
+
+    def test_custom_executor(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], ["(:RED)-->(:BLUE)"])
+        sut.config.executor_plugin = EdgeCountingExecutor
+        assert sut.run()
+        # The executor got the call graph itself, not a CREATE query
+        graph = EdgeCountingExecutor.loaded[-1]
+        assert sorted(n.name for n in graph.nodes.values()) == ["main", "ret0"]
+
+    def test_skip_impossible_patterns(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+        """
+        )
+        patterns = [
+            "(:GREEN)-[:CALLS*]->(:RED)",
+            "({name: 'missing'})-->(:BLUE)",
+            "(:RED)-->(:BLUE)",
+        ]
+        sut = utils.createRainbow(src, "", ["RED", "BLUE", "GREEN"], patterns)
+        sut.config.logger = logging.getLogger("rainbow.test_skip")
+        sut.config.executor_plugin = EdgeCountingExecutor
+        EdgeCountingExecutor.loaded.clear()
+        with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+            assert sut.run()
+        messages = [r.getMessage() for r in logs.records]
+        assert "Skipping pattern 0, the call graph has no GREEN functions" in messages
+        assert (
+            "Skipping pattern 1, the call graph has no functions named missing"
+            in messages
+        )
+        assert len(EdgeCountingExecutor.loaded) == 1
+
+        # No executor is needed if every pattern can be skipped
+        sut.config.patterns = sut.config.patterns[:2]
+        assert not sut.run()
+        assert len(EdgeCountingExecutor.loaded) == 1
+
+    def test_component_workers(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int a() { return ret0(); }
+                COLOR(BLUE) int ret1() { return 0; }
+                COLOR(RED) int b() { return ret1(); }
+                int c() { return 0; }
+                int d() { return c(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], ["(:RED)-->(:BLUE)"])
+        sut.config.component_workers = 2
+        sut.config.executor_plugin = EdgeCountingExecutor
+        EdgeCountingExecutor.loaded.clear()
+        assert sut.run()
+        # Components without colors are dropped, the rest is split in two
+        loaded = sorted(
+            sorted(n.name for n in graph.nodes.values())
+            for graph in EdgeCountingExecutor.loaded
+        )
+        assert loaded == [["a", "ret0"], ["b", "ret1"]]
+
+        # Both parts match, the messages of the parts are merged
+        sut.config.executor_plugin = SpycyExecutor
+        for max_messages, expected in [(None, ["a", "b"]), (1, ["a"])]:
+            sut.config = Config.from_dict(
+                Path("."),
+                {
+                    "prefix": "",
+                    "colors": ["RED", "BLUE"],
+                    "patterns": [
+                        {
+                            "pattern": "(x:RED)-->(:BLUE)",
+                            "on_match": {"caller": "x.name"},
+                            "msg": "%caller",
+                            "max_messages": max_messages,
+                        }
+                    ],
+                    "component_workers": 2,
+                },
+            )
+            sut.config.logger = logging.getLogger("rainbow.test.components")
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = Path(tmpdir) / "costs.json"
+                sut.config.cost_history = CostHistory(path)
+                with self.assertLogs(sut.config.logger, logging.INFO) as logs:
+                    assert sut.run()
+                assert len(CostHistory.load(path).costs) == 1
+            messages = [r.getMessage() for r in logs.records]
+            matches = [r.getMessage() for r in logs.records if r.levelno == logging.ERROR]
+            assert sorted(matches) == expected
+            assert messages.count("Pattern 0 found errors") == 1
+            assert len([m for m in messages if m.startswith("Pattern 0 took")]) == 1
+
+        with self.assertRaisesRegex(AssertionError, "component_workers"):
+            Config.from_dict(
+                Path("."), {"colors": [], "patterns": [], "component_workers": 0}
+            )
+
+    def test_component_workers_fail_fast(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int a() { return ret0(); }
+                COLOR(RED) int ret1() { return 0; }
+                COLOR(BLUE) int b() { return ret1(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], ["(:RED)-->(:BLUE)"])
+        sut.config.component_workers = 2
+        sut.config.fail_fast = True
+        sut.config.executor_plugin = SlowCleanExecutor
+        # The part without errors is still running when the run ends
+        SlowCleanExecutor.started.clear()
+        start = time.time()
+        assert sut.run()
+        assert time.time() - start < 2
+
+
+if __name__ == "__main__":
+    utils.main()
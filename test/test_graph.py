@@ -0,0 +1,256 @@
+import logging
+import textwrap
+import unittest
+
+import utils
+
+from rainbow.config import Config, Pattern
+from rainbow.graph import Graph, Reachability
+from rainbow.scope import Scope
+
+
+class UnitTestGraph(unittest.TestCase):
+    """Unit tests of Graph"""
+
+    def test_from_scope(self):
+        root = Scope.create_root()
+        fn1 = Scope.create_function(1, root, "fn1", "RED", {"cb": None})
+        fn2 = Scope.create_function(2, root, "fn2", None, {})
+        fn1.register_call_scope(fn2)
+
+        graph = Graph.from_scope(root)
+        assert list(graph.nodes.keys()) == [
+            "`fn1__1`",
+            "`cb__param__fn1__1`",
+            "`fn2__2`",
+        ]
+        assert graph.nodes["`fn1__1`"].color == "RED"
+        assert graph.nodes["`cb__param__fn1__1`"].is_param
+        assert graph.edges == [("`fn1__1`", "`fn2__2`")]
+
+    def test_components(self):
+        root = Scope.create_root()
+        fn1 = Scope.create_function(1, root, "fn1", "RED", {})
+        fn2 = Scope.create_function(2, root, "fn2", None, {})
+        fn3 = Scope.create_function(3, root, "fn3", "BLUE", {})
+        fn1.register_call_scope(fn2)
+
+        graph = Graph.from_scope(root)
+        components = graph.components()
+        assert [sorted(c.nodes) for c in components] == [
+            ["`fn1__1`", "`fn2__2`"],
+            ["`fn3__3`"],
+        ]
+        assert Graph.union(components) == graph
+
+        # Fingerprints don't depend on aliases
+        root = Scope.create_root()
+        fn2 = Scope.create_function(7, root, "fn2", None, {})
+        fn1 = Scope.create_function(8, root, "fn1", "RED", {})
+        fn1.register_call_scope(fn2)
+        other = Graph.from_scope(root)
+        assert other.fingerprint() == components[0].fingerprint()
+        assert other.fingerprint() != graph.fingerprint()
+
+        # Two nested functions that can't be told apart
+        fn1.register_call_scope(Scope.create_function(9, fn1, "inner", None, {}))
+        fn2.register_call_scope(Scope.create_function(10, fn2, "inner", None, {}))
+        assert Graph.from_scope(root).fingerprint() is None
+
+    def test_canonical_hash(self):
+        def build(order):
+            root = Scope.create_root()
+            fns = {}
+            for i, name in enumerate(order):
+                fns[name] = Scope.create_function(i, root, name, "RED", {"cb": None})
+            fns["a"].register_call_scope(fns["b"])
+            return Graph.from_scope(root)
+
+        assert build("ab").canonical_hash() == build("ba").canonical_hash()
+        graph = build("ab")
+        graph.edges.reverse()
+        graph.edges.append(graph.edges[0][::-1])
+        assert graph.canonical_hash() != build("ab").canonical_hash()
+
+    def test_empty(self):
+        assert Graph.from_scope(Scope.create_root()).to_cypher() == "RETURN 0"
+
+    def test_counts(self):
+        root = Scope.create_root()
+        Scope.create_function(1, root, "fn1", "RED", {"cb": "RED"})
+        Scope.create_function(2, root, "fn2", None, {})
+        graph = Graph.from_scope(root)
+        assert graph.label_count("RED") == 2
+        assert graph.label_count("BLUE") == 0
+        assert graph.name_count("fn2") == 1
+        assert graph.name_count("fn3") == 0
+
+    def test_contract(self):
+        """
+        red -> a -> b -> blue
+           \\-> c -> purple -> blue
+        """
+        root = Scope.create_root()
+        red = Scope.create_function(1, root, "red", "RED", {})
+        a = Scope.create_function(2, root, "a", None, {})
+        b = Scope.create_function(3, root, "b", None, {})
+        c = Scope.create_function(4, root, "c", None, {})
+        purple = Scope.create_function(5, root, "purple", "PURPLE", {})
+        blue = Scope.create_function(6, root, "blue", "BLUE", {})
+        for caller, callee in [(red, a), (a, b), (b, blue), (red, c)]:
+            caller.register_call_scope(callee)
+        c.register_call_scope(purple)
+        purple.register_call_scope(blue)
+
+        graph = Graph.from_scope(root).contract()
+        assert sorted(n.name for n in graph.nodes.values()) == ["blue", "purple", "red"]
+        names = {alias: n.name for alias, n in graph.nodes.items()}
+        edges = sorted((names[src], names[dst]) for src, dst in graph.edges)
+        assert edges == [("purple", "blue"), ("red", "blue"), ("red", "purple")]
+
+        witnesses = list(graph.shortest_witnesses(Reachability("RED", "BLUE")))
+        assert [n.name for n in graph.expand(witnesses[0])] == [
+            "red",
+            "a",
+            "b",
+            "blue",
+        ]
+        chain = graph.expand_names(["red:RED", "purple:PURPLE", "blue:BLUE"])
+        assert chain == ["red:RED", "c", "purple:PURPLE", "blue:BLUE"]
+
+    def test_contractible_patterns(self):
+        chain = {"chain": "[n in nodes(p) | n.name]", "x": "x.name"}
+        pattern = Pattern("p = (x:RED)-[:CALLS*]->(:BLUE)", chain, "%chain")
+        assert pattern.chain_vars == ["chain"]
+        # Uncolored endpoints, and anything else about the path, need every node
+        assert Pattern("p = (:RED)-[:CALLS*]->(x)").chain_vars is None
+        assert Pattern("p = (:RED)-[:CALLS*]->(:BLUE)", None, "%p").chain_vars is None
+        length = {"n": "length(p)"}
+        assert Pattern("p = (:RED)-[*]->(:BLUE)", length, "%n").chain_vars is None
+
+    def test_required_labels(self):
+        pattern = Pattern("p = (:RED)-[:CALLS*]->(x:BLUE {name: 'f'}) WHERE x:GREEN")
+        assert pattern.required_labels == {"RED", "BLUE"}
+        assert pattern.required_names == {"f"}
+        # Negated labels and alternatives aren't required
+        assert Pattern("(x:A|B)-->(y) WHERE NOT (y)-->(:C)").required_labels == set()
+        # Nothing inside a string literal is a label, a name or a clause
+        pattern = Pattern("(a:RED)-[:CALLS {note: '(:GREEN)'}]->(b {name: \"main\"})")
+        assert pattern.required_labels == {"RED"}
+        assert pattern.required_names == {"main"}
+        pattern = Pattern("(a {other: \"name: 'f'\"})-->(:BLUE {name: 'x WHERE y'})")
+        assert pattern.required_labels == {"BLUE"}
+        assert pattern.required_names == {"x WHERE y"}
+        pattern = Pattern("(a:RED) WHERE a.name = 'MATCH (b:GREEN)'")
+        assert pattern.required_labels == {"RED"}
+
+
+class UnitTestReachability(unittest.TestCase):
+    def test_parse(self):
+        reach = Reachability.parse("(:RED)-[:CALLS*]->(:BLUE)")
+        assert reach == Reachability("RED", "BLUE")
+
+        reach = Reachability.parse(
+            "p = (a:RED)-[*]->(b) WHERE NOT any(n in nodes(p) WHERE n:PURPLE)"
+        )
+        assert reach == Reachability("RED", None, "PURPLE")
+
+        assert Reachability.parse("(:RED)-->(:BLUE)") is None
+        assert Reachability.parse("(:RED)-[:CALLS*]->(:BLUE) WHERE a.x") is None
+
+    def test_shortest_witnesses(self):
+        """
+        Construct the following call graph, which has 2^3 distinct paths from
+        src to dst, but only one shortest witness
+        src -> a0 -> a1 -> a2 -> dst
+          \\-> b0 -/\\-> b1 -/\\-> b2 -/
+        """
+        root = Scope.create_root()
+        src = Scope.create_function(1, root, "src", "RED", {})
+        dst = Scope.create_function(2, root, "dst", "BLUE", {})
+        prev = [src]
+        for i in range(3):
+            a = Scope.create_function(10 + i, root, f"a{i}", None, {})
+            b = Scope.create_function(20 + i, root, f"b{i}", None, {})
+            for p in prev:
+                p.register_call_scope(a)
+                p.register_call_scope(b)
+            prev = [a, b]
+        for p in prev:
+            p.register_call_scope(dst)
+
+        graph = Graph.from_scope(root)
+        reach = Reachability("RED", "BLUE")
+        witnesses = list(graph.shortest_witnesses(reach))
+        assert len(witnesses) == 1
+        assert [n.display() for n in witnesses[0]] == [
+            "src:RED",
+            "a0",
+            "a1",
+            "a2",
+            "dst:BLUE",
+        ]
+
+        # Avoiding `a1` forces the witness through `b1`
+        graph.nodes["`a1__11`"].color = "PURPLE"
+        reach = Reachability("RED", "BLUE", "PURPLE")
+        witnesses = list(graph.shortest_witnesses(reach))
+        assert [n.name for n in witnesses[0]] == ["src", "a0", "b1", "a2", "dst"]
+
+    def test_witness_limit(self):
+        root = Scope.create_root()
+        srcs = [Scope.create_function(i, root, f"src{i}", "RED", {}) for i in range(5)]
+        dst = Scope.create_function(5, root, "dst", "RED", {})
+        for src in srcs:
+            src.register_call_scope(dst)
+
+        graph = Graph.from_scope(root)
+        reach = Reachability("RED", "RED")
+        assert len(list(graph.shortest_witnesses(reach))) == 5
+        assert len(list(graph.shortest_witnesses(reach, 2))) == 2
+
+    def test_recursive_witness(self):
+        root = Scope.create_root()
+        fn = Scope.create_function(1, root, "fn", "RED", {})
+        fn.register_call_scope(fn)
+        witnesses = list(
+            Graph.from_scope(root).shortest_witnesses(Reachability("RED", "RED"))
+        )
+        assert [n.name for n in witnesses[0]] == ["fn", "fn"]
+
+
+class TestWitnessMode(unittest.TestCase):
+    def test_witness_config(self):
+        with self.assertRaises(AssertionError):
+            Config.from_dict(
+                None, {"colors": [], "patterns": [{"pattern": "(a)", "witness": 1}]}
+            )
+
+        with self.assertRaises(AssertionError):
+            Pattern("(:RED)-->(:BLUE)", witness=1)
+
+    def test_witness_messages(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                int wrapper() { return ret0(); }
+                COLOR(RED) int main() { return wrapper() + ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config.patterns = [
+            Pattern(
+                "p = (:RED)-[:CALLS*]->(:BLUE)",
+                error_msg="%source -> %sink: %chain",
+                witness=10,
+            )
+        ]
+        with self.assertLogs(level=logging.ERROR) as logs:
+            assert sut.run()
+        assert len(logs.output) == 1
+        assert "main -> ret0: ['main:RED', 'ret0:BLUE']" in logs.output[0]
+
+
+if __name__ == "__main__":
+    utils.main()
@@ -0,0 +1,195 @@
+import io
+import json
+import logging
+import textwrap
+import unittest
+from pathlib import Path
+
+import clang.cindex
+import utils
+
+from rainbow.config import Config
+from rainbow.graph import Graph
+from rainbow.lsp import IncrementalRainbow, RainbowServer
+
+SOURCE = textwrap.dedent(
+    """\
+    #include <functional>
+    #define COLOR(X) [[clang::annotate(#X)]]
+    COLOR(BLUE) int ret0() { return 0; }
+    int ret1() { return 1; }
+    int wrapper() { return ret1(); }
+    COLOR(RED) int main() { return wrapper(); }
+    """
+)
+
+PATH = "/tmp/rainbow_lsp_test.cpp"
+
+
+def create_config() -> Config:
+    config = Config.from_dict(
+        Path("."),
+        {
+            "colors": ["RED", "BLUE"],
+            "patterns": [
+                {
+                    "pattern": "p = (:RED)-[:CALLS*]->(:BLUE)",
+                    "witness": 1,
+                    "msg": "%source calls %sink",
+                }
+            ],
+        },
+    )
+    config.prefix = ""
+    config.logger = logging.getLogger("rainbow.test.lsp")
+    config.logger.setLevel(logging.ERROR)
+    return config
+
+
+class TestIncrementalRainbow(unittest.TestCase):
+    def setUp(self):
+        self.index = clang.cindex.Index.create()
+
+    def parse(self, src: str) -> clang.cindex.TranslationUnit:
+        return self.index.parse(
+            PATH,
+            unsaved_files=[(PATH, src)],
+            options=clang.cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE,
+        )
+
+    def test_reparse(self):
+        tu = self.parse(SOURCE)
+        sut = IncrementalRainbow(tu, create_config())
+        sut.logger.setLevel(logging.CRITICAL)
+        sut.process_incremental(SOURCE.encode())
+        n_decls = sut.walked
+        assert n_decls > 4
+
+        # Nothing changed, nothing to walk
+        tu.reparse(unsaved_files=[(PATH, SOURCE)])
+        sut.process_incremental(SOURCE.encode())
+        assert sut.walked == 0
+
+        # Only the last two declarations need to be walked again
+        new_src = SOURCE.replace("return ret1();", "return ret0();")
+        tu.reparse(unsaved_files=[(PATH, new_src)])
+        scope = sut.process_incremental(new_src.encode())
+        assert sut.walked == 2
+
+        expected = IncrementalRainbow(self.parse(new_src), create_config())
+        expected.logger.setLevel(logging.CRITICAL)
+        expected_scope = expected.process_incremental(new_src.encode())
+        assert expected.walked == n_decls
+
+        assert Graph.from_scope(scope) == Graph.from_scope(expected_scope)
+        wrapper = scope.functions["wrapper"]
+        assert wrapper.called_functions == [scope.functions["ret0"]]
+
+    def test_reparse_rolls_back(self):
+        # The definition of `late` colors the scope created by its declaration,
+        # and adds `late` to the callers of `wrapper`. Removing it must undo
+        # both.
+        src = textwrap.dedent(
+            """\
+            #include <functional>
+            #define COLOR(X) [[clang::annotate(#X)]]
+            COLOR(BLUE) int ret0() { return 0; }
+            int late();
+            int apply(std::function<int()> f) { return f(); }
+            int wrapper() { return apply(ret0); }
+            COLOR(RED) int late() { return wrapper(); }
+            """
+        )
+        tu = self.parse(src)
+        sut = IncrementalRainbow(tu, create_config())
+        sut.logger.setLevel(logging.CRITICAL)
+        sut.process_incremental(src.encode())
+
+        removed = src[: src.index("COLOR(RED)")]
+        edits = [
+            (removed.replace("apply(ret0)", "ret0()"), 1),
+            (src, 2),
+        ]
+        for new_src, walked in edits:
+            tu.reparse(unsaved_files=[(PATH, new_src)])
+            scope = sut.process_incremental(new_src.encode())
+            assert sut.walked == walked
+
+            expected = IncrementalRainbow(self.parse(new_src), create_config())
+            expected.logger.setLevel(logging.CRITICAL)
+            expected_scope = expected.process_incremental(new_src.encode())
+            assert Graph.from_scope(scope) == Graph.from_scope(expected_scope)
+            assert scope.functions.keys() == expected_scope.functions.keys()
+            for name, expected_fn in expected_scope.functions.items():
+                fn = scope.functions[name]
+                assert fn.color == expected_fn.color, name
+                assert fn.params.keys() == expected_fn.params.keys(), name
+                assert len(fn.called_functions) == len(expected_fn.called_functions)
+
+
+class TestRainbowServer(unittest.TestCase):
+    def frame(self, method, params, id_=None):
+        message = {"jsonrpc": "2.0", "method": method, "params": params}
+        if id_ is not None:
+            message["id"] = id_
+        body = json.dumps(message).encode()
+        return f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+
+    def read_all(self, output: bytes):
+        messages = []
+        reader = io.BytesIO(output)
+        sut = RainbowServer(create_config(), reader, io.BytesIO())
+        while message := sut.read_message():
+            messages.append(message)
+        return messages
+
+    def test_diagnostics(self):
+        uri = Path(PATH).as_uri()
+        changed = SOURCE.replace("return ret1();", "return ret0();")
+        requests = [
+            self.frame("initialize", {}, 1),
+            self.frame(
+                "textDocument/didOpen",
+                {"textDocument": {"uri": uri, "text": SOURCE, "version": 1}},
+            ),
+            self.frame(
+                "textDocument/didChange",
+                {
+                    "textDocument": {"uri": uri, "version": 2},
+                    "contentChanges": [{"text": changed}],
+                },
+            ),
+            self.frame("shutdown", {}, 2),
+            self.frame("exit", {}),
+        ]
+        output = io.BytesIO()
+        sut = RainbowServer(
+            create_config(), io.BytesIO(b"".join(requests)), output, debounce=0
+        )
+        sut.logger.setLevel(logging.CRITICAL)
+        sut.serve()
+
+        messages = self.read_all(output.getvalue())
+        assert messages[0]["id"] == 1
+        assert "capabilities" in messages[0]["result"]
+
+        published = [
+            m["params"]
+            for m in messages
+            if m.get("method") == "textDocument/publishDiagnostics"
+        ]
+        assert len(published) == 2
+        assert published[0]["diagnostics"] == []
+
+        diagnostics = published[1]["diagnostics"]
+        assert published[1]["version"] == 2
+        assert len(diagnostics) == 1
+        assert diagnostics[0]["message"] == "main calls ret0"
+        # Anchored on the definition of main
+        assert diagnostics[0]["range"]["start"] == {"line": 5, "character": 15}
+
+        assert messages[-1] == {"jsonrpc": "2.0", "id": 2, "result": None}
+
+
+if __name__ == "__main__":
+    utils.main()
@@ -0,0 +1,279 @@
+import logging
+import tempfile
+import textwrap
+import unittest
+import weakref
+from pathlib import Path
+
+import clang.cindex
+import utils
+
+from rainbow.config import Config
+from rainbow.executors import SpycyExecutor
+from rainbow.graph import Graph, Reachability
+from rainbow.project import ProjectState, normalize_path
+from rainbow.rainbow import analyze_project
+from rainbow.scope import Scope
+
+
+class TestProjectState(unittest.TestCase):
+    def test_affected(self):
+        state = ProjectState()
+        state.update("/src/a.cpp", ["/src/a.h", "/src/common.h"], Graph())
+        state.update("/src/b.cpp", ["/src/common.h"], Graph())
+
+        sources = ["/src/a.cpp", "/src/b.cpp", "/src/c.cpp"]
+        assert state.affected(sources, set()) == ["/src/c.cpp"]
+        assert state.affected(sources, {"/src/a.cpp"}) == ["/src/a.cpp", "/src/c.cpp"]
+        assert state.affected(sources, {"/src/a.h"}) == ["/src/a.cpp", "/src/c.cpp"]
+        assert state.affected(sources, {"/src/common.h"}) == sources
+
+    def test_save_load(self):
+        root = Scope.create_root()
+        fn = Scope.create_function(1, root, "fn", "RED", {"cb": "BLUE"})
+        fn.register_call_scope(fn.params["cb"])
+        graph = Graph.from_scope(root)
+
+        state = ProjectState()
+        state.update("/src/a.cpp", ["/src/a.h"], graph)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "state.json"
+            state.save(path)
+            loaded = ProjectState.load(path)
+        assert loaded == state
+
+
+class TestGraphMerge(unittest.TestCase):
+    def test_merge(self):
+        root1 = Scope.create_root()
+        main = Scope.create_function(1, root1, "main", "RED", {})
+        local = Scope.create_function(2, main, "cb", None, {})
+        helper1 = Scope.create_function(3, root1, "helper", None, {})
+        main.register_call_scope(local)
+        local.register_call_scope(helper1)
+
+        root2 = Scope.create_root()
+        helper2 = Scope.create_function(1, root2, "helper", None, {})
+        ret0 = Scope.create_function(2, root2, "ret0", "BLUE", {})
+        cb = Scope.create_function(3, helper2, "cb", None, {})
+        helper2.register_call_scope(cb)
+        cb.register_call_scope(ret0)
+
+        merged = Graph.merge([Graph.from_scope(root1), Graph.from_scope(root2)])
+        # helper is shared, but the two `cb` functions are local to their TU
+        assert sorted(n.name for n in merged.nodes.values()) == [
+            "cb",
+            "cb",
+            "helper",
+            "main",
+            "ret0",
+        ]
+        assert len(merged.edges) == 4
+        witnesses = list(merged.shortest_witnesses(Reachability("RED", "BLUE")))
+        assert [n.name for n in witnesses[0]] == ["main", "cb", "helper", "cb", "ret0"]
+
+    def test_merge_conflicting_colors(self):
+        root1 = Scope.create_root()
+        Scope.create_function(1, root1, "fn", "RED", {})
+        root2 = Scope.create_root()
+        Scope.create_function(1, root2, "fn", "BLUE", {})
+        with self.assertRaisesRegex(Exception, "Multiple colors"):
+            Graph.merge([Graph.from_scope(root1), Graph.from_scope(root2)])
+
+
+class TestChangedFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        (self.root / "header.h").write_text(
+            textwrap.dedent(
+                """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0();
+                int helper();
+        """
+            )
+        )
+        self.lib = self.root / "lib.cpp"
+        self.lib.write_text(
+            textwrap.dedent(
+                """\
+                #include "header.h"
+                int ret0() { return 0; }
+                int helper() { return 1; }
+        """
+            )
+        )
+        self.main = self.root / "main.cpp"
+        self.main.write_text(
+            textwrap.dedent(
+                """\
+                #include "header.h"
+                COLOR(RED) int main() { return helper(); }
+        """
+            )
+        )
+        self.state = self.root / "state.json"
+        self.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": ["(:RED)-[:CALLS*]->(:BLUE)"],
+            },
+        )
+        self.config.logger.setLevel(logging.CRITICAL)
+        self.logger = logging.Logger("test")
+        self.logger.setLevel(logging.CRITICAL)
+
+        self.parsed = []
+        index = clang.cindex.Index.create()
+
+        def parse(path):
+            self.parsed.append(path)
+            return index.parse(path)
+
+        self.parse = parse
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_project(self, changed=None):
+        self.parsed = []
+        return analyze_project(
+            [str(self.lib), str(self.main)],
+            self.config,
+            self.parse,
+            self.logger,
+            self.state,
+            changed,
+        )
+
+    def test_changed_files(self):
+        assert not self.run_project()
+        assert self.parsed == [str(self.lib), str(self.main)]
+
+        # Nothing changed, so nothing needs to be parsed
+        assert not self.run_project(set())
+        assert self.parsed == []
+
+        self.lib.write_text(
+            self.lib.read_text().replace("return 1;", "return ret0();")
+        )
+        assert self.run_project({normalize_path(str(self.lib))})
+        assert self.parsed == [str(self.lib)]
+
+        # Both files include the header
+        assert self.run_project({normalize_path(str(self.root / "header.h"))})
+        assert self.parsed == [str(self.lib), str(self.main)]
+
+    def test_incremental_results(self):
+        loaded = []
+
+        class RecordingExecutor(SpycyExecutor):
+            def load(self, graph):
+                loaded.append(sorted(n.name for n in graph.nodes.values()))
+                super().load(graph)
+
+        self.config.executor_plugin = RecordingExecutor
+        assert not self.run_project()
+        assert loaded == [["helper", "main", "ret0"]]
+
+        # The call graph didn't change, so no pattern has to run
+        loaded.clear()
+        self.main.write_text(self.main.read_text() + "// comment\n")
+        assert not self.run_project({normalize_path(str(self.main))})
+        assert loaded == []
+
+        # Only the new component is evaluated
+        self.main.write_text(
+            self.main.read_text()
+            + "COLOR(RED) int other() { return 0; }\n"
+            + "COLOR(BLUE) int source() { return other(); }\n"
+        )
+        assert not self.run_project({normalize_path(str(self.main))})
+        assert loaded == [["other", "source"]]
+
+        # helper now connects main and ret0
+        loaded.clear()
+        self.lib.write_text(
+            self.lib.read_text().replace("return 1;", "return ret0();")
+        )
+        assert self.run_project({normalize_path(str(self.lib))})
+        assert loaded == [["helper", "main", "ret0"]]
+
+    def test_in_flight_limit(self):
+        index = clang.cindex.Index.create()
+        tus = []
+        alive_at_parse = []
+
+        def parse(path):
+            alive_at_parse.append(sum(1 for tu in tus if tu() is not None))
+            tu = index.parse(path)
+            tus.append(weakref.ref(tu))
+            return tu
+
+        sources = [str(self.lib), str(self.main)]
+        for jobs in [1, 2]:
+            tus.clear()
+            alive_at_parse.clear()
+            result = analyze_project(sources, self.config, parse, self.logger, jobs=jobs)
+            assert result is False
+            # Every AST is disposed of once its call graph is extracted
+            assert all(tu() is None for tu in tus)
+            assert max(alive_at_parse) < jobs
+
+
+class TestHeaderSummaries(unittest.TestCase):
+    def test_reuse(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir)
+            (root / "header.h").write_text(
+                textwrap.dedent(
+                    """\
+                    #define COLOR(X) [[clang::annotate(#X)]]
+                    COLOR(BLUE) int ret0();
+                    inline int helper() { return ret0(); }
+            """
+                )
+            )
+            a = root / "a.cpp"
+            a.write_text('#include "header.h"\nint ret0() { return 0; }\n')
+            b = root / "b.cpp"
+            b.write_text(
+                '#include "header.h"\nCOLOR(RED) int main() { return helper(); }\n'
+            )
+            config = Config.from_dict(
+                Path("."),
+                {
+                    "prefix": "",
+                    "colors": ["RED", "BLUE"],
+                    "patterns": ["(:RED)-[:CALLS*]->(:BLUE)"],
+                },
+            )
+            config.logger.setLevel(logging.CRITICAL)
+            logger = logging.Logger("test")
+            logger.setLevel(logging.CRITICAL)
+
+            index = clang.cindex.Index.create()
+            sources = [str(a), str(b)]
+            state = root / "state.json"
+            assert analyze_project(sources, config, index.parse, logger, state)
+
+            tus = ProjectState.load(state).tus
+            usr = "c:@F@helper#"
+            assert tus[normalize_path(str(a))].walked == [usr]
+            assert tus[normalize_path(str(b))].reused == [usr]
+            # Only main -> helper, the body of helper wasn't walked
+            assert len(tus[normalize_path(str(b))].graph.edges) == 1
+
+            # a.cpp doesn't walk helper anymore, so b.cpp has to
+            a.write_text("int ret0() { return 0; }\n")
+            changed = {normalize_path(str(a))}
+            assert analyze_project(sources, config, index.parse, logger, state, changed)
+            tus = ProjectState.load(state).tus
+            assert tus[normalize_path(str(b))].walked == [usr]
+
+
+if __name__ == "__main__":
+    utils.main()
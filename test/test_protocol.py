@@ -0,0 +1,347 @@
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import utils
+
+from rainbow.config import Config
+from rainbow.protocol import (ExecutorConnection, decode, query_frame,
+                              read_frame, serve, supported_encodings,
+                              write_frame)
+
+ROOT = Path(__file__).parent.parent
+EXECUTOR = ROOT / "examples" / "executors" / "spycy_v2.py"
+
+
+def setUpModule():
+    # The example executors import rainbow, which may not be installed
+    path = os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))
+    patch = mock.patch.dict(os.environ, {"PYTHONPATH": path})
+    patch.start()
+    unittest.addModuleCleanup(patch.stop)
+
+
+class TestFrames(unittest.TestCase):
+    def test_roundtrip(self):
+        stream = io.BytesIO()
+        # A line equal to the v1 delimiter is just data
+        write_frame(stream, b"MATCH (a)\n--\nRETURN a")
+        write_frame(stream, b"")
+        stream.seek(0)
+        assert read_frame(stream) == b"MATCH (a)\n--\nRETURN a"
+        assert read_frame(stream) == b""
+        assert read_frame(stream) is None
+
+    def test_streamed_query(self):
+        chunks = ["CREATE (a {name: 'caf\u00e9'})", ",\n  ", '(b {name: "\\"})']
+        for encoding in supported_encodings():
+            for limit in [None, 3]:
+                stream = io.BytesIO(
+                    b"".join(query_frame(7, lambda: iter(chunks), limit, encoding))
+                )
+                expected = {"type": "query", "id": 7, "query": "".join(chunks)}
+                if limit is not None:
+                    expected["limit"] = limit
+                assert decode(read_frame(stream), encoding) == expected
+                assert read_frame(stream) is None
+
+
+class TestServe(unittest.TestCase):
+    def test_pipelined(self):
+        def execute(query):
+            if query == "create":
+                return None
+            if query == "fail":
+                raise Exception("failed")
+            return ({"n": i} for i in range(int(query)))
+
+        # Run both sides of the connection against in-memory streams: first
+        # record what rainbow sends, then replay the executor's answers.
+        requests = io.BytesIO()
+        client = ExecutorConnection(requests, io.BytesIO())
+        client.submit(["create", "fail", "1000"], limit=300)
+        client._writer_thread.join()
+
+        handshake = io.BytesIO()
+        hello = {"type": "hello", "protocol": 2, "encodings": ["json"]}
+        write_frame(handshake, json.dumps(hello).encode())
+
+        responses = io.BytesIO()
+        serve(
+            execute, io.BytesIO(handshake.getvalue() + requests.getvalue()), responses
+        )
+        responses.seek(0)
+        assert read_frame(responses) is not None  # hello
+
+        client.reader = responses
+        assert client.next_result("create") is None
+        assert client.next_result("fail") is None
+        assert client.errors == ["failed"]
+        rows = client.next_result("1000")
+        assert list(rows) == [{"n": i} for i in range(300)]
+
+    def test_streamed_rows(self):
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, "rb") as reader, open(write_fd, "wb") as writer:
+            client = ExecutorConnection(io.BytesIO(), reader)
+            client.submit(["first", "second"])
+            client._writer_thread.join()
+
+            def send(message):
+                write_frame(writer, json.dumps(message).encode())
+                writer.flush()
+
+            # Rows are handed out before the executor finished the query
+            send({"type": "rows", "id": 0, "rows": [{"n": 0}]})
+            rows = client.next_result("first")
+            assert next(rows) == {"n": 0}
+            send({"type": "rows", "id": 0, "rows": [{"n": 1}]})
+            assert next(rows) == {"n": 1}
+            assert client.outstanding() == 2
+
+            # An error after some rows fails the result, and the rest of a
+            # result nobody reads is skipped
+            send({"type": "error", "id": 0, "message": "failed"})
+            send({"type": "rows", "id": 1, "rows": [{"n": 2}, {"n": 3}]})
+            send({"type": "done", "id": 1})
+            assert list(rows) == [] and rows.failed
+            rows = client.next_result("second")
+            assert next(rows) == {"n": 2}
+            assert client.outstanding() == 1
+            assert list(rows) == [{"n": 3}] and not rows.failed
+            assert client.outstanding() == 0
+            assert client.errors == ["failed"]
+
+
+class TestExecutor(unittest.TestCase):
+    def test_v2_executor(self):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(BLUE) int ret1() { return 1; }
+                COLOR(RED) int main() { return ret0() + ret1(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": [
+                    "(:BLUE)-->(:RED)",
+                    {
+                        "pattern": "(a:RED)-->(b:BLUE)",
+                        "on_match": {"caller": "a.name", "callee": "b.name"},
+                        "msg": "%caller calls %callee",
+                    },
+                ],
+                "executor": str(EXECUTOR),
+                "executor_protocol": 2,
+                "executor_row_limit": 1,
+            },
+        )
+        sut.config.logger = logging.getLogger("rainbow.test.protocol")
+        with self.assertLogs("rainbow.test.protocol", logging.ERROR) as logs:
+            assert sut.run()
+        # Only one of the two calls was returned
+        assert len(logs.output) == 1
+
+
+class TestAsyncExecutor(unittest.TestCase):
+    def create_rainbow(self, config):
+        src = textwrap.dedent(
+            """\
+                #define COLOR(X) [[clang::annotate(#X)]]
+                COLOR(BLUE) int ret0() { return 0; }
+                COLOR(RED) int main() { return ret0(); }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(Path("."), config)
+        sut.config.logger.setLevel(logging.CRITICAL)
+        return sut
+
+    def test_concurrency(self):
+        sut = self.create_rainbow(
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": [
+                    "(:BLUE)-->(:RED)",
+                    "(:RED)-->(:RED)",
+                    "(:RED)-->(:BLUE)",
+                ],
+                "executor": str(EXECUTOR),
+                "executor_protocol": 2,
+                "executor_concurrency": 2,
+            }
+        )
+        assert sut.run()
+
+    def test_timeout(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executor = Path(tmpdir) / "slow.sh"
+            # Answers the CREATE query, then hangs
+            executor.write_text(
+                textwrap.dedent(
+                    """\
+                    #!/bin/bash
+                    answered=0
+                    while read line; do
+                      if [ "$line" == "--" ]; then
+                        if [ $answered == 1 ]; then sleep 30; fi
+                        echo "null"
+                        answered=1
+                      fi
+                    done
+            """
+                )
+            )
+            executor.chmod(0o755)
+            sut = self.create_rainbow(
+                {
+                    "prefix": "",
+                    "colors": ["RED", "BLUE"],
+                    "patterns": ["(:RED)-->(:BLUE)", "(:BLUE)-->(:RED)"],
+                    "executor": str(executor),
+                    "executor_timeout": 0.5,
+                }
+            )
+            start = time.time()
+            assert sut.run() is None
+            assert time.time() - start < 10
+
+    def test_duplicate_queries(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executor = Path(tmpdir) / "slow.sh"
+            # Answers the CREATE query, then hangs
+            executor.write_text(
+                textwrap.dedent(
+                    """\
+                    #!/bin/bash
+                    answered=0
+                    while read line; do
+                      if [ "$line" == "--" ]; then
+                        if [ $answered == 1 ]; then sleep 30; fi
+                        echo "null"
+                        answered=1
+                      fi
+                    done
+            """
+                )
+            )
+            executor.chmod(0o755)
+            # Both patterns send the same query, only the first has a timeout
+            pattern = {"pattern": "(a:RED)-->(:BLUE)", "msg": "found"}
+            sut = self.create_rainbow(
+                {
+                    "prefix": "",
+                    "colors": ["RED", "BLUE"],
+                    "patterns": [dict(pattern, timeout=0.5), pattern],
+                    "executor": str(executor),
+                }
+            )
+            start = time.time()
+            assert sut.run() is None
+            assert time.time() - start < 10
+
+    def test_crash(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executor = Path(tmpdir) / "crash.sh"
+            # Answers the CREATE query, then exits without answering
+            executor.write_text(
+                textwrap.dedent(
+                    """\
+                    #!/bin/bash
+                    while read line; do
+                      if [ "$line" == "--" ]; then
+                        echo "null"
+                        break
+                      fi
+                    done
+                    while read line; do
+                      if [ "$line" == "--" ]; then exit 1; fi
+                    done
+            """
+                )
+            )
+            executor.chmod(0o755)
+            # A timeout makes a single executor go through run_queries too
+            for options in [{"executor_timeout": 30}, {"executor_concurrency": 2}]:
+                sut = self.create_rainbow(
+                    {
+                        "prefix": "",
+                        "colors": ["RED", "BLUE"],
+                        "patterns": ["(:RED)-->(:BLUE)", "(:BLUE)-->(:RED)"],
+                        "executor": str(executor),
+                        **options,
+                    }
+                )
+                assert sut.run() is None
+
+    def test_long_result(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executor = Path(tmpdir) / "long.py"
+            # Answers every query but CREATE with a result line of ~200 KB
+            executor.write_text(
+                textwrap.dedent(
+                    f"""\
+                    #!{sys.executable}
+                    import json, sys
+                    created = False
+                    for line in sys.stdin:
+                        if line.strip() != "--":
+                            continue
+                        if created:
+                            row = {{"invalidcalls": True, "pad": "x" * 200000}}
+                            print(json.dumps([row]), flush=True)
+                        else:
+                            print("null", flush=True)
+                            created = True
+            """
+                )
+            )
+            executor.chmod(0o755)
+            for options in [{}, {"executor_timeout": 30}]:
+                sut = self.create_rainbow(
+                    {
+                        "prefix": "",
+                        "colors": ["RED", "BLUE"],
+                        "patterns": ["(:RED)-->(:BLUE)"],
+                        "executor": str(executor),
+                        **options,
+                    }
+                )
+                assert sut.run()
+
+    def test_failed_start(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executor = Path(tmpdir) / "exit.sh"
+            # Exits before answering the handshake
+            executor.write_text("#!/bin/bash\nexit 0\n")
+            executor.chmod(0o755)
+            sut = self.create_rainbow(
+                {
+                    "prefix": "",
+                    "colors": ["RED", "BLUE"],
+                    "patterns": ["(:RED)-->(:BLUE)"],
+                    "executor": str(executor),
+                    "executor_protocol": 2,
+                    "executor_concurrency": 2,
+                }
+            )
+            assert sut.run() is None
+
+
+if __name__ == "__main__":
+    utils.main()
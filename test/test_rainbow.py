@@ -1,11 +1,14 @@
 import textwrap
 import unittest
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import clang.cindex
 import utils
 from spycy import spycy
 
+from rainbow.config import Config
+
 
 class UnitTestRainbow(unittest.TestCase):
     def test_is_function(self):
@@ -40,6 +43,52 @@ class UnitTestRainbow(unittest.TestCase):
         with self.assertRaisesRegex(Exception, ".*unknown color.*"):
             sut.process()
 
+    def test_longest_prefix(self):
+        src = textwrap.dedent(
+            """\
+                [[clang::annotate("COLOR::LOCKING::HELD")]] int lock() { return 0; }
+                [[clang::annotate("COLOR::RED")]] int main() { return lock(); }
+        """
+        )
+        sut = utils.createRainbow(src, "COLOR::", ["RED"], [])
+        sut.extra_configs.append(
+            Config.from_dict(
+                Path("."),
+                {"prefix": "COLOR::LOCKING::", "colors": ["HELD"], "patterns": []},
+            )
+        )
+        scope = sut.process()
+        assert scope.functions["main"].color == "RED"
+        assert scope.functions["lock"].color is None
+        assert scope.functions["lock"].labels == {"COLOR::LOCKING::": "HELD"}
+
+    def test_is_assignment(self):
+        src = textwrap.dedent(
+            """\
+                int main() {
+                    int x = 0, y = 1;
+                    x = y;
+                    x == y;
+                    (x) = /* = */ y;
+                    x <= y;
+                    return x;
+                }
+        """
+        )
+        sut = utils.createRainbow(src, "", [], [])
+
+        def binary_operators(node):
+            if node.kind == clang.cindex.CursorKind.BINARY_OPERATOR:
+                yield node
+            for c in node.get_children():
+                yield from binary_operators(c)
+
+        results = [
+            sut.is_assignment(node, node.kind) is not None
+            for node in binary_operators(sut.tu.cursor)
+        ]
+        assert results == [True, False, True, False]
+
 
 if __name__ == "__main__":
     utils.main()
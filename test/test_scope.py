@@ -94,6 +94,22 @@ class UnitTestScope(unittest.TestCase):
         assert fn1.params["param0"].is_param == True
         assert fn1.resolve_function("param0") is fn1.params["param0"]
 
+    def test_lazy_parameters(self):
+        root = Scope.create_root()
+        Scope.create_function(1, root, "param1", None, {})
+        fn1 = Scope.create_function(
+            2, root, "fn1", None, {"param0": "RED", "param1": None}, callable_params=[]
+        )
+
+        # Colored parameters always get a Scope
+        assert list(fn1.params) == ["param0"]
+        # Parameters without one still shadow outer functions
+        assert fn1.resolve_function("param1") is None
+
+        param1 = fn1.get_param("param1")
+        assert param1.is_param
+        assert fn1.resolve_function("param1") is param1
+
 
 class TestScopeToCypher(unittest.TestCase):
     """Test generating openCypher queries from Scope"""
@@ -343,6 +359,37 @@ class TestRainbowScopeConstruction(unittest.TestCase):
         # Second call is to the shadowing lambda
         assert main_fn.called_functions[1] is main_fn.functions["ret0"]
 
+    def test_callable_parameters(self):
+        src = textwrap.dedent(
+            """\
+            #include <functional>
+            #include <string>
+            #define COLOR(X) [[clang::annotate(#X)]]
+            struct Callable { int operator()() { return 0; } };
+            struct Derived : Callable {};
+            struct Plain { int x; };
+            int fn(
+                int a,
+                const char* b,
+                std::string c,
+                Plain d,
+                COLOR(RED) int e,
+                int (*f)(),
+                std::function<int()> g,
+                const Derived& h
+            ) {
+                auto generic = [](auto i) { return i(); };
+                return 0;
+            }
+        """
+        )
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        scope = sut.process()
+        fn = scope.functions["fn"]
+        assert list(fn.params_to_colors) == list("abcdefgh")
+        assert sorted(fn.params) == list("efgh")
+        assert list(fn.functions["generic"].params) == ["i"]
+
     def test_call_function_by_a_different_name(self):
         src = textwrap.dedent(
             """\
@@ -0,0 +1,209 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+import clang.cindex
+import utils
+
+from rainbow.config import Config, Pattern
+from rainbow.executors import SpycyExecutor, find_executor
+from rainbow.graph import Graph
+from rainbow.rainbow import Rainbow
+from rainbow.scope import Scope
+from rainbow.sqlite_executor import SQLiteExecutor
+
+ROOT = Path(__file__).parent.parent
+CHAIN = "[n in nodes(p) | n.name + ([l in labels(n) | ':' + l] + [''])[0]]"
+
+
+class TestSQLiteExecutor(unittest.TestCase):
+    def create_graph(self) -> Graph:
+        """
+        red -> purple -> blue
+        red -> mid -> blue <- green
+        yellow -> mid
+        """
+        root = Scope.create_root()
+        fns = {}
+        for i, (name, color) in enumerate(
+            [
+                ("red", "RED"),
+                ("purple", "PURPLE"),
+                ("mid", None),
+                ("blue", "BLUE"),
+                ("green", "GREEN"),
+                ("yellow", "YELLOW"),
+            ]
+        ):
+            fns[name] = Scope.create_function(i, root, name, color, {})
+        for src, dst in [
+            ("red", "purple"),
+            ("purple", "blue"),
+            ("red", "mid"),
+            ("mid", "blue"),
+            ("green", "blue"),
+            ("yellow", "mid"),
+        ]:
+            fns[src].register_call_scope(fns[dst])
+        return Graph.from_scope(root)
+
+    def create_cycle(self) -> Graph:
+        """
+        red <-> mid -> blue
+        """
+        root = Scope.create_root()
+        fns = {}
+        for i, (name, color) in enumerate(
+            [("red", "RED"), ("mid", None), ("blue", "BLUE")]
+        ):
+            fns[name] = Scope.create_function(i, root, name, color, {})
+        for src, dst in [("red", "mid"), ("mid", "red"), ("mid", "blue")]:
+            fns[src].register_call_scope(fns[dst])
+        return Graph.from_scope(root)
+
+    def assert_matches_spycy(self, graph: Graph, patterns):
+        config = Config.from_dict(Path("."), {"colors": [], "patterns": []})
+        spycy = SpycyExecutor(config, {})
+        spycy.load(graph)
+        sqlite = SQLiteExecutor(config, {})
+        sqlite.load(graph)
+        for pattern in patterns:
+            expected = spycy.run_pattern(pattern)
+            actual = sqlite.run_pattern(pattern)
+            key = lambda row: repr(sorted(row.items()))
+            assert sorted(actual, key=key) == sorted(expected, key=key), pattern
+        sqlite.close()
+
+    def test_matches_spycy(self):
+        config = Config.from_dict(Path("."), {"colors": [], "patterns": []})
+        graph = self.create_graph()
+        sqlite = SQLiteExecutor(config, {})
+        sqlite.load(graph)
+
+        patterns = [
+            Pattern("(:RED)-[:CALLS*]->(:BLUE)"),
+            Pattern("(:BLUE)-[:CALLS*]->(:RED)"),
+            Pattern("(:GREEN)-->(:BLUE)"),
+            Pattern("(:RED)-->()-->(:BLUE)"),
+            Pattern("(:RED)-[:OTHER]->()"),
+            Pattern("(:YELLOW)<--()"),
+            Pattern(
+                "p = (:RED)-[:CALLS*]->(:BLUE)"
+                + " WHERE NOT any(n in nodes(p) WHERE n:PURPLE)"
+            ),
+            Pattern(
+                "p = (:YELLOW)-[*]->(:BLUE)"
+                + " WHERE NOT any(n in nodes(p) WHERE n:PURPLE)"
+            ),
+            Pattern("(x)-->(:BLUE) WHERE NOT (x:RED OR x:PURPLE)"),
+            Pattern("(x:RED)-->(y) WHERE NOT (y)-->(:BLUE)"),
+            Pattern("(a:RED)-->(x) WHERE NOT x:PURPLE", {"a": "a.name", "x": "x.name"}),
+            Pattern("(a {name: 'green'})-->(b)", {"b": "b.name"}),
+            Pattern(
+                "p = (:RED)-[:CALLS*]->(:BLUE)"
+                + " WHERE NOT any(n in nodes(p) WHERE n:PURPLE)",
+                {"chain": CHAIN},
+            ),
+            Pattern(
+                "p = (:RED)-[:CALLS*]->(:BLUE)", {"chain": "[n IN nodes(p) | n.name]"}
+            ),
+            Pattern("p = (:BLUE)<-[*]-()<--(:YELLOW)", {"chain": CHAIN}),
+            Pattern("(:RED)-[*]->(m)-[*]->(:BLUE)", {"m": "m.name"}),
+        ]
+        self.assert_matches_spycy(graph, patterns)
+
+        # Nodes are reported by name
+        pattern = Pattern("(a:YELLOW)-->(b)-->(c)", error_msg="%a %b %c")
+        assert sqlite.run_pattern(pattern) == [{"a": "yellow", "b": "mid", "c": "blue"}]
+        sqlite.close()
+
+    def test_edge_uniqueness(self):
+        # No edge is used twice by one match, even across relationships
+        patterns = [
+            Pattern("(a)-[*]->(b)-[*]->(c)", {"a": "a.name", "c": "c.name"}),
+            Pattern("(a)-->(b)-[*]->(c)", {"b": "b.name", "c": "c.name"}),
+            Pattern("(a)-->(b)-->(c)-[*]->(d)", {"a": "a.name", "d": "d.name"}),
+            Pattern("p = (:RED)-[*]->(:BLUE)", {"chain": CHAIN}),
+        ]
+        self.assert_matches_spycy(self.create_cycle(), patterns)
+
+    def test_unsupported(self):
+        config = Config.from_dict(Path("."), {"colors": [], "patterns": []})
+        sqlite = find_executor("sqlite")(config, {})
+        sqlite.load(self.create_graph())
+        assert sqlite.run_pattern(Pattern("(a)-[r]->(b) WHERE a.x = 1")) is None
+        assert sqlite.query("MATCH (n) RETURN n") is None
+
+    def test_end2end(self):
+        src = """\
+            #define COLOR(X) [[clang::annotate(#X)]]
+            COLOR(BLUE) int ret0() { return 0; }
+            int indirect() { return ret0(); }
+            COLOR(RED) int main() { return indirect(); }
+        """
+        sut = utils.createRainbow(
+            src, "", ["RED", "BLUE"], ["(:RED)-[:CALLS*]->(:BLUE)"]
+        )
+        sut.config.executor_plugin = SQLiteExecutor
+        assert sut.run()
+
+    def test_component_workers(self):
+        # Every part gets its own database file
+        src = """
+            #define COLOR(X) [[clang::annotate(#X)]]
+            COLOR(BLUE) int ret0() { return 0; }
+            COLOR(RED) int a() { return ret0(); }
+            COLOR(BLUE) int ret1() { return 0; }
+            COLOR(RED) int b() { return ret1(); }
+        """
+        sut = utils.createRainbow(src, "", ["RED", "BLUE"], [])
+        sut.config = Config.from_dict(
+            Path("."),
+            {
+                "prefix": "",
+                "colors": ["RED", "BLUE"],
+                "patterns": [
+                    {
+                        "pattern": "(x:RED)-->(:BLUE)",
+                        "on_match": {"caller": "x.name"},
+                        "msg": "%caller",
+                    }
+                ],
+                "component_workers": 2,
+            },
+        )
+        sut.config.executor_plugin = SQLiteExecutor
+        sut.config.logger = logging.getLogger("rainbow.test.sqlite_components")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "graph.db"
+            sut.config.executor_options = {"path": str(path)}
+            for _ in range(5):
+                with self.assertLogs(sut.config.logger, logging.ERROR) as logs:
+                    assert sut.run()
+                assert sorted(r.getMessage() for r in logs.records) == ["a", "b"]
+            assert sorted(p.name for p in Path(tmpdir).iterdir()) == [
+                "graph.db.0",
+                "graph.db.1",
+            ]
+
+    def test_example(self):
+        # examples/full reports the chains it finds, both executors agree
+        index = clang.cindex.Index.create()
+        tu = index.parse(str(ROOT / "examples/full/test.cpp"))
+        logger = logging.getLogger("rainbow.test.example")
+        messages = []
+        for executor in [SpycyExecutor, SQLiteExecutor]:
+            config = Config.from_json(ROOT / "examples/full/config.json", logger)
+            config.executor_plugin = executor
+            sut = Rainbow(tu, config)
+            sut.logger.setLevel(logging.CRITICAL)
+            with self.assertLogs(logger, logging.WARNING) as logs:
+                assert sut.run()
+            messages.append(sorted(logs.output))
+        assert messages[0] == messages[1]
+        assert not any("unknown" in message for message in messages[1])
+
+
+if __name__ == "__main__":
+    utils.main()
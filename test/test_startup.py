@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from typing import Dict
+
+import utils
+
+ROOT = Path(__file__).parent.parent
+
+# Backends that must only be imported once they are used
+LAZY_MODULES = ["spycy", "pandas", "asyncio", "sqlite3", "msgpack"]
+
+
+class TestStartup(unittest.TestCase):
+    def import_times(self, code: str) -> Dict[str, int]:
+        """Cumulative import time in microseconds of every module imported by
+        `code`, from `python -X importtime`"""
+        env = dict(os.environ, PYTHONPATH=str(ROOT))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            env=env,
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+        return times
+
+    def test_lazy_backends(self):
+        times = self.import_times("import rainbow.rainbow")
+        assert "rainbow.rainbow" in times
+        for module in LAZY_MODULES:
+            assert module not in times, f"{module} is imported at startup"
+
+        # Loading a config that uses an external executor doesn't need them
+        # either
+        code = "\n".join(
+            [
+                "from pathlib import Path",
+                "from rainbow.config import Config",
+                "Config.from_json(Path('examples/full/config_echo.json'))",
+            ]
+        )
+        times = self.import_times(code)
+        for module in LAZY_MODULES:
+            assert module not in times, f"{module} is imported by Config"
+
+
+if __name__ == "__main__":
+    utils.main()
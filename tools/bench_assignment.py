@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import clang.cindex
+import click
+
+from rainbow.config import Config
+from rainbow.rainbow import Rainbow
+
+OPERATORS = ["=", "+", "-", "*", "==", "<", "+=", "<<", "&&"]
+
+
+def generate_source(n_functions: int, n_statements: int) -> str:
+    """A source file dominated by arithmetic and assignments"""
+    rng = random.Random(0)
+    lines = []
+    for i in range(n_functions):
+        lines.append(f"int fn{i}(int a, int b, int c) {{")
+        for _ in range(n_statements):
+            lhs = rng.choice("abc")
+            op = rng.choice(OPERATORS)
+            lines.append(f"  {lhs} {op} (a * {rng.randint(1, 9)} + b) - (c << 1) * a;")
+        lines.append("  return a + b + c;")
+        lines.append("}")
+    return "\n".join(lines)
+
+
+def binary_operators(node: clang.cindex.Cursor) -> Iterator[clang.cindex.Cursor]:
+    if node.kind == clang.cindex.CursorKind.BINARY_OPERATOR:
+        yield node
+    for c in node.get_children():
+        yield from binary_operators(c)
+
+
+@click.command(help="Benchmark assignment detection on expression-dense code")
+@click.option("-c", "--clangLocation", type=Path, help="Path to libclang.so")
+@click.option("--functions", default=200, help="Number of functions to generate")
+@click.option("--statements", default=50, help="Statements per function")
+def main(clanglocation: Optional[Path], functions: int, statements: int):
+    if clanglocation:
+        clang.cindex.Config.set_library_file(clanglocation)
+
+    with tempfile.NamedTemporaryFile(suffix=".cpp") as f:
+        f.write(generate_source(functions, statements).encode())
+        f.flush()
+        tu = clang.cindex.Index.create().parse(f.name)
+        rainbow = Rainbow(tu, Config(Path("."), [], [], ""))
+        nodes = list(binary_operators(tu.cursor))
+        print(f"{len(nodes)} binary operators")
+
+        start = time.perf_counter()
+        expected = [
+            rainbow._operator_spelling_from_tokens(n, next(n.get_children())) == "="
+            for n in nodes
+        ]
+        tokens_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = [rainbow.is_assignment(n, n.kind) is not None for n in nodes]
+        time_ = time.perf_counter() - start
+
+    assert actual == expected
+    print(f"tokens:        {tokens_time:.3f}s")
+    print(f"is_assignment: {time_:.3f}s ({tokens_time / time_:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import clang.cindex
+import click
+
+from rainbow.config import Config
+from rainbow.rainbow import analyze_project
+
+
+def generate_sources(directory: Path, n_files: int, n_functions: int) -> List[str]:
+    """Sources that all include a shared header, and call into each other"""
+    header = directory / "common.h"
+    header.write_text(
+        "#define COLOR(X) [[clang::annotate(#X)]]\n"
+        + "COLOR(BLUE) inline int common(int x) { return x + 1; }\n"
+    )
+    sources = []
+    for i in range(n_files):
+        next_fn = f"file{(i + 1) % n_files}_fn0"
+        lines = ['#include "common.h"', f"int {next_fn}(int x);"]
+        for j in range(n_functions):
+            callee = next_fn if j == 0 else f"file{i}_fn{j - 1}"
+            lines.append(
+                f"int file{i}_fn{j}(int x) {{ return {callee}(x) + common(x); }}"
+            )
+        source = directory / f"file{i}.cpp"
+        source.write_text("\n".join(lines))
+        sources.append(str(source))
+    return sources
+
+
+def rss() -> int:
+    """Resident set size of this process in bytes"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+
+@click.command(help="Measure memory use while analyzing many translation units")
+@click.option("-c", "--clangLocation", type=Path, help="Path to libclang.so")
+@click.option("--files", default=1000, help="Number of sources to generate")
+@click.option("--functions", default=50, help="Functions per source")
+@click.option("-j", "--jobs", default=1, help="Sources analyzed at the same time")
+def main(clanglocation: Optional[Path], files: int, functions: int, jobs: int):
+    if clanglocation:
+        clang.cindex.Config.set_library_file(clanglocation)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sources = generate_sources(Path(tmpdir), files, functions)
+        config = Config.from_dict(
+            Path("."),
+            {
+                "colors": ["RED", "BLUE"],
+                "patterns": ["(:RED)-->(:BLUE)"],
+                # Loading a large graph into spycy would dominate the run
+                "executor_plugin": "sqlite",
+            },
+        )
+        index = clang.cindex.Index.create()
+        samples = []
+
+        def parse(path: str) -> clang.cindex.TranslationUnit:
+            if len(samples) % (files // 10 or 1) == 0:
+                samples.append(rss())
+            else:
+                samples.append(samples[-1])
+            return index.parse(path)
+
+        start = time.perf_counter()
+        analyze_project(sources, config, parse, logging.getLogger("bench"), jobs=jobs)
+        time_ = time.perf_counter() - start
+
+    for i in range(0, len(samples), files // 10 or 1):
+        print(f"after {i:5} files: {samples[i] / 2**20:7.1f} MiB")
+    print(f"final:             {rss() / 2**20:7.1f} MiB")
+    print(f"{time_:.1f}s")
+
+
+if __name__ == "__main__":
+    main()